@@ -0,0 +1,109 @@
+from __future__ import print_function
+
+# Compares archive formats & compression levels on real update
+# archives or build output dirs.
+#
+# Usage: python dev/archive_benchmark.py <archive or dir> [...]
+#
+# Reports the compressed size, ratio to the uncompressed tar, the time
+# it takes the builder to compress & the time it takes a client to
+# read the archive with the same code used when extracting updates.
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+
+from pyupdater import settings
+from pyupdater.utils import (compress_archive,
+                             get_archive_format,
+                             open_tar,
+                             _make_tar,
+                             _lzma)
+from pyupdater.utils.exceptions import UtilsError
+
+LEVELS = [
+    (u'gztar', [1, 6, 9]),
+    (u'bztar', [1, 9]),
+    (u'xztar', [0, 6, 9]),
+    ]
+
+
+def read_payload(path):
+    # Returns the uncompressed tar of an archive or dir
+    if os.path.isdir(path):
+        name = os.path.basename(os.path.abspath(path))
+        return _make_tar(path, name, settings.ARCHIVE_MTIME)
+    archive_format = get_archive_format(path)
+    if archive_format == u'gztar':
+        import gzip
+        f = gzip.open(path, u'rb')
+    elif archive_format == u'bztar':
+        import bz2
+        f = bz2.BZ2File(path, u'rb')
+    elif archive_format == u'xztar':
+        f = _lzma().LZMAFile(path, u'rb')
+    else:
+        sys.exit(u'Not a tar archive or dir: {}'.format(path))
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def read_archive(path):
+    # Reads every member like a client extracting an update
+    with open_tar(path) as tar:
+        for m in tar:
+            if m.isfile():
+                tar.extractfile(m).read()
+
+
+def bench(path, temp_dir):
+    payload = read_payload(path)
+    print(u'\n{} - {:,} bytes uncompressed'.format(path, len(payload)))
+    print(u'{:<8}{:>6}{:>16}{:>8}{:>12}{:>14}'.format(u'format', u'level',
+                                                      u'size', u'ratio',
+                                                      u'compress',
+                                                      u'decompress'))
+    for archive_format, levels in LEVELS:
+        ext = settings.ARCHIVE_FORMATS[archive_format]
+        for level in levels:
+            start = time.time()
+            try:
+                data = compress_archive(payload, archive_format, level)
+            except UtilsError as err:
+                print(u'{:<8}{:>6}  {}'.format(archive_format, level, err))
+                break
+            compress_time = time.time() - start
+
+            filename = os.path.join(temp_dir, u'bench' + ext)
+            with open(filename, u'wb') as f:
+                f.write(data)
+            start = time.time()
+            read_archive(filename)
+            decompress_time = time.time() - start
+
+            print(u'{:<8}{:>6}{:>16,}{:>8.3f}{:>11.2f} s{:>11.2f} s'.format(
+                archive_format, level, len(data),
+                float(len(data)) / max(len(payload), 1),
+                compress_time, decompress_time))
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit(u'Usage: archive_benchmark.py <archive or dir> [...]')
+    temp_dir = tempfile.mkdtemp()
+    try:
+        for path in sys.argv[1:]:
+            try:
+                bench(path, temp_dir)
+            except (IOError, tarfile.TarError) as err:
+                print(u'Could not read {}: {}'.format(path, err))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
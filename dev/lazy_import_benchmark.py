@@ -0,0 +1,56 @@
+from __future__ import print_function
+
+# Measures the cost of attribute access through a lazy_import proxy.
+#
+# Usage: python dev/lazy_import_benchmark.py [loops]
+#
+# Compares the module itself, the global lazy_import rebinds after the
+# first use & a reference to the proxy taken before it, like one kept
+# by another module with "from pyupdater.utils import os".
+import sys
+import timeit
+
+from pyupdater.utils import lazy_import
+
+
+@lazy_import
+def os():
+    import os
+    return os
+
+
+def main():
+    loops = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    proxy = globals()['os']
+    start = timeit.default_timer()
+    proxy.path
+    print(u'First access (imports): {:.1f} us'.format(
+        (timeit.default_timer() - start) * 1000000))
+
+    import os as module
+    tests = [
+        (u'module', module),
+        (u'rebound global', globals()['os']),
+        (u'proxy reference', proxy),
+        ]
+    print(u'{:<18}{:>12}'.format(u'access', u'ns / attr'))
+    for name, obj in tests:
+        t = best_time(obj, loops)
+        print(u'{:<18}{:>12.1f}'.format(name, t / loops * 1e9))
+
+
+def best_time(obj, loops):
+    # Best of 3 runs of loops attribute lookups
+    best = None
+    for _ in range(3):
+        start = timeit.default_timer()
+        for _ in range(loops):
+            obj.path
+        elapsed = timeit.default_timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+from __future__ import print_function
+
+# Measures what the client costs a frozen app at launch.
+#
+# Usage: python dev/startup_benchmark.py [runs] [history file]
+#
+# Each run is a new interpreter that imports pyupdater.client & sets up
+# a Client without refreshing. The medians are appended to the history
+# file, startup-history.jsonl by default, with the git revision & python
+# version so changes can be tracked over time.
+import json
+import os
+import subprocess
+import sys
+import time
+
+RUN = """
+import json, tempfile, time
+start = time.time()
+from pyupdater.client import Client
+imported = time.time()
+
+
+class Config(object):
+    APP_NAME = 'Benchmark'
+    COMPANY_NAME = 'PyUpdater'
+    DATA_DIR = tempfile.mkdtemp()
+    PUBLIC_KEYS = ['iBFNlFxQZ17n3SakBmF2fI6dZhrbkdf5GtP9m/wVrTQ']
+    UPDATE_URLS = ['https://example.com/updates']
+
+Client(Config(), test=True)
+done = time.time()
+print(json.dumps({'import': imported - start, 'init': done - imported}))
+"""
+
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2 == 1:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+def run_once():
+    start = time.time()
+    out = subprocess.check_output([sys.executable, u'-c', RUN])
+    total = time.time() - start
+    data = json.loads(out.decode(u'utf-8').strip().splitlines()[-1])
+    data[u'process'] = total
+    return data
+
+
+def git_revision():
+    try:
+        out = subprocess.check_output([u'git', u'rev-parse', u'--short',
+                                       u'HEAD'])
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.decode(u'utf-8').strip()
+
+
+def load_last(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, u'r') as f:
+        lines = [l for l in f.read().splitlines() if l.strip()]
+    if len(lines) == 0:
+        return None
+    return json.loads(lines[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    history = sys.argv[2] if len(sys.argv) > 2 else u'startup-history.jsonl'
+    results = [run_once() for _ in range(runs)]
+    record = {
+        u'date': time.strftime(u'%Y-%m-%dT%H:%M:%S'),
+        u'revision': git_revision(),
+        u'python': sys.version.split()[0],
+        u'runs': runs,
+        }
+    for key in [u'import', u'init', u'process']:
+        record[key] = median([r[key] for r in results])
+
+    last = load_last(history)
+    print(u'{:<10}{:>12}{:>12}'.format(u'median', u'ms', u'last ms'))
+    for key in [u'import', u'init', u'process']:
+        previous = u''
+        if last is not None and key in last:
+            previous = u'{:.1f}'.format(last[key] * 1000)
+        print(u'{:<10}{:>12.1f}{:>12}'.format(key, record[key] * 1000,
+                                              previous))
+    with open(history, u'a') as f:
+        f.write(json.dumps(record, sort_keys=True) + u'\n')
+
+
+if __name__ == '__main__':
+    main()
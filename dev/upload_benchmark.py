@@ -0,0 +1,77 @@
+from __future__ import print_function
+
+# Measures upload throughput offline with the local uploader.
+#
+# Usage: python dev/upload_benchmark.py [files] [size in KB] [latency ms]
+#
+# Creates a deploy dir of random files & publishes it to a temp dir
+# with different worker counts. Latency is added to every file to stand
+# in for a remote service.
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from pyupdater.uploader.plugins import LocalUploader
+
+WORKERS = [1, 2, 4, 8, 16]
+
+
+class SlowUploader(LocalUploader):
+    latency = 0
+
+    def upload_file(self, filename):
+        time.sleep(self.latency)
+        return super(SlowUploader, self).upload_file(filename)
+
+
+def make_deploy_dir(path, count, size):
+    files = []
+    for i in range(count):
+        filename = u'file-{}'.format(i)
+        with open(os.path.join(path, filename), u'wb') as f:
+            f.write(os.urandom(size))
+        files.append(filename)
+    return files
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    size = int(sys.argv[2]) * 1024 if len(sys.argv) > 2 else 256 * 1024
+    latency = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.05
+    temp_dir = tempfile.mkdtemp()
+    try:
+        deploy_dir = os.path.join(temp_dir, u'deploy')
+        os.mkdir(deploy_dir)
+        files = make_deploy_dir(deploy_dir, count, size)
+        print(u'{:,} files of {:,} bytes, {:.0f} ms latency'.format(
+            count, size, latency * 1000))
+        print(u'{:>8}{:>12}{:>14}'.format(u'workers', u'time',
+                                          u'throughput'))
+        for workers in WORKERS:
+            upload_dir = os.path.join(temp_dir, u'upload-{}'.format(workers))
+            uploader = SlowUploader()
+            uploader.latency = latency
+            uploader.init(upload_dir=upload_dir, files=files)
+            uploader.deploy_dir = deploy_dir
+            uploader.upload_workers = workers
+            # Hide per file progress
+            stdout = sys.stdout
+            sys.stdout = open(os.devnull, u'w')
+            try:
+                start = time.time()
+                uploader.upload()
+                elapsed = time.time() - start
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            print(u'{:>8}{:>10.2f} s{:>9.1f} MB/s'.format(
+                workers, elapsed,
+                count * size / 1024.0 / 1024 / max(elapsed, 0.001)))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,19 +18,24 @@ from __future__ import unicode_literals
 from pyupdater import settings, __version__
 from pyupdater.client.downloader import FileDownloader
 from pyupdater.client.updates import AppUpdate, LibUpdate
-from pyupdater.utils import (convert_to_list,
+from pyupdater.utils import (atomic_write,
+                             convert_to_list,
                              EasyAccessDict,
                              get_highest_version,
+                             get_key_id,
+                             gzip_compress,
                              gzip_decompress,
                              lazy_import,
                              Version)
 from pyupdater.utils.config import TransistionDict
+from pyupdater.utils.exceptions import UtilsError
+from pyupdater.utils.manifest import BinaryManifest
 
 
 @lazy_import
-def gzip():
-    import gzip
-    return gzip
+def hashlib():
+    import hashlib
+    return hashlib
 
 
 @lazy_import
@@ -80,15 +85,23 @@ def six():
 
 
 log = logging.getLogger(__name__)
+# Importing the client has no side effects. The optional pyu.log next
+# to the app is looked for when the first client is set up.
+_log_file_checked = False
 
-log_path = os.path.join(jms_utils.paths.app_cwd, 'pyu.log')
-if os.path.exists(log_path):  # pragma: no cover
-    ch = logging.FileHandler(os.path.join(jms_utils.paths.app_cwd,
-                             'pyu.log'))
-    ch.setLevel(logging.DEBUG)
-    ch.setFormatter(jms_utils.logger.log_format_string())
-    log.addHandler(ch)
-log.debug('Version {}'.format(__version__))
+
+def _setup_log_file():
+    global _log_file_checked
+    if _log_file_checked is True:
+        return
+    _log_file_checked = True
+    log_path = os.path.join(jms_utils.paths.app_cwd, 'pyu.log')
+    if os.path.exists(log_path):  # pragma: no cover
+        ch = logging.FileHandler(log_path)
+        ch.setLevel(logging.DEBUG)
+        ch.setFormatter(jms_utils.logger.log_format_string())
+        log.addHandler(ch)
+    log.debug('Version {}'.format(__version__))
 
 
 class Client(object):
@@ -138,6 +151,7 @@ class Client(object):
             False: Don't refresh update manifest on object initialization
 
         """
+        _setup_log_file()
         # Used to add missing required information
         # i.e. APP_NAME
         pyi_config = TransistionDict()
@@ -178,16 +192,39 @@ class Client(object):
         # Ensuring only one occurrence of a public key is present
         # Would be a waste to test a bad key twice
         self.public_keys = list(set(self.public_keys))
+        # Signatures carry a key id so we can go straight to the
+        # matching public key instead of trying all of them
+        self.key_ids = dict((get_key_id(pk), pk) for pk in self.public_keys)
+        self._verifying_keys = {}
+        self._verified_cache = None
+        self.verified_cache_file = os.path.join(self.data_dir,
+                                                settings.VERIFIED_CACHE_FILE)
         # Config option to disable tls cert verification
         self.verify = config.get('VERIFY_SERVER_CERT', True)
         self.version_file = settings.VERSION_FILE
-
-        self._setup()
+        self.version_file_sig = settings.VERSION_FILE_SIG
+        # Release channel to get updates from
+        self.channel = config.get('UPDATE_CHANNEL', settings.DEFAULT_CHANNEL)
+        if self.channel not in settings.CHANNELS:
+            log.warning('Unknown update channel "{}". Using '
+                        '"{}"'.format(self.channel, settings.DEFAULT_CHANNEL))
+            self.channel = settings.DEFAULT_CHANNEL
+        self.channel_version_file = \
+            settings.VERSION_FILE_CHANNEL.format(self.channel)
+        self.channel_version_file_sig = \
+            settings.VERSION_FILE_CHANNEL_SIG.format(self.channel)
+        # Config option to use the compact binary version file
+        self.binary_manifest = config.get('BINARY_MANIFEST', False)
+        self.version_file_binary = settings.VERSION_FILE_BINARY
+
+        # Dirs are made when first needed by refresh
+        self._dirs_ready = False
         if refresh is True:
             self.refresh()
 
     def refresh(self):
         "Will download and verify your version file."
+        self._setup()
         self._get_update_manifest()
 
     def update_check(self, name, version):
@@ -241,7 +278,7 @@ class Client(object):
         # If None is returned get_highest_version could
         # not find the supplied name in the version file
         latest = get_highest_version(name, self.platform,
-                                     self.easy_data)
+                                     self.easy_data, self.channel)
         if latest is None:
             log.debug('Could not find the latest version')
             return None
@@ -263,6 +300,7 @@ class Client(object):
             'json_data': self.json_data,
             'data_dir': self.data_dir,
             'platform': self.platform,
+            'channel': self.channel,
             'app_name': self.app_name,
             'verify': self.verify,
             'progress_hooks': self.progress_hooks,
@@ -283,16 +321,18 @@ class Client(object):
     # Here we attempt to read the manifest from the filesystem
     # in case of no Internet connection. Useful for an update
     # needs to be installed without an network connection
-    def _get_manifest_filesystem(self):
+    def _get_manifest_filesystem(self, filename=None, compressed=True):
+        if filename is None:
+            filename = self.version_file
         data = None
         with jms_utils.paths.ChDir(self.data_dir):
-            if not os.path.exists(self.version_file):
+            if not os.path.exists(filename):
                 log.warning('No version file on file system')
                 return data
             else:
                 log.info('Found version file on file system')
                 try:
-                    with open(self.version_file, 'rb') as f:
+                    with open(filename, 'rb') as f:
                         data = f.read()
                     log.info('Loaded version file from file system')
                 except Exception as err:
@@ -300,6 +340,8 @@ class Client(object):
                     log.error('Failed to load version file from file '
                               'system')
                     log.debug(str(err), exc_info=True)
+                if compressed is False:
+                    return data
                 # In case we don't have any data to pass
                 # Catch the error here and just return None
                 try:
@@ -310,43 +352,92 @@ class Client(object):
                 return decompressed_data
 
     # Downloading the manifest. If successful also writes it to file-system
-    def _download_manifest(self):
+    def _download_manifest(self, filename=None, compressed=True):
+        if filename is None:
+            filename = self.version_file
         log.info('Downloading online version file')
         try:
-            fd = FileDownloader(self.version_file, self.update_urls,
+            fd = FileDownloader(filename, self.update_urls,
                                 verify=self.verify)
             data = fd.download_verify_return()
-            try:
-                decompressed_data = gzip_decompress(data)
-            except IOError:
-                log.error('Failed to decompress gzip file')
-                # Will be caught down below. Just logging the error
-                raise
+            if data is None:
+                raise IOError('Failed to download {}'.format(filename))
+            if compressed is True:
+                try:
+                    data = gzip_decompress(data)
+                except IOError:
+                    log.error('Failed to decompress gzip file')
+                    # Will be caught down below. Just logging the error
+                    raise
             log.info('Version file download successful')
             # Writing version file to application data directory
-            self._write_manifest_2_filesystem(decompressed_data)
-            return decompressed_data
+            self._write_manifest_2_filesystem(data, filename, compressed)
+            return data
         except Exception as err:
             log.error('Version file download failed')
             log.debug(str(err), exc_info=True)
             return None
 
-    def _write_manifest_2_filesystem(self, data):
+    def _write_manifest_2_filesystem(self, data, filename=None,
+                                     compressed=True):
+        if filename is None:
+            filename = self.version_file
         with jms_utils.paths.ChDir(self.data_dir):
             log.debug('Writing version file to disk')
-            with gzip.open(self.version_file, 'wb') as f:
-                f.write(data)
+            if compressed is True:
+                data = gzip_compress(data)
+            atomic_write(filename, data)
+
+    def _get_binary_manifest(self):
+        # Downloads, parses & verifies the binary version file.
+        # Returns False so the caller can fall back to the json
+        # version file.
+        log.info('Loading binary version file...')
+        data = self._download_manifest(self.version_file_binary)
+        if data is None:
+            data = self._get_manifest_filesystem(self.version_file_binary)
+        if data is None:
+            return False
+
+        try:
+            manifest = BinaryManifest(data)
+        except UtilsError as err:
+            log.error(str(err))
+            log.debug(str(err), exc_info=True)
+            return False
+
+        self._verify_binary_sig(manifest)
+        if self.verified is False:
+            return False
+        # BinaryManifest supports the same lookups as EasyAccessDict
+        self.json_data = manifest
+        self.easy_data = manifest
+        self.ready = True
+        return True
+
+    def _verify_binary_sig(self, manifest):
+        # Signatures are raw bytes over the exact signed bytes.
+        if self._verify_data(manifest.signed_data, manifest.signatures):
+            log.info('Binary version file verified')
+            self.verified = True
+        else:
+            log.warning('Binary version file not verified')
 
     def _get_update_manifest(self):
         #  Downloads & Verifies version file signature.
+        if self.binary_manifest is True:
+            if self._get_binary_manifest() is True:
+                return
+
         log.info('Loading version file...')
 
-        data = self._download_manifest()
+        # The channel version file only has releases this client
+        # can use. Repos from before channels only have the full one.
+        data, sig_data = self._load_manifest(self.channel_version_file,
+                                             self.channel_version_file_sig)
         if data is None:
-            # Its ok if this is None. If any exceptions are raised
-            # that we can't handle we will just return an empty
-            # dictionary.
-            data = self._get_manifest_filesystem()
+            data, sig_data = self._load_manifest(self.version_file,
+                                                 self.version_file_sig)
 
         try:
             log.debug('Data type: {}'.format(type(data)))
@@ -371,13 +462,52 @@ class Client(object):
         if self.json_data is None:
             self.json_data = {}
 
-        # If verified we set self.verified to True.
-        # We return the data either way
-        self.json_data = self._verify_sig(self.json_data)
+        # Detached signatures are checked against the bytes we
+        # downloaded. Older repos only have embedded signatures
+        # so we fall back to re-serializing the data.
+        if self._verify_detached_sig(data, sig_data) is True:
+            self.json_data.pop('sigs', None)
+        else:
+            # If verified we set self.verified to True.
+            # We return the data either way
+            self.json_data = self._verify_sig(self.json_data)
 
         self.easy_data = EasyAccessDict(self.json_data)
         log.debug('Version Data:\n{}'.format(str(self.easy_data)))
 
+    def _load_manifest(self, filename, sig_filename):
+        # Returns version file & detached signature data
+        data = self._download_manifest(filename)
+        if data is not None:
+            sig_data = self._download_manifest(sig_filename,
+                                               compressed=False)
+        else:
+            # Its ok if this is None. If any exceptions are raised
+            # that we can't handle we will just return an empty
+            # dictionary.
+            data = self._get_manifest_filesystem(filename)
+            sig_data = self._get_manifest_filesystem(sig_filename,
+                                                     compressed=False)
+        return data, sig_data
+
+    def _verify_detached_sig(self, data, sig_data):
+        if data is None or sig_data is None:
+            return False
+        try:
+            signatures = [(s['key_id'], s['sig']) for s in
+                          json.loads(sig_data.decode('utf-8'))]
+        except Exception as err:
+            log.error('Failed to load version file signatures')
+            log.debug(str(err), exc_info=True)
+            return False
+
+        if self._verify_data(data, signatures, encoding='base64'):
+            log.info('Version file verified')
+            self.verified = True
+            return True
+        log.debug('Detached signatures failed to verify')
+        return False
+
     def _verify_sig(self, data):
         # Checking to see if there is a sigs key in the version file.
         if 'sigs' in data.keys():
@@ -389,29 +519,13 @@ class Client(object):
             # into a string to use as data to verify the sig.
             update_data = json.dumps(data, sort_keys=True)
 
-            # Attempting to verify signature of version file by
-            # looping through public keys and testing. If found
-            # will break out of the loop
-            for pk in self.public_keys:
-                log.debug('Public Key: {}'.format(pk))
-                for s in signatures:
-                    log.debug('Signature: {}'.format(s))
-                    # I added this try/except block because sometimes a
-                    # None value in json_data would find its way down here.
-                    # Hopefully i fixed it by return right under the Exception
-                    # block above.  But just in case will leave anyway.
-                    try:
-                        pub_key = ed25519.VerifyingKey(pk, encoding='base64')
-                        pub_key.verify(s, update_data, encoding='base64')
-                    except Exception as err:
-                        log.error(str(err))
-                    else:
-                        log.info('Version file verified')
-                        self.verified = True
-                        break
-                if self.verified is True:
-                    # No longer need to iterate through public keys
-                    break
+            # Embedded signatures have no key id so every public key
+            # may have to be tried
+            signatures = [(None, s) for s in signatures]
+            if self._verify_data(update_data, signatures,
+                                 encoding='base64'):
+                log.info('Version file verified')
+                self.verified = True
             else:
                 # Couldn't verify with any public keys
                 log.warning('Version file not verified')
@@ -421,16 +535,82 @@ class Client(object):
 
         return data
 
+    def _verify_data(self, data, signatures, encoding=None):
+        # Verifies data against a list of (key id, signature) tuples.
+        # A key id of None means try all public keys.
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+
+        # Data we've already verified with the same set of public
+        # keys doesn't need to go through ed25519 again
+        digest = hashlib.sha256(data)
+        for key_id in sorted(self.key_ids.keys()):
+            digest.update(key_id.encode('ascii'))
+        digest = digest.hexdigest()
+        if digest in self._load_verified_cache():
+            log.debug('Signature verification cache hit')
+            return True
+
+        for key_id, sig in signatures:
+            if key_id is None:
+                public_keys = self.public_keys
+            elif key_id in self.key_ids:
+                public_keys = [self.key_ids[key_id]]
+            else:
+                log.debug('Unknown key id: {}'.format(key_id))
+                continue
+            for pk in public_keys:
+                try:
+                    pub_key = self._get_verifying_key(pk)
+                    pub_key.verify(sig, data, encoding=encoding)
+                except Exception as err:
+                    log.debug(str(err))
+                else:
+                    self._save_verified_cache(digest)
+                    return True
+        return False
+
+    def _get_verifying_key(self, public_key):
+        # Parsing public keys once per client
+        if public_key not in self._verifying_keys:
+            self._verifying_keys[public_key] = ed25519.VerifyingKey(
+                public_key, encoding='base64')
+        return self._verifying_keys[public_key]
+
+    def _load_verified_cache(self):
+        if self._verified_cache is None:
+            self._verified_cache = []
+            if os.path.exists(self.verified_cache_file):
+                try:
+                    with open(self.verified_cache_file, 'r') as f:
+                        self._verified_cache = json.loads(f.read())
+                except Exception as err:
+                    log.debug(str(err), exc_info=True)
+        return self._verified_cache
+
+    def _save_verified_cache(self, digest):
+        cache = self._load_verified_cache()
+        cache.append(digest)
+        # Only recent manifests are worth remembering
+        del cache[:-settings.VERIFIED_CACHE_SIZE]
+        try:
+            atomic_write(self.verified_cache_file, json.dumps(cache))
+        except Exception as err:
+            log.debug(str(err), exc_info=True)
+
     def _setup(self):
         # Sets up required directories on end-users computer
         # to place verified update data
         # Very safe director maker :)
+        if self._dirs_ready is True:
+            return
         log.info('Setting up directories...')
         dirs = [self.data_dir, self.update_folder]
         for d in dirs:
             if not os.path.exists(d):
                 log.info('Creating directory: {}'.format(d))
                 os.makedirs(d)
+        self._dirs_ready = True
 
     # Legacy code used when migrating from single urls to
     # A list of urls
@@ -19,7 +19,7 @@ from io import BytesIO
 import logging
 import time
 
-from pyupdater.utils import get_hash, lazy_import
+from pyupdater.utils import atomic_write, get_hash, lazy_import
 
 log = logging.getLogger(__name__)
 
@@ -56,10 +56,16 @@ class FileDownloader(object):
             True: Verify https connection
 
             False: Don't verify https connection
+
+        url_path (str): Path of file on the update server. Defaults
+                        to filename
     """
     def __init__(self, filename, urls, hexdigest=None, verify=True,
-                 progress_hooks=[]):
+                 progress_hooks=[], url_path=None):
         self.filename = filename
+        if url_path is None:
+            url_path = filename
+        self.url_path = url_path
         if isinstance(urls, list) is False:
             self.urls = [urls]
         else:
@@ -213,7 +219,7 @@ class FileDownloader(object):
     def _create_response(self):
         data = None
         for url in self.urls:
-            file_url = url + self.filename
+            file_url = url + self.url_path
             log.debug('Url for request: {}'.format(file_url))
             try:
                 data = self.http_pool.urlopen('GET', file_url,
@@ -256,8 +262,7 @@ class FileDownloader(object):
 
     def _write_to_file(self):
         # Writes download data in memory to disk
-        with open(self.filename, 'wb') as f:
-            f.write(self.file_binary_data)
+        atomic_write(self.filename, self.file_binary_data)
 
     def _check_hash(self):
         # Checks hash of downloaded file
@@ -18,21 +18,18 @@ from __future__ import unicode_literals
 import logging
 import os
 
-try:
-    import bsdiff4
-except ImportError:  # pragma: no cover
-    bsdiff4 = None
-
 from pyupdater.client.downloader import FileDownloader
 from pyupdater import settings
-from pyupdater.utils import (get_package_hashes,
+from pyupdater.utils import (atomic_write,
+                             get_object_path,
+                             get_package_hashes,
+                             gzip_compress,
+                             gzip_decompress,
                              EasyAccessDict,
                              lazy_import,
                              Version)
-from pyupdater.utils.exceptions import PatcherError
-
-if bsdiff4 is None:  # pragma: no cover
-    from pyupdater.utils import bsdiff4_py as bsdiff4
+from pyupdater.utils.diff_engines import get_engine
+from pyupdater.utils.exceptions import PatcherError, UtilsError
 
 log = logging.getLogger(__name__)
 
@@ -57,10 +54,16 @@ class Patcher(object):
 
         json_data (dict): Info dict with all package meta data
 
+        easy_data (obj): Key lookup of json_data. Used as is when
+                         passed, i.e. a binary manifest
+
         current_version (str): Version number of currently installed binary
 
         highest_version (str): Newest version available
 
+        channel (str): Release channel. Only patches of releases on
+                       this channel are applied
+
         update_folder (str): Path to update folder to place updated binary in
 
         update_urls (list): List of urls to use for file download
@@ -75,9 +78,12 @@ class Patcher(object):
     def __init__(self, **kwargs):
         self.name = kwargs.get('name')
         self.json_data = kwargs.get('json_data')
-        self.star_access_update_data = EasyAccessDict(self.json_data)
+        self.star_access_update_data = kwargs.get('easy_data')
+        if self.star_access_update_data is None:
+            self.star_access_update_data = EasyAccessDict(self.json_data)
         self.current_version = Version(kwargs.get('current_version'))
         self.highest_version = kwargs.get('highest_version')
+        self.channel = kwargs.get('channel')
         self.update_folder = kwargs.get('update_folder')
         self.update_urls = kwargs.get('update_urls', [])
         self.verify = kwargs.get('verify', True)
@@ -170,6 +176,17 @@ class Patcher(object):
                 info['patch_name'] = platform_info['patch_name']
                 info['patch_urls'] = self.update_urls
                 info['patch_hash'] = platform_info['patch_hash']
+                # Patches from before formats were recorded are bsdiff4
+                info['patch_format'] = platform_info.get('patch_format')
+                # Patches made from the uncompressed tar of an archive
+                info['patch_mode'] = platform_info.get('patch_mode')
+                info['compress_level'] = platform_info.get(
+                    'compress_level', settings.ARCHIVE_COMPRESS_LEVEL)
+                if platform_info.get('layout') == \
+                        settings.DEPLOY_LAYOUT_HASHED:
+                    info['url_path'] = get_object_path(info['patch_hash'])
+                else:
+                    info['url_path'] = info['patch_name']
                 self.patch_data.append(info)
             except Exception as err:  # pragma: no cover
                 log.debug(str(err), exc_info=True)
@@ -194,8 +211,18 @@ class Patcher(object):
 
         # Ensuring we apply patches in correct order
         versions = sorted(versions)
+        release = settings.CHANNELS.get(self.channel, 0)
+        if self.highest_version is not None:
+            highest = Version(self.highest_version)
+        else:
+            highest = None
         log.debug('getting required patches')
         for i in versions:
+            # Skipping releases from less stable channels
+            if i.release < release:
+                continue
+            if highest is not None and i > highest:
+                continue
             if i > self.current_version:
                 needed_patches.append(i)
         # Used to guarantee patches are only added once
@@ -209,7 +236,8 @@ class Patcher(object):
         for p in self.patch_data:
             # Initialize downloader
             fd = FileDownloader(p['patch_name'], p['patch_urls'],
-                                p['patch_hash'], self.verify)
+                                p['patch_hash'], self.verify,
+                                url_path=p['url_path'])
 
             # Attempt to download resource
             data = fd.download_verify_return()
@@ -246,15 +274,37 @@ class Patcher(object):
     def _apply_patches_in_memory(self):
         # Applies a sequence of patches in memory
         log.debug('Applying patches')
-        self.new_binary = self.og_binary
-        for i in self.patch_binary_data:
+        data = self.og_binary
+        # Compression level to rebuild the archive with while data
+        # is an uncompressed tar. None while data is the archive
+        level = None
+        for info, i in zip(self.patch_data, self.patch_binary_data):
+            try:
+                engine = get_engine(info['patch_format'])
+            except UtilsError as err:
+                log.error(str(err))
+                raise PatcherError('Unsupported patch format')
+            tar = info['patch_mode'] == settings.PATCH_MODE_TAR
             try:
-                self.new_binary = bsdiff4.patch(self.new_binary, i)
+                if tar is True and level is None:
+                    data = gzip_decompress(data)
+                elif tar is False and level is not None:
+                    data = gzip_compress(data, level)
+                data = engine.patch(data, i)
                 log.debug('Applied patch successfully')
             except Exception as err:
                 log.debug(err, exc_info=True)
                 log.error(err)
                 raise PatcherError('Patch failed to apply')
+            if tar is True:
+                level = info['compress_level']
+            else:
+                level = None
+        # Rebuilt archives are checked against file_hash when
+        # written to disk
+        if level is not None:
+            data = gzip_compress(data, level)
+        self.new_binary = data
 
     def _write_update_to_disk(self):  # pragma: no cover
         # Writes updated binary to disk
@@ -270,13 +320,9 @@ class Patcher(object):
 
         with jms_utils.paths.ChDir(self.update_folder):
             try:
-                with open(filename, 'wb') as f:
-                    f.write(self.new_binary)
+                atomic_write(filename, self.new_binary)
                 log.debug('Wrote update file')
-            except IOError:
-                # Removes file if it got created
-                if os.path.exists(filename):
-                    os.remove(filename)
+            except (IOError, OSError):
                 log.error('Failed to open file for writing')
                 raise PatcherError('Failed to open file for writing')
             else:
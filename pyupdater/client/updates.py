@@ -20,12 +20,21 @@ import threading
 from pyupdater.client.downloader import FileDownloader
 from pyupdater.client.patcher import Patcher
 from pyupdater import settings
-from pyupdater.utils import (get_filename,
+from pyupdater.utils import (atomic_write,
+                             get_archive_format,
+                             get_filename,
                              get_hash,
                              get_highest_version,
                              get_mac_dot_app_dir,
+                             get_object_path,
                              lazy_import,
+                             open_tar,
                              Version)
+from pyupdater.utils.chunks import (build_archive,
+                                    chunk_boundaries,
+                                    decompress_chunk,
+                                    get_payload,
+                                    load_chunk_index)
 from pyupdater.utils.exceptions import ClientError, UtilsError, VersionError
 
 
@@ -35,6 +44,12 @@ def logging():
     return logging
 
 
+@lazy_import
+def multiprocessing():
+    import multiprocessing.pool
+    return multiprocessing
+
+
 @lazy_import
 def os():
     import os
@@ -53,12 +68,6 @@ def sys():
     return sys
 
 
-@lazy_import
-def tarfile():
-    import tarfile
-    return tarfile
-
-
 @lazy_import
 def warnings():
     import warnings
@@ -100,6 +109,7 @@ class LibUpdate(object):
         self.json_data = data.get('json_data')
         self.data_dir = data.get('data_dir')
         self.platform = data.get('platform')
+        self.channel = data.get('channel')
         self.app_name = data.get('app_name')
         self.progress_hooks = data.get('progress_hooks')
         self.update_folder = os.path.join(self.data_dir,
@@ -139,7 +149,8 @@ class LibUpdate(object):
         """Will download the package update that was referenced
         with check update.
 
-        Proxy method for :meth:`_patch_update` & :meth:`_full_update`.
+        Proxy method for :meth:`_patch_update`, :meth:`_chunk_update`
+        & :meth:`_full_update`.
 
         Returns:
 
@@ -163,13 +174,17 @@ class LibUpdate(object):
                     log.info('Patch download successful')
                 else:
                     log.error('Patch update failed')
-                    log.info('Starting full download')
-                    update_success = self._full_update(self.name)
-                    if update_success:
+                    if self._chunk_update(self.name, self.version):
                         self.status = True
-                        log.info('Full download successful')
-                    else:  # pragma: no cover
-                        log.error('Full download failed')
+                        log.info('Chunk download successful')
+                    else:
+                        log.info('Starting full download')
+                        update_success = self._full_update(self.name)
+                        if update_success:
+                            self.status = True
+                            log.info('Full download successful')
+                        else:  # pragma: no cover
+                            log.error('Full download failed')
                 # Removes old versions, of update being checked, from
                 # updates folder.  Since we only start patching from
                 # the current binary this shouldn't be a problem.
@@ -215,7 +230,7 @@ class LibUpdate(object):
 
             # Ensuring we extract the latest version
             latest = get_highest_version(self.name, self.platform,
-                                         self.easy_data)
+                                         self.easy_data, self.channel)
             # Get full filename of latest update archive
             filename = get_filename(self.name, latest, self.platform,
                                     self.easy_data)
@@ -224,19 +239,19 @@ class LibUpdate(object):
                 raise ClientError('File does not exists')
 
             log.info('Extracting Update')
-            archive_ext = os.path.splitext(filename)[1].lower()
-            # Handles extracting gzip or zip archives
-            if archive_ext == '.gz':
+            archive_format = get_archive_format(filename)
+            # Handles extracting tar or zip archives
+            if archive_format in ('gztar', 'bztar', 'xztar'):
                 try:
-                    with tarfile.open(filename, 'r:gz') as tfile:
+                    with open_tar(filename) as tfile:
                         # Extract file update to current
                         # directory.
                         tfile.extractall()
                 except Exception as err:  # pragma: no cover
                     log.error(err)
                     log.debug(str(err), exc_info=True)
-                    raise ClientError('Error reading gzip file')
-            elif archive_ext == '.zip':
+                    raise ClientError('Error reading tar file')
+            elif archive_format == 'zip':
                 try:
                     with zipfile.ZipFile(filename, 'r') as zfile:
                         # Extract update file to current
@@ -251,7 +266,8 @@ class LibUpdate(object):
 
     # Checks if latest update is already downloaded
     def _is_downloaded(self, name):
-        latest = get_highest_version(name, self.platform, self.easy_data)
+        latest = get_highest_version(name, self.platform, self.easy_data,
+                                     self.channel)
 
         filename = get_filename(name, latest, self.platform, self.easy_data)
 
@@ -284,7 +300,7 @@ class LibUpdate(object):
                         'Possible TRAP!')
             return False
         latest = get_highest_version(name, self.platform,
-                                     self.easy_data)
+                                     self.easy_data, self.channel)
         # Just checking to see if the zip for the current version is
         # available to patch If not we'll just do a full binary download
         if not os.path.exists(os.path.join(self.update_folder, filename)):
@@ -294,7 +310,9 @@ class LibUpdate(object):
 
         # Initilize Patch object with all required information
         p = Patcher(name=name, json_data=self.json_data,
+                    easy_data=self.easy_data,
                     current_version=version, highest_version=latest,
+                    channel=self.channel,
                     update_folder=self.update_folder,
                     update_urls=self.update_urls, verify=self.verify,
                     progress_hooks=self.progress_hooks)
@@ -305,9 +323,157 @@ class LibUpdate(object):
         return p.start()
 
     # Starting full update
+    # Handles chunk store updates
+    def _chunk_update(self, name, version):
+        # Rebuilds the latest archive from the chunks of the installed
+        # archive & downloads only the chunks it doesn't have
+        latest = get_highest_version(name, self.platform, self.easy_data,
+                                     self.channel)
+        filename = get_filename(name, latest, self.platform, self.easy_data)
+        file_hash = self._get_info(name, latest, 'file_hash')
+        index_hash = self._get_info(name, latest, 'chunk_index')
+        if filename is None or index_hash is None:
+            log.debug('No chunk index for {}'.format(latest))
+            return False
+        log.info('Starting chunk update')
+        index = self._download_chunk_index(index_hash)
+        if index is None:
+            return False
+        payload, local = self._local_chunks(name, version, index['mode'])
+        if len(local) == 0:
+            # Nothing to reuse. One full download is faster
+            return False
+
+        missing = []
+        for digest, _ in index['chunks']:
+            if digest not in local and digest not in missing:
+                missing.append(digest)
+        log.info('Downloading {} of {} chunks'.format(len(missing),
+                                                      len(index['chunks'])))
+        fetched = {}
+        workers = min(len(missing), settings.CHUNK_DOWNLOAD_WORKERS)
+        pool = multiprocessing.pool.ThreadPool(processes=max(1, workers))
+        try:
+            for digest, chunk in pool.imap_unordered(self._download_chunk,
+                                                     missing):
+                if chunk is None:
+                    return False
+                fetched[digest] = chunk
+                self._call_progress_hooks({'total': len(missing),
+                                           'downloaded': len(fetched),
+                                           'status': 'downloading'})
+        finally:
+            pool.terminate()
+            pool.join()
+
+        parts = []
+        for digest, length in index['chunks']:
+            if digest in fetched:
+                parts.append(fetched[digest])
+            else:
+                offset = local[digest]
+                parts.append(payload[offset:offset + length])
+        archive = build_archive(b''.join(parts), index)
+        del parts
+        if get_hash(archive) != file_hash:
+            log.error('Rebuilt archive hash mismatch')
+            return False
+        atomic_write(os.path.join(self.update_folder, filename), archive)
+        self._call_progress_hooks({'total': len(missing),
+                                   'downloaded': len(fetched),
+                                   'status': 'finished'})
+        return True
+
+    def _download_chunk(self, digest):
+        # Returns digest & the chunk or None if it couldn't be
+        # downloaded. Runs on a thread pool.
+        url_path = get_object_path(digest, settings.DEPLOY_CHUNKS_FOLDER)
+        fd = FileDownloader(digest, self.update_urls, verify=self.verify,
+                            url_path=url_path)
+        data = fd.download_verify_return()
+        if data is None:
+            log.error('Failed to download chunk {}'.format(digest))
+            return digest, None
+        try:
+            return digest, decompress_chunk(data, digest)
+        except UtilsError as err:
+            log.error(str(err))
+            return digest, None
+
+    def _local_chunks(self, name, version, mode):
+        # Returns the payload of the installed archive & the offset of
+        # each of its chunks by hash. Read from its chunk index if it
+        # has one, otherwise chunked here.
+        filename = get_filename(name, version, self.platform, self.easy_data)
+        if filename is None:
+            return b'', {}
+        path = os.path.join(self.update_folder, filename)
+        if not os.path.exists(path):
+            log.debug('No installed archive to take chunks from')
+            return b'', {}
+        with open(path, 'rb') as f:
+            data = f.read()
+        if get_hash(data) != self._get_info(name, version, 'file_hash'):
+            log.debug('Installed archive hash mismatch')
+            return b'', {}
+
+        local = {}
+        index_hash = self._get_info(name, version, 'chunk_index')
+        index = None
+        if index_hash is not None:
+            index = self._download_chunk_index(index_hash)
+        try:
+            if index is not None:
+                payload = get_payload(data, index['mode'])
+                offset = 0
+                for digest, length in index['chunks']:
+                    local.setdefault(digest, offset)
+                    offset += length
+            else:
+                if not filename.endswith('.tar.gz'):
+                    mode = None
+                payload = get_payload(data, mode)
+                for offset, length in chunk_boundaries(payload):
+                    chunk = payload[offset:offset + length]
+                    local.setdefault(get_hash(chunk), offset)
+        except Exception as err:
+            log.debug(str(err), exc_info=True)
+            return b'', {}
+        return payload, local
+
+    def _download_chunk_index(self, index_hash):
+        # Returns the chunk index published under index_hash or None
+        fd = FileDownloader(index_hash, self.update_urls, index_hash,
+                            self.verify, url_path=get_object_path(index_hash))
+        data = fd.download_verify_return()
+        if data is None:
+            log.error('Failed to download chunk index')
+            return None
+        try:
+            return load_chunk_index(data)
+        except UtilsError as err:
+            log.error(str(err))
+            return None
+
+    def _get_info(self, name, version, key):
+        # Value of key in the version file entry of name & version
+        info_key = '{}*{}*{}*{}*{}'.format(self.updates_key, name,
+                                           version, self.platform, key)
+        return self.easy_data.get(info_key)
+
+    def _call_progress_hooks(self, data):
+        for ph in self.progress_hooks or []:
+            try:
+                ph(data)
+            except Exception as err:
+                log.debug(str(err), exc_info=True)
+                log.error('Exception in callback: '
+                          '{}'.format(ph.__name__))
+
     def _full_update(self, name):
         log.info('Starting full update')
-        latest = get_highest_version(name, self.platform, self.easy_data)
+        latest = get_highest_version(name, self.platform, self.easy_data,
+                                     self.channel)
 
         filename = get_filename(name, latest, self.platform, self.easy_data)
 
@@ -315,11 +481,18 @@ class LibUpdate(object):
                                            latest, self.platform,
                                            'file_hash')
         file_hash = self.easy_data.get(hash_key)
+        layout_key = '{}*{}*{}*{}*{}'.format(self.updates_key, name,
+                                             latest, self.platform,
+                                             'layout')
+        url_path = None
+        if self.easy_data.get(layout_key) == settings.DEPLOY_LAYOUT_HASHED:
+            url_path = get_object_path(file_hash)
 
         with jms_utils.paths.ChDir(self.update_folder):
             log.info('Downloading update...')
             fd = FileDownloader(filename, self.update_urls,
-                                file_hash, self.verify, self.progress_hooks)
+                                file_hash, self.verify, self.progress_hooks,
+                                url_path=url_path)
             result = fd.download_verify_write()
             if result:
                 log.info('Download Complete')
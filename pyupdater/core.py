@@ -17,12 +17,40 @@ from __future__ import unicode_literals
 
 import os
 
-from pyupdater.key_handler import KeyHandler
-from pyupdater.package_handler import PackageHandler
-from pyupdater.storage import Storage
-from pyupdater.uploader import Uploader
-from pyupdater.utils.config import TransistionDict
-from pyupdater.utils.storage import Storage
+from pyupdater.utils import lazy_import
+
+# pyupdater imports Core for PyUpdater, so the handlers are only
+# loaded once a Core is made. Importing the client stays cheap.
+
+
+@lazy_import
+def key_handler():
+    import pyupdater.key_handler
+    return pyupdater.key_handler
+
+
+@lazy_import
+def package_handler():
+    import pyupdater.package_handler
+    return pyupdater.package_handler
+
+
+@lazy_import
+def uploader():
+    import pyupdater.uploader
+    return pyupdater.uploader
+
+
+@lazy_import
+def utils_config():
+    import pyupdater.utils.config
+    return pyupdater.utils.config
+
+
+@lazy_import
+def storage():
+    import pyupdater.utils.storage
+    return pyupdater.utils.storage
 
 
 class Core(object):
@@ -33,7 +61,7 @@ class Core(object):
             config (obj): config object
     """
     def __init__(self, config=None, db=None):
-        self.config = TransistionDict()
+        self.config = utils_config.TransistionDict()
         # Important to keep this before updating config
         if config is not None:
             self.update_config(config, db)
@@ -51,16 +79,16 @@ class Core(object):
             config.DATA_DIR = os.getcwd()
 
         if db is None:
-            self.db = Storage(config.DATA_DIR)
+            self.db = storage.Storage(config.DATA_DIR)
         else:
             self.db = db
         self.config.from_object(config)
         self._update(self.config, self.db)
 
     def _update(self, config, db):
-        self.kh = KeyHandler(config, db)
-        self.ph = PackageHandler(config, db)
-        self.up = Uploader(config)
+        self.kh = key_handler.KeyHandler(config, db)
+        self.ph = package_handler.PackageHandler(config, db)
+        self.up = uploader.Uploader(config, db)
 
     def setup(self):
         "Sets up root dir with required PyUpdater folders"
@@ -72,14 +100,18 @@ class Core(object):
         """
         self.ph.process_packages()
 
-    def set_uploader(self, requested_uploader):
+    def set_uploader(self, requested_uploader, upload_all=False):
         u"""Sets upload destination
 
         Args:
 
             requested_uploader (str): upload service. i.e. s3, scp
+
+        Kwargs:
+
+            upload_all (bool): Upload files uploaded before too
         """
-        self.up.set_uploader(requested_uploader)
+        self.up.set_uploader(requested_uploader, upload_all)
 
     def upload(self):
         "Uploads files in deploy folder"
@@ -17,13 +17,11 @@ from __future__ import print_function
 
 from pyupdater import settings
 from pyupdater.key_handler.keydb import KeyDB
-from pyupdater.utils import lazy_import
-
-
-@lazy_import
-def gzip():
-    import gzip
-    return gzip
+from pyupdater.utils import (AtomicWriter,
+                             gzip_compress,
+                             lazy_import,
+                             Version)
+from pyupdater.utils.manifest import attach_signatures, encode_manifest
 
 
 @lazy_import
@@ -65,6 +63,63 @@ def six():
 log = logging.getLogger(__name__)
 
 
+class BatchSigner(object):
+    """Signs every payload of a release with every signing key in one
+    pass. Payloads are added first & signed together by :meth:`sign`.
+
+    Args:
+
+        signing_keys (list): (key id, ed25519.SigningKey) to sign with
+
+    Kwargs:
+
+        encoding (str): Encoding of signatures. None for raw bytes
+    """
+
+    def __init__(self, signing_keys, encoding='base64'):
+        self.signing_keys = signing_keys
+        self.encoding = encoding
+        self.payloads = []
+
+    def add(self, data, raw=False):
+        """Adds a payload to sign
+
+        Args:
+
+            data (bytes): Data to sign
+
+        Kwargs:
+
+            raw (bool): Return raw signatures instead of encoded
+
+        Returns:
+
+            (int): Index of the payload's signatures in the list
+                   returned by :meth:`sign`
+        """
+        self.payloads.append((data, raw))
+        return len(self.payloads) - 1
+
+    def sign(self):
+        """Signs & clears the added payloads
+
+        Returns:
+
+            (list): [(key id, sig), ...] for each payload in the order
+                    they were added
+        """
+        sigs = [[] for _ in self.payloads]
+        for key_id, key in self.signing_keys:
+            for i, (data, raw) in enumerate(self.payloads):
+                if raw is True:
+                    sig = key.sign(data)
+                else:
+                    sig = key.sign(data, encoding=self.encoding)
+                sigs[i].append((key_id, sig))
+        self.payloads = []
+        return sigs
+
+
 class KeyHandler(object):
     """KeyHanlder object is used to manage keys used for signing updates
 
@@ -108,6 +163,10 @@ class KeyHandler(object):
                                              settings.VERSION_FILE_OLD)
         self.version_file = os.path.join(self.deploy_dir,
                                          settings.VERSION_FILE)
+        self.binary_version_file = os.path.join(self.deploy_dir,
+                                                settings.VERSION_FILE_BINARY)
+        self.version_sig_file = os.path.join(self.deploy_dir,
+                                             settings.VERSION_FILE_SIG)
         self._migrate()
 
     def _migrate(self):
@@ -145,7 +204,6 @@ class KeyHandler(object):
     def _make_keys(self):
         # Makes a set of private and public keys
         # Used for authentication
-        self.keysdb.load()
         privkey, pubkey = ed25519.create_keypair()
         pri = privkey.to_ascii(encoding=self.key_encoding)
         pub = pubkey.to_ascii(encoding=self.key_encoding)
@@ -171,11 +229,9 @@ class KeyHandler(object):
     def get_public_keys(self):
         """Returns (object): Public Key
         """
-        self.keysdb.load()
         return self.keysdb.get_public_keys()
 
     def get_recent_revoked_key(self):
-        self.keysdb.load()
         return self.keysdb.get_revoked_key()
 
     # ToDo: Remove in v1.0
@@ -199,64 +255,131 @@ class KeyHandler(object):
 
     def _add_sig(self):
         # Adding new signature to version file
-        private_keys = self._load_private_keys()
         # Just making sure we have a least 2 keys so when revoke is
         # called we have a fall back
-        if len(private_keys) < 2:
+        if len(self._load_private_keys()) < 2:
             self.make_keys()
-        private_keys = self._load_private_keys()
+        signing_keys = self.keysdb.get_signing_keys(self.key_encoding)
 
         update_data = self._load_update_data()
         if u'sigs' in update_data:
             log.debug(u'Removing signatures from version file')
             del update_data[u'sigs']
-        update_data_str = json.dumps(update_data, sort_keys=True)
-
-        signatures = list()
-        signature = None
-
+        signer = BatchSigner(signing_keys, self.key_encoding)
+
+        # Embedded signatures are over the compact json of each version
+        # file. Smaller version files hold only what clients on a
+        # channel need.
+        channels = sorted(settings.CHANNELS.keys())
+        channel_data = [self._channel_data(update_data, c) for c in channels]
+        main = signer.add(six.b(json.dumps(update_data, sort_keys=True)))
+        channel_idx = [signer.add(six.b(json.dumps(d, sort_keys=True)))
+                       for d in channel_data]
+        # The binary manifest is signed over its exact bytes with raw
+        # signatures. Clients verify without re-serializing anything.
+        manifest = encode_manifest(update_data)
+        binary = signer.add(manifest, raw=True)
+        sigs = signer.sign()
+
+        signatures = [s for _, s in sigs[main]]
+        version_data = update_data.copy()
+        version_data[u'sigs'] = signatures
         # ToDo: Remove in v1.0: Used for migration to v0.14 & above
-        old = False
-        # ToDo: End
-        for p in private_keys:
-            if six.PY2 is True and isinstance(p, unicode) is True:
-                log.debug('Got type: {}'.format(type(p)))
-                p = str(p)
-            log.debug(u'Key type: {}'.format(type(p)))
-            privkey = ed25519.SigningKey(p, encoding=self.key_encoding)
-            sig = privkey.sign(six.b(update_data_str),
-                               encoding=self.key_encoding)
-            # ToDo: Remove in v1.0: Used for migration to v0.14 & above
-            if old is False:
-                signature = sig
-                old = True
-            # ToDo: End
-            log.debug('Sig: {}'.format(sig))
-            signatures.append(sig)
-
-        og_data = json.loads(update_data_str)
-        update_data = og_data.copy()
-        update_data[u'sigs'] = signatures
-        # ToDo: Remove in v1.0: Used for migration to v0.14 & above
-        old_update_data = og_data.copy()
-        old_update_data[u'sig'] = signature
+        old_update_data = update_data.copy()
+        old_update_data[u'sig'] = signatures[0]
         # ToDo: End
         log.info(u'Adding sig to update data')
-        self._write_update_data(og_data, update_data, old_update_data)
-
-    def _write_update_data(self, data, version, old_version):
-        # Write version file to disk
+        for data, i in zip(channel_data, channel_idx):
+            data[u'sigs'] = [s for _, s in sigs[i]]
+        binary_version = attach_signatures(manifest, sigs[binary])
+
+        # Detached signatures are over the bytes clients download,
+        # which include the embedded signatures
+        version_str = json.dumps(version_data, indent=2, sort_keys=True)
+        main = signer.add(six.b(version_str))
+        channel_strs = [json.dumps(d, indent=2, sort_keys=True)
+                        for d in channel_data]
+        channel_idx = [signer.add(six.b(c)) for c in channel_strs]
+        sigs = signer.sign()
+
+        version_sig = self._detached_sig(sigs[main])
+        channel_versions = {}
+        for c, c_str, i in zip(channels, channel_strs, channel_idx):
+            channel_versions[c] = (c_str, self._detached_sig(sigs[i]))
+        self._write_update_data(update_data, version_str, old_update_data,
+                                binary_version, version_sig,
+                                channel_versions)
+
+    def _detached_sig(self, sigs):
+        # Each signature carries the key id so clients don't have to
+        # try every public key they know about.
+        # Returns the serialized signatures
+        version_sigs = [{u'key_id': key_id, u'sig': sig}
+                        for key_id, sig in sigs]
+        return json.dumps(version_sigs, indent=2, sort_keys=True)
+
+    def _channel_data(self, data, channel):
+        # Version data with only the releases of channel & the
+        # channels more stable than it
+        release = settings.CHANNELS[channel]
+        latest = data.get(settings.CHANNELS_KEY, {}).get(channel)
+        if latest is None:
+            # Version data from before channels were added
+            latest = {}
+            for name, platforms in data.get(u'latest', {}).items():
+                for plat, version in platforms.items():
+                    if Version(version).release >= release:
+                        latest.setdefault(name, {})[plat] = version
+
+        updates = {}
+        for name, versions in data.get(settings.UPDATES_KEY, {}).items():
+            for version, info in versions.items():
+                if Version(version).release >= release:
+                    updates.setdefault(name, {})[version] = info
+        return {
+            settings.UPDATES_KEY: updates,
+            settings.CHANNELS_KEY: {channel: latest},
+            u'latest': latest,
+            }
+
+    def _write_update_data(self, data, version, old_version,
+                           binary_version=None, version_sig=None,
+                           channel_versions=None):
+        # Write version file to disk. version is the serialized
+        # manifest so the bytes match the detached signatures
         self.db.save(settings.CONFIG_DB_KEY_VERSION_META, data)
         log.debug(u'Saved version meta data')
 
-        with gzip.open(self.version_file, u'wb') as f:
-            f.write(json.dumps(version, indent=2, sort_keys=True))
-        log.info(u'Created gzipped version manifest in deploy dir')
-        # ToDo: Remove in v1.0
-        with open(self.old_version_file, u'w') as f:
-            f.write(json.dumps(old_version, indent=2, sort_keys=True))
-        log.info(u'Created json version manifest in deploy dir')
-        # ToDo: End
+        # Every file is replaced only once all of them are on disk, so
+        # a crash never publishes part of a release
+        with AtomicWriter() as writer:
+            writer.write(self.version_file, gzip_compress(six.b(version)))
+            log.info(u'Created gzipped version manifest in deploy dir')
+
+            if version_sig is not None:
+                writer.write(self.version_sig_file, version_sig)
+                log.info(u'Created version manifest signatures in '
+                         u'deploy dir')
+
+            if channel_versions is not None:
+                for channel, (c_version, c_sig) in channel_versions.items():
+                    c_file = settings.VERSION_FILE_CHANNEL.format(channel)
+                    writer.write(os.path.join(self.deploy_dir, c_file),
+                                 gzip_compress(six.b(c_version)))
+                    c_file = settings.VERSION_FILE_CHANNEL_SIG.format(channel)
+                    writer.write(os.path.join(self.deploy_dir, c_file),
+                                 c_sig)
+                log.info(u'Created channel version manifests in deploy dir')
+
+            if binary_version is not None:
+                writer.write(self.binary_version_file,
+                             gzip_compress(binary_version))
+                log.info(u'Created binary version manifest in deploy dir')
+            # ToDo: Remove in v1.0
+            writer.write(self.old_version_file,
+                         json.dumps(old_version, indent=2, sort_keys=True))
+            log.info(u'Created json version manifest in deploy dir')
+            # ToDo: End
 
     def _load_update_data(self):
         log.debug(u"Loading version data")
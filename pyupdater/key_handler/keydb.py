@@ -13,18 +13,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # --------------------------------------------------------------------------
-import json
 import logging
 import time
 
 from pyupdater import settings
+from pyupdater.utils import get_key_id, lazy_import
 
 log = logging.getLogger(__name__)
 
 
+@lazy_import
+def ed25519():
+    import ed25519
+    return ed25519
+
+
+@lazy_import
+def six():
+    import six
+    return six
+
+
 class KeyDB(object):
     u"""Handles finding, sorting, getting meta-data, moving packages.
 
+    Keys are indexed by key id when loaded. Signing keys are parsed once
+    & kept in memory until the keys change.
+
     Kwargs:
 
         data_dir (str): Path to directory containing key.db
@@ -41,6 +56,13 @@ class KeyDB(object):
     def __init__(self, db, load=False):
         self.db = db
         self.data = None
+        # Record numbers of valid & revoked keys, oldest first
+        self.valid = []
+        self.revoked = []
+        # key id: record number
+        self.key_ids = {}
+        # Parsed signing keys of valid keys
+        self._signing_keys = None
         if load is True:
             self.load()
 
@@ -58,7 +80,7 @@ class KeyDB(object):
         _time = time.time()
         if self.data is None:
             self.load()
-        num = len(self.data) + 1
+        num = max(self.data.keys() or [0]) + 1
         data = {
             u'date': _time,
             u'public': public,
@@ -68,6 +90,7 @@ class KeyDB(object):
         }
         log.info('Adding public key to db. {}'.format(len(public)))
         self.data[num] = data
+        self._index()
         self.save()
 
     def get_public_keys(self):
@@ -81,38 +104,55 @@ class KeyDB(object):
     def _get_keys(self, key):
         if self.data is None:
             self.load()
-        order = []
-        keys = []
-        for k, v in self.data.items():
-            if v[u'revoked'] is False:
-                order.append(int(k))
-            else:
-                log.debug(u'Revoked key'.format(len(k)))
-        order = sorted(order)
-        for o in order:
-            try:
-                data = self.data[o]
-                log.debug(u'Got key data')
-                pub_key = data[key]
-                keys.append(pub_key)
-                log.debug(u'Got public key')
-            except KeyError:  # pragma: no cover
-                log.debug(u'Key error')
-                continue
-        return keys
+        return [self.data[n][key] for n in self.valid]
+
+    def get_key(self, key_id):
+        u"""Returns (dict): Key pair with key_id or None if unknown
+
+        Args:
+
+            key_id (str): Id from :func:`pyupdater.utils.get_key_id`
+        """
+        if self.data is None:
+            self.load()
+        num = self.key_ids.get(key_id)
+        if num is None:
+            return None
+        return self.data[num]
+
+    def is_revoked(self, key_id):
+        u"Returns (bool): True if the key with key_id was revoked"
+        info = self.get_key(key_id)
+        return info is not None and info[u'revoked'] is True
+
+    def get_signing_keys(self, encoding='base64'):
+        u"""Returns (list): (key id, ed25519.SigningKey) of all valid
+        keys. Parsed on first use.
+
+        Kwargs:
+
+            encoding (str): Encoding private keys are stored in
+        """
+        if self.data is None:
+            self.load()
+        if self._signing_keys is None:
+            keys = []
+            for n in self.valid:
+                p = self.data[n][u'private']
+                if six.PY2 is True and isinstance(p, unicode) is True:
+                    p = str(p)
+                keys.append((self._key_id(n),
+                             ed25519.SigningKey(p, encoding=encoding)))
+            self._signing_keys = keys
+        return self._signing_keys
 
     def get_revoked_key(self):
         u"Returns most recent revoked key pair"
-        keys = []
-        for k, v in self.data.items():
-            if v[u'revoked'] is True:
-                keys.append(int(k))
-        if len(keys) >= 1:
-            key = sorted(keys)[-1]
-            info = self.data[key]
-        else:
-            info = None
-        return info
+        if self.data is None:
+            self.load()
+        if len(self.revoked) >= 1:
+            return self.data[self.revoked[-1]]
+        return None
 
     def revoke_key(self, count=1):
         u"""Revokes key pair
@@ -121,45 +161,43 @@ class KeyDB(object):
 
             count (int): The number of keys to revoke. Oldest first
         """
-        keys = map(str, self.data.keys())
-        keys = sorted(keys)
-        log.debug(u'Collecting keys'.format(keys))
-        c = 0
-        for k in keys:
-            if c >= count:
-                break
-            k = int(k)
-            if self.data[k][u'revoked'] is False:
-                self.data[k][u'revoked'] = True
-                log.debug(u'Revoked key')
-                c += 1
+        if self.data is None:
+            self.load()
+        log.debug(u'Collecting keys')
+        for n in self.valid[:count]:
+            self.data[n][u'revoked'] = True
+            log.debug(u'Revoked key')
+        self._index()
         self.save()
 
     def load(self):
         u"Loads data from key.db"
-        # ToDo: Remove in v1.0
-        if os.path.exists(self.key_file):  # pragma: no cover
-            log.info('Beginning key.db migration')
-            try:
-                with open(self.key_file, u'r') as f:
-                    self.data = json.loads(f.read())
-                log.debug(u'Loaded key.db')
-                self.save()
-                log.info(u'key.db migration successful')
-                os.remove(self.key_file)
-                log.info(u'Removed {}'.format(self.key_file))
-            except Exception as err:
-                log.error(u'Failed to load key.db')
-                log.debug(str(err), exc_info=True)
-                log.error(u'Migration failed')
-        else:
-            self.data = self.db.load(settings.CONFIG_DB_KEY_KEYS)
-            if self.data is None:
-                log.info('Key.db file not found creating new')
-                self.data = dict()
+        data = self.db.load(settings.CONFIG_DB_KEY_KEYS)
+        if data is None:
+            log.info('Key.db file not found creating new')
+            data = dict()
+        # Record numbers are strings after a round trip through json
+        self.data = dict((int(k), v) for k, v in data.items())
+        self._index()
 
     def save(self):
         u"Saves data to key.db"
         log.debug(u'Saving keys...')
         self.db.save(settings.CONFIG_DB_KEY_KEYS, self.data)
         log.debug(u'Saved keys...')
+
+    def _key_id(self, num):
+        return get_key_id(self.data[num][u'public'])
+
+    def _index(self):
+        # Rebuilds the indexes after keys are loaded or change
+        self.valid = []
+        self.revoked = []
+        self.key_ids = {}
+        for n in sorted(self.data.keys()):
+            if self.data[n][u'revoked'] is True:
+                self.revoked.append(n)
+            else:
+                self.valid.append(n)
+            self.key_ids[self._key_id(n)] = n
+        self._signing_keys = None
@@ -17,22 +17,39 @@ from __future__ import print_function
 import json
 import logging
 import multiprocessing
+from multiprocessing.pool import ThreadPool
 import os
 import shutil
-
-try:  # pragma: no cover
-    import bsdiff4
-except ImportError:  # pragma: no cover
-    bsdiff4 = None
+import tempfile
+import time
 
 from pyupdater import settings
 from pyupdater.exceptions import PackageHandlerError
+from pyupdater.package_handler.ledger import JobLedger
 from pyupdater.package_handler.package import Package, Patch
-from pyupdater.utils import (EasyAccessDict,
+from pyupdater.package_handler.scheduler import (chunk_cost,
+                                                 patch_cost,
+                                                 PatchScheduler)
+from pyupdater.utils import (atomic_write,
+                             EasyAccessDict,
+                             get_hash,
+                             get_object_path,
                              get_package_hashes as gph,
+                             gzip_decompress,
                              lazy_import,
-                             remove_dot_files
+                             link_file,
+                             move_file,
+                             normalize_archive,
+                             remove_dot_files,
+                             Version
                              )
+from pyupdater.utils.chunks import (compress_chunk,
+                                    get_payload,
+                                    load_chunk_index,
+                                    make_chunk_index,
+                                    split_chunks)
+from pyupdater.utils.diff_engines import get_engine
+from pyupdater.utils.exceptions import UtilsError
 
 log = logging.getLogger(__name__)
 
@@ -74,6 +91,30 @@ class PackageHandler(object):
         else:
             log.info(u'Patch support disabled')
             self.patch_support = False
+        # Diff engine used to create patches. PATCH_ENGINES maps
+        # package names to engines for packages that need another one
+        self.patch_engine = obj.get(u'PATCH_ENGINE',
+                                    settings.DEFAULT_PATCH_FORMAT)
+        self.patch_engines = obj.get(u'PATCH_ENGINES', {})
+        # Make patches from the uncompressed tar of .tar.gz archives.
+        # Archives get recompressed deterministically so clients can
+        # rebuild them after patching.
+        self.patch_uncompressed = obj.get(u'PATCH_UNCOMPRESSED', False)
+        # Most patches to create at once & memory budget in MB for
+        # patch creation. None means cpu count & available memory
+        self.patch_workers = obj.get(u'PATCH_WORKERS')
+        self.patch_memory_limit = obj.get(u'PATCH_MEMORY_LIMIT')
+        # Store deploy files under their hash so they never change
+        # & can be cached forever
+        layout = obj.get(u'DEPLOY_LAYOUT')
+        self.hashed_layout = layout == settings.DEPLOY_LAYOUT_HASHED
+        # Split archives into content defined chunks so clients only
+        # download the chunks they don't already have
+        self.chunk_store = obj.get(u'CHUNK_STORE', False)
+        # Retention policy for the version manifest. None keeps
+        # every release
+        self.retention_count = obj.get(u'UPDATE_RETENTION_COUNT')
+        self.retention_days = obj.get(u'UPDATE_RETENTION_DAYS')
         data_dir = obj.get(u'DATA_DIR', os.getcwd())
         self.db = db
         self.data_dir = os.path.join(data_dir, settings.USER_DATA_FOLDER)
@@ -87,6 +128,9 @@ class PackageHandler(object):
                                          settings.VERSION_FILE_DB)
         self.config = None
         self.json_data = None
+        self.ledger = None
+        # Listing of the files dir. Read once per run
+        self.src_files = None
 
         self.setup()
 
@@ -103,6 +147,7 @@ class PackageHandler(object):
         if self.config_loaded is False:
             self.json_data = self._load_version_file()
             self.config = self._load_config()
+            self.ledger = JobLedger(self.db)
             self.config_loaded = True
 
     def process_packages(self):
@@ -111,23 +156,36 @@ class PackageHandler(object):
         all packages.  Updates the version file meta-data. Then writes
         version file back to disk.
 
+        Progress is kept in a job ledger. If a run is aborted the next
+        one reuses hashes & patches it already made.
+
         Proxy method for :meth:`_get_package_list`,
         :meth:`_make_patches`, :meth:`_add_patches_to_packages`,
-        :meth:`_update_version_file`,
+        :meth:`_store_chunks`, :meth:`_update_version_file`,
         :meth:`_write_json_to_file` & :meth:`_move_packages`.
         """
         if self.data_dir is None:
             raise PackageHandlerError('Must init first.', expected=True)
         package_manifest, patch_manifest = self._get_package_list()
         patches = self._make_patches(patch_manifest)
-        self._cleanup(patch_manifest)
         package_manifest = self._add_patches_to_packages(package_manifest,
                                                          patches)
+        self._store_chunks(package_manifest)
         self.json_data = self._update_version_file(self.json_data,
                                                    package_manifest)
+        self._cleanup(patch_manifest)
+        pruned = self._prune_version_file(self.json_data)
         self._write_json_to_file(self.json_data)
         self._write_config_to_file(self.config)
+        # Saved with the version file & config in the same sync
+        for p in package_manifest:
+            self.ledger.complete(p.file_hash, JobLedger.MANIFEST)
+        self.ledger.save()
         self._move_packages(package_manifest)
+        for p in package_manifest:
+            self.ledger.finish(p.file_hash)
+        self.ledger.save()
+        self._remove_pruned_files(pruned)
 
     def _setup_work_dirs(self):
         # Sets up work dirs on dev machine.  Creates the following folder
@@ -216,16 +274,14 @@ class PackageHandler(object):
         package_manifest = list()
         patch_manifest = list()
         bad_packages = list()
+        self.src_files = None
         with jms_utils.paths.ChDir(self.new_dir):
             # Getting a list of all files in the new dir
-            packages = os.listdir(os.getcwd())
-            for p in packages:
-                # On package initialization we do the following
-                # 1. Check for a supported archive
-                # 2. get required info: version, platform, hash
-                # If any check fails package.info['status'] will be False
-                # You can query package.info['reason'] for the reason
-                package = Package(p)
+            # Sorted so the manifest is updated in the same order
+            # every run
+            packages = sorted(os.listdir(os.getcwd()))
+            for package in self._load_packages(packages):
+                p = package.filename
                 if package.info['status'] is False:
                     # Package failed at something
                     # package.info['reason'] will tell why
@@ -239,30 +295,45 @@ class PackageHandler(object):
                 self.config = self._add_package_to_config(package,
                                                           self.config)
 
-                if self.patch_support:
+                # Patches made by an aborted run are reused
+                if self.patch_support and not self._resume_patch(package):
+                    patch_mode = None
+                    if self.patch_uncompressed is True and \
+                            p.endswith(u'.tar.gz'):
+                        patch_mode = settings.PATCH_MODE_TAR
                     # Will check if source file for patch exists
                     # if so will return the path and number of patch
                     # to create. If missing source file None returned
                     path = self._check_make_patch(self.json_data,
                                                   package.name,
                                                   package.platform,
-                                                  )
+                                                  package.channel,
+                                                  patch_mode)
                     if path is not None:
                         log.info(u'Found source file to create patch')
                         patch_name = package.name + u'-' + package.platform
                         src_path = path[0]
                         patch_number = path[1]
+                        patch_format = self._patch_format(package.name,
+                                                          patch_mode)
                         patch_info = dict(src=src_path,
                                           dst=os.path.abspath(p),
                                           patch_name=os.path.join(self.new_dir,
                                                                   patch_name),
                                           patch_num=patch_number,
-                                          package=package.filename)
+                                          patch_format=patch_format,
+                                          patch_mode=patch_mode,
+                                          package=package.filename,
+                                          file_hash=package.file_hash)
                         # ready for patching
                         patch_manifest.append(patch_info)
                     else:
                         log.warning(u'No source file to patch from')
 
+            # Hashes survive an aborted run
+            self.ledger.prune(packages)
+            self.ledger.save()
+
         # ToDo: Expose this
         if ignore_errors is False:
             log.warning(u'Bad package & reason for being naughty:')
@@ -272,6 +343,80 @@ class PackageHandler(object):
 
         return package_manifest, patch_manifest
 
+    def _load_packages(self, packages):
+        # On package initialization we do the following
+        # 1. Check for a supported archive
+        # 2. get required info: version, platform, hash
+        # If any check fails package.info['status'] will be False
+        # You can query package.info['reason'] for the reason
+        #
+        # Hashing is most of the work & hashlib releases the GIL,
+        # so packages are inspected on a thread pool. Results come
+        # back in the same order as packages.
+        if len(packages) < 2:
+            return [self._inspect_package(p) for p in packages]
+        workers = min(len(packages), multiprocessing.cpu_count())
+        log.debug(u'Inspecting packages with {} threads'.format(workers))
+        pool = ThreadPool(processes=workers)
+        try:
+            return pool.map(self._inspect_package, packages)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _inspect_package(self, filename):
+        # Unchanged files already hashed by an earlier run aren't
+        # hashed again
+        normalized = self.patch_uncompressed is True or \
+            self.chunk_store is True
+        digest = self.ledger.get_digest(filename, normalized)
+        if digest is not None:
+            log.debug(u'Using recorded hash for {}'.format(filename))
+        elif normalized is True:
+            # Has to happen before the archive is hashed
+            try:
+                normalize_archive(filename)
+            except Exception as err:
+                log.error(u'Failed to normalize {}'.format(filename))
+                log.debug(str(err), exc_info=True)
+                normalized = False
+        package = Package(filename, digest)
+        package.normalized = normalized
+        if digest is None and package.info['status'] is True:
+            self.ledger.set_digest(filename, package.file_hash, normalized)
+        return package
+
+    def _resume_patch(self, package):
+        # Reuses the patch an aborted run made for package. Returns
+        # True if no new patch should be made.
+        digest = package.file_hash
+        info = self.ledger.get(digest, JobLedger.PATCHED)
+        # Already in the version file, so only the move is left
+        in_manifest = self.ledger.get(digest, JobLedger.MANIFEST) is not None
+        if info is None:
+            return in_manifest
+        if in_manifest is False:
+            src = self._patch_source(self.json_data, package.name,
+                                     package.platform, package.channel)
+            if src is None or os.path.basename(src) != info[u'src']:
+                return False
+            patch_path = os.path.join(self.new_dir, info[u'patch_name'])
+            if not os.path.exists(patch_path) or \
+                    gph(patch_path) != info[u'patch_hash']:
+                return False
+        log.info(u'Reusing patch {}'.format(info[u'patch_name']))
+        for k in [u'patch_name', u'patch_hash', u'patch_format']:
+            package.patch_info[k] = info[k]
+        if info.get(u'patch_mode') is not None:
+            package.patch_info[u'patch_mode'] = info[u'patch_mode']
+            level = settings.ARCHIVE_COMPRESS_LEVEL
+            package.patch_info[u'compress_level'] = level
+        # Patch numbers are never handed out twice
+        patches = self.config.setdefault(u'patches', {})
+        patches[package.name] = max(patches.get(package.name, 0),
+                                    info[u'patch_num'])
+        return True
+
     def _add_package_to_config(self, p, data):
         if u'package' not in data.keys():
             data[u'package'] = {}
@@ -293,13 +438,30 @@ class PackageHandler(object):
                 if p.version > value:
                     log.info(u'Adding new version to package-config')
                     data[u'package'][p.name][p.platform] = p.version
+
+        # Release times are used by the age based retention policy
+        released = data.setdefault(u'released', {})
+        released = released.setdefault(p.name, {}).setdefault(p.platform, {})
+        if p.version not in released:
+            released[p.version] = int(time.time())
         return data
 
     def _cleanup(self, patch_manifest):
         if len(patch_manifest) < 1:
             return
         log.info(u'Cleaning up files directory')
+        # Archives still latest in some channel are patch sources
+        # for future releases on that channel
+        in_use = set()
+        for name, plat, version in self._latest_versions(self.json_data):
+            try:
+                info = self.json_data[settings.UPDATES_KEY][name][version]
+                in_use.add(info[plat][u'filename'])
+            except KeyError:
+                continue
         for p in patch_manifest:
+            if os.path.basename(p[u'src']) in in_use:
+                continue
             if os.path.exists(p[u'src']):
                 basename = os.path.basename(p[u'src'])
                 log.info(u'Removing {}'.format(basename))
@@ -310,11 +472,56 @@ class PackageHandler(object):
         if len(patch_manifest) < 1:
             return pool_output
         log.info(u'Starting patch creation')
-        cpu_count = multiprocessing.cpu_count() * 2
-        pool = multiprocessing.Pool(processes=cpu_count)
-        pool_output = pool.map(_make_patch, patch_manifest)
+        memory = None
+        if self.patch_memory_limit is not None:
+            memory = self.patch_memory_limit * 1024 ** 2
+        scheduler = PatchScheduler(max_workers=self.patch_workers,
+                                   memory=memory)
+        costs = list()
+        for p in patch_manifest:
+            engine = get_engine(p[u'patch_format'])
+            uncompressed = p.get(u'patch_mode') == settings.PATCH_MODE_TAR
+            costs.append(patch_cost(p[u'src'], p[u'dst'],
+                                    engine.memory_factor, uncompressed))
+
+        def record(index, patch):
+            self._record_patch(patch_manifest[index], patch)
+
+        pool_output = scheduler.run(_make_patch, patch_manifest, costs,
+                                    callback=record)
+        for p, stat in zip(patch_manifest, scheduler.stats):
+            if stat is None:
+                continue
+            name = u'{}-{}'.format(os.path.basename(p[u'patch_name']),
+                                   p[u'patch_num'])
+            elapsed, rss, error = stat
+            if error is not None:
+                log.error(u'Failed to create patch {}: {}'.format(name,
+                                                                 error))
+            if rss is not None:
+                rss = u'{:.1f}MB'.format(rss / 1024.0 ** 2)
+            log.info(u'Patch {} took {:.2f}s. Peak '
+                     u'RSS: {}'.format(name, elapsed, rss))
         return pool_output
 
+    def _record_patch(self, patch_info, patch):
+        # Saves each patch to the ledger as soon as it's made
+        if patch is None or patch.ready is False:
+            return
+        if not os.path.exists(patch.patch_name):
+            return
+        info = {
+            u'patch_name': os.path.basename(patch.patch_name),
+            u'patch_hash': gph(patch.patch_name),
+            u'patch_format': patch.patch_format,
+            u'patch_mode': patch.patch_mode,
+            u'patch_num': patch_info[u'patch_num'],
+            u'src': os.path.basename(patch_info[u'src']),
+            }
+        self.ledger.complete(patch_info[u'file_hash'], JobLedger.PATCHED,
+                             info)
+        self.ledger.save()
+
     def _add_patches_to_packages(self, package_manifest, patches):
         # ToDo: Increase the efficiency of this double for
         #       loop. Not sure if it can be done though
@@ -334,6 +541,11 @@ class PackageHandler(object):
                         else:
                             p_name = gph(p.patch_name)
                         pm.patch_info[u'patch_hash'] = p_name
+                        pm.patch_info[u'patch_format'] = p.patch_format
+                        if p.patch_mode is not None:
+                            pm.patch_info[u'patch_mode'] = p.patch_mode
+                            level = settings.ARCHIVE_COMPRESS_LEVEL
+                            pm.patch_info[u'compress_level'] = level
                         break
                     else:
                         log.debug('No patch match found')
@@ -342,6 +554,56 @@ class PackageHandler(object):
                 log.warning(u'No patches found')
         return package_manifest
 
+    def _store_chunks(self, package_manifest):
+        # Adds the chunks of new archives to the chunk store in the
+        # deploy dir & publishes a chunk index for each archive under
+        # the hash of the index
+        if self.chunk_store is not True:
+            return
+        log.info(u'Adding packages to chunk store')
+        packages = list()
+        jobs = list()
+        costs = list()
+        for p in package_manifest:
+            digest = self.ledger.get(p.file_hash, JobLedger.CHUNKED)
+            if digest is not None and \
+                    os.path.exists(self._object_path(digest)):
+                log.debug(u'Reusing chunk index of {}'.format(p.filename))
+                p.chunk_index = digest
+                continue
+            path = os.path.join(self.new_dir, p.filename)
+            # Normalized .tar.gz archives are chunked by their tar, so
+            # chunks are shared even though compression shifts bytes
+            tar = p.normalized is True and p.filename.endswith(u'.tar.gz')
+            packages.append(p)
+            jobs.append({u'path': path, u'tar': tar,
+                         u'deploy_dir': self.deploy_dir})
+            costs.append(chunk_cost(path, tar))
+        if len(jobs) == 0:
+            return
+
+        # Chunking is pure python, so archives are chunked on a
+        # process pool
+        memory = None
+        if self.patch_memory_limit is not None:
+            memory = self.patch_memory_limit * 1024 ** 2
+        scheduler = PatchScheduler(max_workers=self.patch_workers,
+                                   memory=memory)
+        results = scheduler.run(_chunk_archive, jobs, costs)
+        for p, result, stat in zip(packages, results, scheduler.stats):
+            if result is None:
+                log.error(u'Failed to chunk {}: {}'.format(p.filename,
+                                                          stat[2]))
+                continue
+            index, count, added = result
+            p.chunk_index = get_hash(index)
+            atomic_write(self._object_path(p.chunk_index), index)
+            log.info(u'{}: {} chunks, {} new. Took {:.2f}s'.format(
+                p.filename, count, added, stat[0]))
+            self.ledger.complete(p.file_hash, JobLedger.CHUNKED,
+                                 p.chunk_index)
+        self.ledger.save()
+
     def _update_version_file(self, json_data, package_manifest):
         # Updates version file with package meta-data
         log.info(u'Adding package meta-data to version manifest')
@@ -349,6 +611,8 @@ class PackageHandler(object):
         for p in package_manifest:
             patch_name = p.patch_info.get(u'patch_name')
             patch_hash = p.patch_info.get(u'patch_hash')
+            patch_format = p.patch_info.get(u'patch_format')
+            patch_mode = p.patch_info.get(u'patch_mode')
 
             # Converting info to version file format
             info = {u'file_hash': p.file_hash,
@@ -356,6 +620,18 @@ class PackageHandler(object):
             if patch_name and patch_hash:
                 info[u'patch_name'] = patch_name
                 info[u'patch_hash'] = patch_hash
+                if patch_format is not None:
+                    info[u'patch_format'] = patch_format
+                if patch_mode is not None:
+                    # Needed by clients to rebuild the archive
+                    info[u'patch_mode'] = patch_mode
+                    level = p.patch_info[u'compress_level']
+                    info[u'compress_level'] = level
+            if self.hashed_layout is True:
+                # Clients download the archive & patch by their hashes
+                info[u'layout'] = settings.DEPLOY_LAYOUT_HASHED
+            if p.chunk_index is not None:
+                info[u'chunk_index'] = p.chunk_index
 
             version_key = '{}*{}*{}'.format(settings.UPDATES_KEY,
                                             p.name, p.version)
@@ -384,8 +660,149 @@ class PackageHandler(object):
             # Will add each individual platform version update
             # to latest.  Now can update platforms independently
             json_data[u'latest'][p.name][p.platform] = p.version
+            self._update_channels(json_data, p)
         return json_data
 
+    def _update_channels(self, json_data, package):
+        # A release is the latest for its own channel & every less
+        # stable channel, unless that channel already has a newer one
+        version = Version(package.version)
+        channels = json_data.setdefault(settings.CHANNELS_KEY, {})
+        for channel, release in settings.CHANNELS.items():
+            if version.release < release:
+                continue
+            latest = channels.setdefault(channel, {})
+            latest = latest.setdefault(package.name, {})
+            current = latest.get(package.platform)
+            if current is None or Version(current) < version:
+                log.debug(u'Setting {} latest for {} {} to '
+                          u'{}'.format(channel, package.name,
+                                       package.platform, package.version))
+                latest[package.platform] = package.version
+
+    def _latest_versions(self, json_data):
+        # Yields (name, platform, version) for every latest & channel
+        # latest pointer in the version file
+        pointers = [json_data.get(u'latest', {})]
+        pointers += json_data.get(settings.CHANNELS_KEY, {}).values()
+        for latest in pointers:
+            for name, platforms in latest.items():
+                for plat, version in platforms.items():
+                    yield name, plat, version
+
+    def _prune_version_file(self, json_data):
+        # Removes releases outside of the retention policy from the
+        # version manifest so it doesn't grow forever. The retention
+        # count applies to each package, platform & channel. The latest
+        # release of each channel, package & platform is always kept.
+        # Returns the file names of the removed archives & patches.
+        pruned = list()
+        pruned_objects = set()
+        pruned_indexes = set()
+        if not self.retention_count and not self.retention_days:
+            return pruned
+        log.info(u'Pruning version manifest')
+        now = time.time()
+        released = self.config.get(u'released', {})
+        keep = set(self._latest_versions(json_data))
+        for name, versions in json_data[settings.UPDATES_KEY].items():
+            platforms = set()
+            for v in versions.values():
+                platforms.update(v.keys())
+            for plat in platforms:
+                times = released.get(name, {}).get(plat, {})
+                found = [v for v in versions.keys() if plat in versions[v]]
+                found.sort(key=Version, reverse=True)
+                # Releases are counted per channel so a run of betas
+                # doesn't push the stable releases out
+                counts = {}
+                for v in found:
+                    release = Version(v).release
+                    i = counts.get(release, 0)
+                    counts[release] = i + 1
+                    if (name, plat, v) in keep:
+                        continue
+                    expired = False
+                    if self.retention_count and i >= self.retention_count:
+                        expired = True
+                    # Releases made before retention was supported
+                    # have no time recorded & are only pruned by count
+                    if self.retention_days and v in times:
+                        age = now - times[v]
+                        if age > self.retention_days * 86400:
+                            expired = True
+                    if expired is False:
+                        continue
+                    log.info(u'Pruning {} {} {}'.format(name, v, plat))
+                    info = versions[v].pop(plat)
+                    times.pop(v, None)
+                    pruned.append(info[u'filename'])
+                    if info.get(u'patch_name'):
+                        pruned.append(info[u'patch_name'])
+                    if info.get(u'layout') == settings.DEPLOY_LAYOUT_HASHED:
+                        pruned_objects.add(info[u'file_hash'])
+                        if info.get(u'patch_hash'):
+                            pruned_objects.add(info[u'patch_hash'])
+                    if info.get(u'chunk_index'):
+                        pruned_objects.add(info[u'chunk_index'])
+                        pruned_indexes.add(info[u'chunk_index'])
+            for v in list(versions.keys()):
+                if len(versions[v]) == 0:
+                    del versions[v]
+        # Objects can be shared by releases of other packages &
+        # platforms. Only remove the ones nothing refers to anymore.
+        indexes = set()
+        for versions in json_data[settings.UPDATES_KEY].values():
+            for platforms in versions.values():
+                for info in platforms.values():
+                    pruned_objects.discard(info.get(u'file_hash'))
+                    pruned_objects.discard(info.get(u'patch_hash'))
+                    pruned_objects.discard(info.get(u'chunk_index'))
+                    if info.get(u'chunk_index'):
+                        indexes.add(info[u'chunk_index'])
+        pruned_chunks = set()
+        for digest in pruned_indexes & pruned_objects:
+            pruned_chunks.update(self._load_chunks(digest) or [])
+        if len(pruned_chunks) > 0:
+            for digest in indexes:
+                chunks = self._load_chunks(digest)
+                if chunks is None:
+                    # Can't tell which chunks a kept release uses
+                    log.warning(u'Missing chunk index {}. Not pruning '
+                                u'chunks'.format(digest))
+                    pruned_chunks = set()
+                    break
+                pruned_chunks.difference_update(chunks)
+        pruned += [get_object_path(o) for o in sorted(pruned_objects)]
+        pruned += [get_object_path(c, settings.DEPLOY_CHUNKS_FOLDER)
+                   for c in sorted(pruned_chunks)]
+        return pruned
+
+    def _load_chunks(self, digest):
+        # Returns the chunk hashes in the chunk index digest. None if
+        # the index isn't in the deploy dir or can't be read.
+        path = os.path.join(self.deploy_dir,
+                            *get_object_path(digest).split(u'/'))
+        if not os.path.exists(path):
+            return None
+        with open(path, u'rb') as f:
+            data = f.read()
+        try:
+            index = load_chunk_index(data)
+        except UtilsError:
+            return None
+        return set(c for c, _ in index[u'chunks'])
+
+    def _remove_pruned_files(self, pruned):
+        # Removes archives & patches of pruned releases from the
+        # files & deploy dirs.
+        for filename in pruned:
+            for d in [self.deploy_dir, self.files_dir]:
+                path = os.path.join(d, *filename.split(u'/'))
+                if os.path.exists(path):
+                    log.debug(u'Removing {}'.format(path))
+                    os.remove(path)
+
     def _write_json_to_file(self, json_data):
         # Writes json data to disk
         log.debug(u'Saving version meta-data')
@@ -396,30 +813,41 @@ class PackageHandler(object):
         self.db.save(settings.CONFIG_DB_KEY_PY_REPO_CONFIG, json_data)
 
     def _move_packages(self, package_manifest):
+        # The deploy copy is a hardlink & everything else is a rename,
+        # so no archive data is copied unless the dirs are on
+        # different devices
         if len(package_manifest) < 1:
             return
         log.info(u'Moving packages to deploy folder')
         for p in package_manifest:
             patch = p.patch_info.get(u'patch_name')
             with jms_utils.paths.ChDir(self.new_dir):
-                if patch:
-                    if os.path.exists(os.path.join(self.deploy_dir, patch)):
-                        os.remove(os.path.join(self.deploy_dir, patch))
-                    log.debug(u'Moving {} to {}'.format(patch,
-                              self.deploy_dir))
-                    if os.path.exists(patch):
-                        shutil.move(patch, self.deploy_dir)
-
-                shutil.copy(p.filename, self.deploy_dir)
-                log.debug(u'Copying {} to {}'.format(p.filename,
-                          self.deploy_dir))
-
-                if os.path.exists(os.path.join(self.files_dir, p.filename)):
-                    os.remove(os.path.join(self.files_dir, p.filename))
-                shutil.move(p.filename, self.files_dir)
+                if patch and os.path.exists(patch):
+                    if self.hashed_layout is True:
+                        dst = self._object_path(p.patch_info[u'patch_hash'])
+                    else:
+                        dst = os.path.join(self.deploy_dir, patch)
+                    log.debug(u'Moving {} to {}'.format(patch, dst))
+                    move_file(patch, dst)
+
+                if self.hashed_layout is True:
+                    dst = self._object_path(p.file_hash)
+                else:
+                    dst = os.path.join(self.deploy_dir, p.filename)
+                method = link_file(p.filename, dst)
+                log.debug(u'Added {} to {} by {}'.format(p.filename, dst,
+                                                         method))
+
+                move_file(p.filename, os.path.join(self.files_dir,
+                                                   p.filename))
                 log.debug(u'Moving {} to {}'.format(p.filename,
                           self.files_dir))
 
+    def _object_path(self, digest, folder=None):
+        # Path in the deploy dir of a file in the hashed layout or
+        # chunk store. Creates the parent dir.
+        return _object_path(self.deploy_dir, digest, folder)
+
     def _update_file_list(self, json_data, package_info):
         files = json_data[settings.UPDATES_KEY]
         latest = json_data.get(u'latest')
@@ -435,35 +863,26 @@ class PackageHandler(object):
             json_data[u'latest'][package_info.name] = {}
         return json_data
 
-    def _check_make_patch(self, json_data, name, platform):
+    def _check_make_patch(self, json_data, name, platform, channel=None,
+                          patch_mode=None):
         # Check to see if previous version is available to
-        # make patch updates
+        # make patch updates. Patches are made from the latest
+        # version on the package's channel
         # Also calculates patch number
         log.info('Checking if patch creation is possible')
-        if bsdiff4 is None:
-            log.warning(u'Bsdiff is missing. Cannot create patches')
+        patch_format = self._patch_format(name, patch_mode)
+        try:
+            engine = get_engine(patch_format)
+        except UtilsError as err:
+            log.error(str(err))
             return None
-        src_file_path = None
-        if os.path.exists(self.files_dir):
-            with jms_utils.paths.ChDir(self.files_dir):
-                files = os.listdir(os.getcwd())
-
-            files = remove_dot_files(files)
-            # No src files to patch from. Exit quickly
-            if len(files) == 0:
-                return None
-            # If latest not available in version file. Exit
-            try:
-                latest = json_data[u'latest'][name][platform]
-            except KeyError:
-                return None
-            try:
-                l_plat = json_data[settings.UPDATES_KEY][name][latest]
-                filename = l_plat[platform][u'filename']
-            except:
-                return None
-            src_file_path = os.path.join(self.files_dir, filename)
-
+        if engine.can_diff() is False:
+            log.warning(u'Cannot create {} patches on this '
+                        u'system'.format(patch_format))
+            return None
+        src_file_path = self._patch_source(json_data, name, platform,
+                                           channel)
+        if src_file_path is not None:
             try:
                 patch_num = self.config[u'patches'][name]
                 self.config[u'patches'][name] += 1
@@ -482,6 +901,50 @@ class PackageHandler(object):
             return src_file_path, num
         return None
 
+    def _patch_source(self, json_data, name, platform, channel=None):
+        # Returns path to the archive of the latest version on the
+        # package's channel or None if there isn't one
+        if self.src_files is None:
+            if not os.path.exists(self.files_dir):
+                return None
+            self.src_files = remove_dot_files(os.listdir(self.files_dir))
+        # No src files to patch from. Exit quickly
+        if len(self.src_files) == 0:
+            return None
+        # If latest not available in version file. Exit
+        try:
+            channels = json_data[settings.CHANNELS_KEY]
+            latest = channels[channel][name][platform]
+        except KeyError:
+            try:
+                latest = json_data[u'latest'][name][platform]
+            except KeyError:
+                return None
+        try:
+            l_plat = json_data[settings.UPDATES_KEY][name][latest]
+            filename = l_plat[platform][u'filename']
+        except:
+            return None
+        return os.path.join(self.files_dir, filename)
+
+    def _patch_format(self, name, patch_mode=None):
+        # Returns the diff engine format id for a package. Engines made
+        # for tar payloads fall back to the default for anything else
+        patch_format = self.patch_engines.get(name, self.patch_engine)
+        if patch_mode == settings.PATCH_MODE_TAR:
+            return patch_format
+        try:
+            tar_only = get_engine(patch_format).tar_only
+        except UtilsError:
+            # Reported by _check_make_patch
+            return patch_format
+        if tar_only is True:
+            log.info(u'{} patches need PATCH_UNCOMPRESSED & a .tar.gz '
+                     u'archive. Using {}'.format(
+                         patch_format, settings.DEFAULT_PATCH_FORMAT))
+            return settings.DEFAULT_PATCH_FORMAT
+        return patch_format
+
 
 def _make_patch(patch_info):
     # Does with the name implies. Used with multiprocessing
@@ -502,9 +965,75 @@ def _make_patch(patch_info):
         if patch.ready is True:
             log.info(u"Creating patch... "
                      u"{}".format(os.path.basename(patch_name)))
-            bsdiff4.file_diff(src_path, patch.dst_path, patch.patch_name)
+            engine = get_engine(patch.patch_format)
+            if patch.patch_mode == settings.PATCH_MODE_TAR:
+                _diff_uncompressed(engine, src_path, patch.dst_path,
+                                   patch.patch_name)
+            else:
+                engine.diff(src_path, patch.dst_path, patch.patch_name)
             base_name = os.path.basename(patch_name)
             log.info(u'Done creating patch... {}'.format(base_name))
         else:
             log.error(u'Missing patch attr')
     return patch
+
+
+def _object_path(deploy_dir, digest, folder=None):
+    # Path in deploy_dir of a file in the hashed layout or chunk
+    # store. Creates the parent dir, which other workers may create
+    # at the same time.
+    path = os.path.join(deploy_dir,
+                        *get_object_path(digest, folder).split(u'/'))
+    parent = os.path.dirname(path)
+    try:
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+    except OSError:
+        if not os.path.isdir(parent):
+            raise
+    return path
+
+
+def _chunk_archive(job):
+    # Adds the chunks of an archive to the chunk store. Used with
+    # multiprocessing. Returns the chunk index, the chunk count & the
+    # number of chunks that weren't in the store yet.
+    with open(job[u'path'], u'rb') as f:
+        payload = f.read()
+    mode = None
+    level = None
+    if job[u'tar'] is True:
+        payload = get_payload(payload, settings.PATCH_MODE_TAR)
+        mode = settings.PATCH_MODE_TAR
+        level = settings.ARCHIVE_COMPRESS_LEVEL
+
+    chunks = []
+    added = 0
+    for chunk_hash, chunk in split_chunks(payload):
+        chunks.append((chunk_hash, len(chunk)))
+        path = _object_path(job[u'deploy_dir'], chunk_hash,
+                            settings.DEPLOY_CHUNKS_FOLDER)
+        if not os.path.exists(path):
+            atomic_write(path, compress_chunk(chunk))
+            added += 1
+    return make_chunk_index(chunks, mode, level), len(chunks), added
+
+
+def _diff_uncompressed(engine, src_path, dst_path, patch_path):
+    # Diffs the tar payloads of two .tar.gz archives. Small changes
+    # reshuffle the whole deflate stream so diffing the compressed
+    # archives gives patches almost as big as the archive.
+    temp_dir = tempfile.mkdtemp()
+    try:
+        paths = []
+        for path in [src_path, dst_path]:
+            with open(path, u'rb') as f:
+                data = gzip_decompress(f.read())
+            tar_path = os.path.join(temp_dir, u'{}.tar'.format(len(paths)))
+            with open(tar_path, u'wb') as f:
+                f.write(data)
+            paths.append(tar_path)
+            del data
+        engine.diff(paths[0], paths[1], patch_path)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
@@ -0,0 +1,159 @@
+# --------------------------------------------------------------------------
+# Copyright 2014 Digital Sapphire Development Team
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# --------------------------------------------------------------------------
+from __future__ import unicode_literals
+import logging
+import os
+
+from pyupdater import settings
+
+log = logging.getLogger(__name__)
+
+
+class JobLedger(object):
+    """Remembers the work pkg --process has done on packages in the new
+    folder so an aborted run can be resumed & a re-run doesn't hash or
+    patch the same archive twice.
+
+    Jobs are keyed by archive digest. The digest of a file is reused
+    while its size & mtime don't change.
+
+    Args:
+
+        db (obj): Storage the ledger is saved to
+    """
+
+    # Stages of a job in the order they complete. Once a package has
+    # been moved out of the new folder its job is removed.
+    PATCHED = 'patched'
+    CHUNKED = 'chunked'
+    MANIFEST = 'manifest'
+
+    def __init__(self, db):
+        self.db = db
+        data = db.load(settings.CONFIG_DB_KEY_JOB_LEDGER)
+        if data is None:
+            data = {}
+        # filename: {size, mtime, digest, normalized}
+        self.files = data.setdefault('files', {})
+        # digest: {stage: info}
+        self.jobs = data.setdefault('jobs', {})
+        self.data = data
+
+    def get_digest(self, path, normalized=False):
+        """Returns the recorded digest of a file
+
+        Args:
+
+            path (str): Path to file
+
+        Kwargs:
+
+            normalized (bool): Only return digests recorded after the
+                               archive was normalized
+
+        Returns:
+
+            (str): Digest or None if the file changed since it was
+                   recorded
+        """
+        entry = self.files.get(os.path.basename(path))
+        if entry is None:
+            return None
+        if normalized is True and entry.get('normalized') is not True:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if entry['size'] != st.st_size or entry['mtime'] != st.st_mtime:
+            return None
+        return entry['digest']
+
+    def set_digest(self, path, digest, normalized=False):
+        """Records the digest of a file with its current size & mtime
+
+        Args:
+
+            path (str): Path to file
+
+            digest (str): Digest of file
+
+        Kwargs:
+
+            normalized (bool): The archive has been normalized
+        """
+        st = os.stat(path)
+        self.files[os.path.basename(path)] = {
+            'size': st.st_size,
+            'mtime': st.st_mtime,
+            'digest': digest,
+            'normalized': normalized,
+            }
+
+    def get(self, digest, stage):
+        """Returns (obj): Info recorded when stage completed or None if
+        it hasn't
+        """
+        return self.jobs.get(digest, {}).get(stage)
+
+    def complete(self, digest, stage, info=True):
+        """Records a completed stage of a job
+
+        Args:
+
+            digest (str): Digest of package
+
+            stage (str): JobLedger.PATCHED, CHUNKED or MANIFEST
+
+        Kwargs:
+
+            info (obj): Json serializable info needed to resume
+        """
+        log.debug('{} complete for {}'.format(stage, digest))
+        self.jobs.setdefault(digest, {})[stage] = info
+
+    def finish(self, digest):
+        """Removes a job & the files recorded with its digest
+
+        Args:
+
+            digest (str): Digest of package
+        """
+        self.jobs.pop(digest, None)
+        for filename, entry in list(self.files.items()):
+            if entry['digest'] == digest:
+                del self.files[filename]
+
+    def prune(self, filenames):
+        """Forgets files that are gone & their jobs
+
+        Args:
+
+            filenames (list): Files still in the new folder
+        """
+        filenames = set(filenames)
+        for filename in list(self.files.keys()):
+            if filename not in filenames:
+                del self.files[filename]
+        digests = set(e['digest'] for e in self.files.values())
+        for digest in list(self.jobs.keys()):
+            if digest not in digests:
+                del self.jobs[digest]
+
+    def save(self):
+        "Saves the ledger & syncs the database to disk"
+        self.db.save(settings.CONFIG_DB_KEY_JOB_LEDGER, self.data)
+        self.db.sync_db(force=True)
@@ -18,7 +18,8 @@ import os
 import re
 
 from pyupdater.exceptions import UtilsError, VersionError
-from pyupdater.utils import (get_package_hashes,
+from pyupdater.utils import (get_archive_format,
+                             get_package_hashes,
                              parse_platform,
                              Version,
                              )
@@ -38,6 +39,8 @@ class Patch(object):
         self.dst_path = patch_info.get(u'dst')
         self.patch_name = patch_info.get(u'patch_name')
         self.dst_filename = patch_info.get(u'package')
+        self.patch_format = patch_info.get(u'patch_format')
+        self.patch_mode = patch_info.get(u'patch_mode')
         self.ready = self._check_attrs()
 
     def _check_attrs(self):
@@ -59,21 +62,26 @@ class Package(object):
     Args:
 
         filename (str): name of update file
+
+    Kwargs:
+
+        file_hash (str): Known hash of update file. Skips hashing
     """
 
-    def __init__(self, filename):
+    def __init__(self, filename, file_hash=None):
         self.name = None
         self.version = None
+        self.channel = None
         self.filename = filename
         self.version_path = None
-        self.file_hash = None
+        self.file_hash = file_hash
         self.platform = None
         self.info = {'status': False, 'reason': ''}
         self.patch_info = {}
-        # seems to produce the best diffs.
-        # Tests on homepage: https://github.com/JohnyMoSwag/PyiUpdater
-        # Zip doesn't keep +x permissions. Only using gz for now.
-        self.supported_extensions = [u'.zip', u'.gz']
+        # Hash of the chunk index when the chunk store is enabled
+        self.chunk_index = None
+        # Set once the archive was normalized by normalize_archive
+        self.normalized = False
         self.ignored_files = [u'.DS_Store', ]
         self.extract_info(filename)
 
@@ -87,8 +95,7 @@ class Package(object):
         if package in self.ignored_files:
             log.debug('Ignored file: {}'.format(package))
             return
-        if os.path.splitext(package)[1].lower() not in \
-                self.supported_extensions:
+        if get_archive_format(package) is None:
             msg = u'Not a supported archive format: {}'.format(package)
             self.info['reason'] = msg
             log.warning(msg)
@@ -96,7 +103,9 @@ class Package(object):
 
         log.info(u'Extracting update archive info for: {}'.format(package))
         try:
-            self.version = str(Version(package))
+            version = Version(package)
+            self.version = str(version)
+            self.channel = version.channel
         except (UtilsError, VersionError):
             msg = u'Package version not formatted correctly'
             self.info[u'reason'] = msg
@@ -113,7 +122,8 @@ class Package(object):
 
         # No need to get any more info if above failed
         self.name = self._get_package_name(package)
-        self.file_hash = get_package_hashes(package)
+        if self.file_hash is None:
+            self.file_hash = get_package_hashes(package)
         self.info[u'status'] = True
         log.info('Info extraction complete')
 
@@ -0,0 +1,311 @@
+# --------------------------------------------------------------------------
+# Copyright 2014 Digital Sapphire Development Team
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# --------------------------------------------------------------------------
+from __future__ import unicode_literals
+import logging
+import multiprocessing
+import os
+import struct
+import sys
+import time
+
+try:  # pragma: no cover
+    from multiprocessing import SimpleQueue
+except ImportError:  # pragma: no cover
+    from multiprocessing.queues import SimpleQueue
+
+try:  # pragma: no cover
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+from pyupdater import settings
+
+log = logging.getLogger(__name__)
+
+
+def available_memory():
+    """Returns (int): Bytes of memory available for new processes or
+    None if it can't be determined on this platform.
+    """
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    try:
+        pages = os.sysconf(str('SC_AVPHYS_PAGES'))
+        page_size = os.sysconf(str('SC_PAGE_SIZE'))
+        return pages * page_size
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def _file_size(path, uncompressed=False):
+    size = os.path.getsize(path)
+    if uncompressed is True and path.endswith('.gz') and size >= 4:
+        # Gzip trailer holds the uncompressed size mod 2 ** 32
+        with open(path, 'rb') as f:
+            f.seek(-4, os.SEEK_END)
+            size = struct.unpack(str('<I'), f.read(4))[0]
+    return size
+
+
+def patch_cost(src, dst, memory_factor=None, uncompressed=False):
+    """Estimated peak memory needed to diff src into dst. bsdiff holds
+    both files plus a suffix array of the source in memory.
+
+    Args:
+
+        src (str): Path to source file
+
+        dst (str): Path to destination file
+
+    Kwargs:
+
+        memory_factor (int): Memory needed per byte of source. Defaults
+                             to what bsdiff needs
+
+        uncompressed (bool): Patch is made from the uncompressed tar
+                             of .tar.gz archives
+
+    Returns:
+
+        (int): Bytes
+    """
+    if memory_factor is None:
+        memory_factor = settings.PATCH_MEMORY_FACTOR
+    cost = 0
+    if os.path.exists(src):
+        cost += _file_size(src, uncompressed) * memory_factor
+    if os.path.exists(dst):
+        cost += _file_size(dst, uncompressed)
+    return cost
+
+
+def chunk_cost(path, uncompressed=False):
+    """Estimated peak memory needed to chunk an archive. The chunker
+    holds the payload & a copy it hashes.
+
+    Args:
+
+        path (str): Path to archive
+
+    Kwargs:
+
+        uncompressed (bool): The archive is chunked by the uncompressed
+                             tar of a .tar.gz archive
+
+    Returns:
+
+        (int): Bytes
+    """
+    return _file_size(path) + _file_size(path, uncompressed) * 2
+
+
+def _peak_rss():
+    # Peak resident set size of the current process in bytes
+    if resource is None:  # pragma: no cover
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes
+    if sys.platform != 'darwin':
+        rss *= 1024
+    return rss
+
+
+# Set in each worker process by _init_worker
+_started = None
+
+
+def _init_worker(started):
+    global _started
+    _started = started
+
+
+def _run_job(args):
+    # Runs in the worker process. Errors are returned instead of
+    # raised so the scheduler always gets its memory back.
+    func, job, index = args
+    # Lets the scheduler notice if this worker dies mid job
+    if _started is not None:
+        _started.put((index, os.getpid()))
+    start = time.time()
+    error = None
+    try:
+        result = func(job)
+    except Exception as err:
+        log.debug(str(err), exc_info=True)
+        result = None
+        error = str(err)
+    return result, time.time() - start, _peak_rss(), error
+
+
+class PatchScheduler(object):
+    """Runs memory hungry jobs, i.e. patch creation, on a process pool
+    without running more at once than memory allows.
+
+    Each worker process handles a single job so memory is given back
+    to the os as soon as a job is done.
+
+    Kwargs:
+
+        max_workers (int): Most jobs to run at once. Defaults to cpu
+                           count
+
+        memory (int): Memory budget in bytes. Defaults to memory
+                      currently available
+    """
+
+    def __init__(self, max_workers=None, memory=None):
+        if max_workers is None:
+            max_workers = multiprocessing.cpu_count()
+        self.max_workers = max(1, max_workers)
+        if memory is None:
+            memory = available_memory()
+        self.memory = memory
+        # Seconds between checks on running jobs
+        self.poll_interval = 0.05
+        # Seconds a job's worker may be gone before its result shows up
+        self.dead_worker_grace = 2
+        # (seconds, peak rss in bytes, error) for each job
+        self.stats = []
+
+    def run(self, func, jobs, costs, callback=None):
+        """Runs func on every job. A job is only started if its cost
+        fits the memory budget next to the jobs already running. A job
+        is always started if nothing else is running.
+
+        Args:
+
+            func (func): Module level function to run. Must be picklable
+
+            jobs (list): Arguments for func
+
+            costs (list): Estimated memory in bytes each job needs
+
+        Kwargs:
+
+            callback (func): Called with the index & result of each job
+                             as it finishes
+
+        Returns:
+
+            (list): Results of func in the same order as jobs. None for
+                    jobs that failed, including jobs whose worker died
+        """
+        results = [None] * len(jobs)
+        self.stats = [None] * len(jobs)
+        if len(jobs) == 0:
+            return results
+        if self.memory is not None:
+            log.debug('Patch memory budget: {}MB'.format(self.memory //
+                                                         1024 ** 2))
+
+        # index: [async result, cost, start time, worker pid,
+        #         time the worker was first seen dead]
+        running = {}
+        # Used memory
+        used = [0]
+        # Pool can't be closed cleanly once a task is lost with its worker
+        lost = []
+
+        def done(index, output):
+            cost = running.pop(index)[1]
+            used[0] -= cost
+            results[index] = output[0]
+            self.stats[index] = output[1:]
+            if output[3] is not None:
+                log.error('Job failed: {}'.format(output[3]))
+            if callback is not None:
+                try:
+                    callback(index, output[0])
+                except Exception as err:
+                    log.error('Job callback failed: {}'.format(err))
+                    log.debug(str(err), exc_info=True)
+
+        def fits(cost):
+            if len(running) == 0:
+                return True
+            if len(running) >= self.max_workers:
+                return False
+            return self.memory is None or used[0] + cost <= self.memory
+
+        def read_started():
+            while started.empty() is False:
+                index, pid = started.get()
+                if index in running:
+                    running[index][3] = pid
+
+        def worker_died(entry, alive):
+            # maxtasksperchild=1 so a worker also exits after sending a
+            # result. Only call it dead if no result shows up in time.
+            if entry[3] is None or entry[3] in alive:
+                return False
+            if entry[4] is None:
+                entry[4] = time.time()
+            return time.time() - entry[4] > self.dead_worker_grace
+
+        def reap(pool):
+            read_started()
+            alive = set(w.pid for w in pool._pool if w.is_alive())
+            for index, entry in list(running.items()):
+                output = None
+                if entry[0].ready():
+                    try:
+                        output = entry[0].get(0)
+                    # i.e. MaybeEncodingError for unpicklable results
+                    except Exception as err:
+                        output = (None, time.time() - entry[2], None,
+                                  str(err))
+                elif worker_died(entry, alive):
+                    lost.append(index)
+                    output = (None, time.time() - entry[2], None,
+                              'Worker process {} died'.format(entry[3]))
+                if output is not None:
+                    done(index, output)
+
+        # Biggest jobs first so small ones fill the gaps
+        order = sorted(range(len(jobs)), key=lambda i: costs[i],
+                       reverse=True)
+        processes = min(self.max_workers, len(jobs))
+        # Unlike Queue, put doesn't return before the pid is sent
+        started = SimpleQueue()
+        pool = multiprocessing.Pool(processes=processes, maxtasksperchild=1,
+                                    initializer=_init_worker,
+                                    initargs=(started,))
+        try:
+            while len(order) > 0 or len(running) > 0:
+                while len(order) > 0 and fits(costs[order[0]]):
+                    i = order.pop(0)
+                    result = pool.apply_async(_run_job,
+                                              ((func, jobs[i], i),))
+                    running[i] = [result, costs[i], time.time(), None, None]
+                reap(pool)
+                if len(running) > 0:
+                    time.sleep(self.poll_interval)
+        except BaseException:
+            pool.terminate()
+            raise
+        else:
+            if len(lost) > 0:
+                pool.terminate()
+            else:
+                pool.close()
+        finally:
+            pool.join()
+        return results
@@ -28,6 +28,9 @@ CONFIG_DB_KEY_APP_CONFIG = 'app_config'
 CONFIG_DB_KEY_KEYS = 'signing_keys'
 CONFIG_DB_KEY_VERSION_META = 'version_meta'
 CONFIG_DB_KEY_PY_REPO_CONFIG = 'py_repo_config'
+CONFIG_DB_KEY_JOB_LEDGER = 'job_ledger'
+CONFIG_DB_KEY_UPLOAD_INVENTORY = 'upload_inventory'
+CONFIG_DB_KEY_MULTIPART_UPLOADS = 'multipart_uploads'
 
 GENERIC_APP_NAME = 'PyUpdater App'
 GENERIC_COMPANY_NAME = 'PyUpdater'
@@ -39,21 +42,107 @@ LOG_FILENAME_DEBUG = 'pyu-debug.log'
 # Used for plugins
 UPLOAD_PLUGIN_NAMESPACE = 'pyupdater.plugins.uploaders'
 
+# Files uploaded at once, retries of a failed upload & seconds to wait
+# before the first retry. The wait doubles with each retry.
+UPLOAD_WORKERS = 4
+UPLOAD_RETRIES = 3
+UPLOAD_RETRY_DELAY = 1.0
+
+# Files this large are uploaded in parts by uploaders with multipart
+# support. A failed upload only resends the parts that didn't arrive.
+MULTIPART_THRESHOLD = 64 * 1024 * 1024
+MULTIPART_PART_SIZE = 16 * 1024 * 1024
+
 # Name of client config file
 USER_CLIENT_CONFIG_FILENAME = 'client_config.py'
 
 # Main user visible data folder
 USER_DATA_FOLDER = 'pyu-data'
 
+# Deploy layout storing files under their sha256 in DEPLOY_OBJECTS_FOLDER
+DEPLOY_LAYOUT_HASHED = 'hashed'
+DEPLOY_OBJECTS_FOLDER = 'objects'
+
+# Folder in the deploy dir holding the chunk store
+DEPLOY_CHUNKS_FOLDER = 'chunks'
+
+# Chunk sizes of the chunk store. Chunks are cut where the content
+# matches, so about CHUNK_AVG_SIZE apart.
+CHUNK_MIN_SIZE = 16 * 1024
+CHUNK_AVG_SIZE = 64 * 1024
+CHUNK_MAX_SIZE = 256 * 1024
+
+# Chunks a client downloads at once
+CHUNK_DOWNLOAD_WORKERS = 4
+
 # Name of env var to get users passwrod from
 USER_PASS_ENV = 'PYUPDATER_PASS'
 
+# Block size used when hashing files
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Patch format used when none is configured & for patches made
+# before formats were recorded in the version file
+DEFAULT_PATCH_FORMAT = 'bsdiff4'
+
+# Block size used by the block diff engine
+PATCH_BLOCK_SIZE = 4096
+
+# Patches made from the uncompressed tar inside .tar.gz archives
+PATCH_MODE_TAR = 'tar'
+
+# Compression level used when creating & normalizing archives
+ARCHIVE_COMPRESS_LEVEL = 9
+
+# Archive formats the builder can create by their extension. Named
+# like the formats of shutil.make_archive
+ARCHIVE_FORMATS = {
+    'gztar': '.tar.gz',
+    'bztar': '.tar.bz2',
+    'xztar': '.tar.xz',
+    'zip': '.zip',
+    }
+
+# Compression level used by formats other than gzip when none is
+# given. xz presets above 6 need a lot more memory to decompress.
+ARCHIVE_COMPRESS_LEVELS = {'bztar': 9, 'xztar': 6}
+
+# Modification time of archive members, 1980-01-01. The earliest
+# time zip archives can store.
+ARCHIVE_MTIME = 315532800
+
+# bsdiff needs about this many times the source file size in
+# memory to create a patch
+PATCH_MEMORY_FACTOR = 17
+
 # Key in version file where value are update meta data
 UPDATES_KEY = 'updates'
 
+# Key in version file where per channel latest versions are kept
+CHANNELS_KEY = 'channels'
+
+# Release channels mapped to Version.release. A channel also gets
+# the releases of every channel more stable than itself.
+CHANNELS = {'stable': 2, 'beta': 1, 'alpha': 0}
+DEFAULT_CHANNEL = 'stable'
+
 # Folder on client system where updates are stored
 UPDATE_FOLDER = 'update'
 
 # Name of version file place in online repo
 VERSION_FILE = 'versions.gz'
 VERSION_FILE_OLD = 'version.json'
+
+# Name of compact binary version file placed in online repo
+VERSION_FILE_BINARY = 'versions.bin.gz'
+
+# Name of detached signature file for VERSION_FILE
+VERSION_FILE_SIG = 'versions.sig'
+
+# Per channel version file & detached signature file
+VERSION_FILE_CHANNEL = 'versions-{}.gz'
+VERSION_FILE_CHANNEL_SIG = 'versions-{}.sig'
+
+# Client side cache of verified version file digests
+VERIFIED_CACHE_FILE = 'verified.json'
+VERIFIED_CACHE_SIZE = 10
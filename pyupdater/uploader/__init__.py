@@ -14,13 +14,16 @@
 # limitations under the License.
 # --------------------------------------------------------------------------
 import logging
+from multiprocessing.pool import ThreadPool
 import os
 import sys
 import time
 
 from pyupdater.exceptions import UploaderError, UploaderPluginError
 from pyupdater import settings
-from pyupdater.utils import (lazy_import,
+from pyupdater.utils import (convert_to_list,
+                             get_package_hashes,
+                             lazy_import,
                              remove_dot_files)
 
 log = logging.getLogger(__name__)
@@ -36,6 +39,20 @@ def stevedore():
 ns = settings.UPLOAD_PLUGIN_NAMESPACE
 
 
+def get_manifest_files():
+    """Returns (list): Names of the version files in the order they
+    are published. Each signature follows the file it signs.
+    """
+    files = [settings.VERSION_FILE_OLD]
+    for channel in sorted(settings.CHANNELS.keys()):
+        files.append(settings.VERSION_FILE_CHANNEL.format(channel))
+        files.append(settings.VERSION_FILE_CHANNEL_SIG.format(channel))
+    files += [settings.VERSION_FILE_BINARY,
+              settings.VERSION_FILE,
+              settings.VERSION_FILE_SIG]
+    return files
+
+
 class Uploader(object):
     """Uploads updates to configured servers.  SSH, SFTP, S3
     Will automatically pick the correct uploader depending on
@@ -46,21 +63,29 @@ class Uploader(object):
         Args:
 
             obj (instance): config object
+
+        Kwargs:
+
+            db (obj): Storage the upload inventory is kept in
     """
-    def __init__(self, app=None):
+    def __init__(self, app=None, db=None):
         if app:
-            self.init_app(app)
+            self.init_app(app, db)
 
     # ToDo: Remove in v1.0
-    def init_app(self, obj):
-        self.init(obj)
+    def init_app(self, obj, db=None):
+        self.init(obj, db)
 
-    def init(self, obj):
+    def init(self, obj, db=None):
         """Sets up client with config values from obj
 
         Args:
 
             obj (instance): config object
+
+        Kwargs:
+
+            db (obj): Storage the upload inventory is kept in
         """
         data_dir = obj.get(u'DATA_DIR', os.getcwd())
         self.data_dir = os.path.join(data_dir, settings.USER_DATA_FOLDER)
@@ -69,8 +94,17 @@ class Uploader(object):
         self.ssh_host = obj.get(u'SSH_HOST')
         self.ssh_username = obj.get(u'SSH_USERNAME')
         self.object_bucket = obj.get(u'OBJECT_BUCKET')
+        # Used by the built in local & http uploaders
+        self.upload_dir = obj.get(u'UPLOAD_DIR')
+        self.upload_url = obj.get(u'UPLOAD_URL')
+        self.upload_workers = obj.get(u'UPLOAD_WORKERS')
+        self.upload_retries = obj.get(u'UPLOAD_RETRIES')
         self.uploader = None
         self.test = False
+        self.db = db
+        # Files handed to the uploader & where they are uploaded to
+        self.files = []
+        self.destination = None
 
         # Extension Manager
         self.mgr = stevedore.extension.ExtensionManager(namespace=ns)
@@ -80,23 +114,42 @@ class Uploader(object):
         Only calls the upload method if an uploader is set.
         """
         if self.uploader is not None:
+            if self.destination is not None and len(self.files) == 0:
+                log.info(u'Nothing to upload. All files were uploaded '
+                         u'before')
+                return
             self.uploader.deploy_dir = self.deploy_dir
+            if self.upload_workers is not None:
+                self.uploader.upload_workers = self.upload_workers
+            if self.upload_retries is not None:
+                self.uploader.upload_retries = self.upload_retries
+            self.uploader.multipart_uploads = self._load_multipart()
             try:
                 self.uploader.upload()
             except Exception as err:  # pragma: no cover
                 log.error('Failed to upload: {}'.format(str(err)))
                 log.debug(str(err), exc_info=True)
+                self._record_multipart()
                 sys.exit(str(err))
+            self._record_uploads()
+            self._record_multipart()
         else:
             raise UploaderError(u'Must call set_uploader first', expected=True)
 
-    def set_uploader(self, requested_uploader):
+    def set_uploader(self, requested_uploader, upload_all=False):
         """Returns an uploader object. 1 of S3, SCP, SFTP.
         SFTP uploaders not supported at this time.
 
+        Only files that are new or changed since the last upload to the
+        same destination are handed to the uploader.
+
         Args:
 
-            requested_uploader (string): Either s3 or scp
+            requested_uploader (string): s3, scp, local or http
+
+        Kwargs:
+
+            upload_all (bool): Upload every file in the deploy dir
 
         Returns:
 
@@ -122,25 +175,193 @@ class Uploader(object):
         self.uploader = plugin.plugin()
         msg = u'Requested uploader: {}'.format(requested_uploader)
         log.debug(msg)
-        try:
-            files = os.listdir(self.deploy_dir)
-        except OSError:
-            files = []
-        files = remove_dot_files(files)
+        files = self._get_files()
+        self.destination = u':'.join([requested_uploader,
+                                     self.object_bucket or u'',
+                                     self.ssh_host or u'',
+                                     self.ssh_remote_dir or u'',
+                                     u','.join(convert_to_list(
+                                         self.upload_dir or [], [])),
+                                     self.upload_url or u''])
+        if upload_all is False:
+            files = self._changed_files(files)
+        self.files = files
         self.uploader.init(object_bucket=self.object_bucket,
                            ssh_username=self.ssh_username,
                            ssh_remote_dir=self.ssh_remote_dir,
                            ssh_host=self.ssh_host,
+                           upload_dir=self.upload_dir,
+                           upload_url=self.upload_url,
                            files=files)
 
+    def _load_inventory(self):
+        # Files uploaded to the destination by their path relative to
+        # the deploy dir. {path: {size, mtime, sha256}}
+        if self.db is None:
+            return {}
+        data = self.db.load(settings.CONFIG_DB_KEY_UPLOAD_INVENTORY)
+        if data is None:
+            data = {}
+        return data.get(self.destination, {})
+
+    def _changed_files(self, files):
+        # Returns the files that aren't in the inventory or changed
+        # since they were uploaded
+        inventory = self._load_inventory()
+        changed = []
+        touched = False
+        for f in files:
+            entry = inventory.get(f)
+            if entry is None:
+                changed.append(f)
+                continue
+            # Files in the hashed layout & chunk store are named after
+            # their content, so they never change
+            folder = f.split(u'/')[0]
+            if folder in [settings.DEPLOY_OBJECTS_FOLDER,
+                          settings.DEPLOY_CHUNKS_FOLDER] and f != folder:
+                continue
+            path = os.path.join(self.deploy_dir, *f.split(u'/'))
+            st = os.stat(path)
+            if entry[u'size'] != st.st_size:
+                changed.append(f)
+            elif entry[u'mtime'] != st.st_mtime:
+                if entry[u'sha256'] != get_package_hashes(path):
+                    changed.append(f)
+                else:
+                    # Only touched. Not hashed again next time
+                    entry[u'mtime'] = st.st_mtime
+                    touched = True
+        if touched is True:
+            self._save_inventory(inventory)
+        log.info(u'{} of {} files changed since the last '
+                 u'upload'.format(len(changed), len(files)))
+        return changed
+
+    def _save_inventory(self, inventory):
+        # Replaces the inventory of the destination
+        if self.db is None or self.destination is None:
+            return
+        data = self.db.load(settings.CONFIG_DB_KEY_UPLOAD_INVENTORY)
+        if data is None:
+            data = {}
+        data[self.destination] = inventory
+        self.db.save(settings.CONFIG_DB_KEY_UPLOAD_INVENTORY, data)
+
+    def _record_uploads(self):
+        # Adds the uploaded files to the inventory. Files no longer
+        # in the deploy dir are forgotten.
+        if self.db is None or self.destination is None:
+            return
+        current = set(self._get_files())
+        inventory = dict((k, v) for k, v in self._load_inventory().items()
+                         if k in current)
+        failed = set(self.uploader.failed_uploads)
+        for f in self.files:
+            if f in failed:
+                continue
+            path = os.path.join(self.deploy_dir, *f.split(u'/'))
+            st = os.stat(path)
+            inventory[f] = {u'size': st.st_size,
+                            u'mtime': st.st_mtime,
+                            u'sha256': get_package_hashes(path)}
+        self._save_inventory(inventory)
+
+    def _load_multipart(self):
+        # Unfinished multipart uploads to the destination of files
+        # that haven't changed since
+        if self.db is None or self.destination is None:
+            return {}
+        data = self.db.load(settings.CONFIG_DB_KEY_MULTIPART_UPLOADS)
+        if data is None:
+            data = {}
+        uploads = {}
+        for f, entry in data.get(self.destination, {}).items():
+            path = os.path.join(self.deploy_dir, *f.split(u'/'))
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if entry[u'size'] == st.st_size and \
+                    entry[u'mtime'] == st.st_mtime:
+                uploads[f] = entry[u'upload_id']
+        return uploads
+
+    def _record_multipart(self):
+        # Keeps the ids of unfinished multipart uploads so the next run
+        # resumes them
+        if self.db is None or self.destination is None:
+            return
+        data = self.db.load(settings.CONFIG_DB_KEY_MULTIPART_UPLOADS)
+        if data is None:
+            data = {}
+        uploads = {}
+        for f, upload_id in self.uploader.multipart_uploads.items():
+            path = os.path.join(self.deploy_dir, *f.split(u'/'))
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            uploads[f] = {u'upload_id': upload_id,
+                          u'size': st.st_size,
+                          u'mtime': st.st_mtime}
+        data[self.destination] = uploads
+        self.db.save(settings.CONFIG_DB_KEY_MULTIPART_UPLOADS, data)
+
+    def _get_files(self):
+        # Files in the deploy dir, the objects of the hashed layout &
+        # the chunk store relative to the deploy dir
+        try:
+            files = os.listdir(self.deploy_dir)
+        except OSError:
+            files = []
+        files = remove_dot_files(files)
+        for folder in [settings.DEPLOY_OBJECTS_FOLDER,
+                       settings.DEPLOY_CHUNKS_FOLDER]:
+            if folder not in files:
+                continue
+            files.remove(folder)
+            folder_dir = os.path.join(self.deploy_dir, folder)
+            for root, dirs, filenames in os.walk(folder_dir):
+                dirs.sort()
+                rel = os.path.relpath(root, self.deploy_dir)
+                rel = u'/'.join(rel.split(os.sep))
+                for f in sorted(remove_dot_files(filenames)):
+                    files.append(u'{}/{}'.format(rel, f))
+        return files
+
 
 class BaseUploader(object):
     """Base Uploader.  All uploaders should subclass
     this base class
+
+    Subclasses only have to implement :meth:`upload_file`. Uploaders
+    that can't upload from more than one thread at a time should set
+    upload_workers to 1.
+
+    Uploaders for services with multipart uploads can also implement
+    :meth:`init_multipart`, :meth:`upload_part`,
+    :meth:`complete_multipart` & :meth:`list_parts` & set multipart to
+    True. Files of multipart_threshold bytes or more are then uploaded
+    in parts of multipart_part_size bytes, upload_workers at a time. A
+    retry, or the next run, only uploads the parts that are missing.
     """
+
+    # Files uploaded at once
+    upload_workers = settings.UPLOAD_WORKERS
+    # Retries of a failed upload & seconds to wait before the first
+    upload_retries = settings.UPLOAD_RETRIES
+    upload_retry_delay = settings.UPLOAD_RETRY_DELAY
+    # Set by uploaders implementing the multipart methods
+    multipart = False
+    multipart_threshold = settings.MULTIPART_THRESHOLD
+    multipart_part_size = settings.MULTIPART_PART_SIZE
+
     def __init__(self):
         self.failed_uploads = []
         self.deploy_dir = None
+        # filename: upload id of multipart uploads not completed yet
+        self.multipart_uploads = {}
 
     def init(self, **kwargs):
         """Used to pass file list & any other config options set during
@@ -162,60 +383,169 @@ class BaseUploader(object):
         raise NotImplementedError(u'Must be implemented in subclass.')
 
     def upload(self):
-        """Uploads all files in file_list"""
-        self.files_completed = 1
+        """Uploads all files in file_list with a pool of upload_workers
+        threads. A failed upload is retried upload_retries times,
+        waiting twice as long before each retry.
+
+        Version files are published last, one at a time, & only once
+        every other file was uploaded & verified. Clients never see a
+        version file referring to archives or patches that aren't
+        there yet.
+
+        Returns:
+
+            (bool): True if all files were uploaded
+        """
+        self.failed_uploads = []
+        self.files_completed = 0
+        self.bytes_uploaded = 0
         self.file_count = self._get_filelist_count()
-        for f in self.file_list:
-            msg = u'\n\nUploading: {}' .format(f)
-            msg2 = u' - File {} of {}\n'.format(self.files_completed,
-                                                self.file_count)
-            print(msg + msg2)
-            complete = self.upload_file(f)
-            if complete:
-                log.debug('{} uploaded successfully'.format(f))
-                self.files_completed += 1
-            else:
-                log.debug(u'{} failed to upload.  will retry'.format(f))
-                self.failed_uploads.append(f)
+        manifests = [f for f in get_manifest_files() if f in self.file_list]
+        artifacts = [f for f in self.file_list if f not in manifests]
+        start = time.time()
+        self._upload_files(artifacts, self.upload_workers)
         if len(self.failed_uploads) > 0:
-            self._retry_upload()
+            log.error(u'Not publishing version files. Some files they '
+                      u'refer to failed to upload')
+            self.failed_uploads += manifests
+        else:
+            self._upload_files(manifests, 1)
+        elapsed = max(time.time() - start, 0.001)
+        mb = self.bytes_uploaded / 1024.0 / 1024.0
+        print(u'\nUploaded {} of {} files, {:.1f} MB in {:.1f} s '
+              u'({:.2f} MB/s)'.format(self.files_completed, self.file_count,
+                                      mb, elapsed, mb / elapsed))
         if len(self.failed_uploads) < 1:
-            print(u"\nUpload Complete")
-            time.sleep(3)
+            print(u'Upload Complete')
             return True
         else:
             print(u'The following files were not uploaded')
             for i in self.failed_uploads:
-                log.error(u'{} failed to upload'.format(i))
                 print(i)
             return False
 
-    def _retry_upload(self):
-        # Takes list of failed downloads and tries to re upload them
-        retry = self.failed_uploads[:]
-        self.failed_uploads = []
-        failed_count = len(retry)
-        count = 1
-        for f in retry:
-            msg = u'\n\nRetyring: {} - File {} of {}\n'.format(f,
-                                                               count,
-                                                               failed_count)
-            print(msg)
-            complete = self.upload_file(f)
+    def _upload_files(self, files, workers):
+        # Uploads files with a pool of workers. Files finish in any
+        # order unless there's 1 worker.
+        workers = max(1, min(workers, len(files)))
+        log.debug(u'Uploading with {} workers'.format(workers))
+        pool = ThreadPool(workers)
+        try:
+            results = pool.imap_unordered(self._upload_with_retry, files)
+            for filename, complete, size in results:
+                if complete is True:
+                    self.files_completed += 1
+                    self.bytes_uploaded += size
+                    print(u'Uploaded: {} - File {} of {}'.format(
+                        filename, self.files_completed, self.file_count))
+                else:
+                    log.error(u'{} failed to upload'.format(filename))
+                    self.failed_uploads.append(filename)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _upload_with_retry(self, filename):
+        # Runs in a worker thread. Returns filename, True if the upload
+        # succeeded & the size of the file
+        size = self._get_file_size(filename)
+        multipart = self.multipart is True and \
+            size >= self.multipart_threshold
+        delay = self.upload_retry_delay
+        for attempt in range(self.upload_retries + 1):
+            try:
+                if multipart is True:
+                    complete = self._upload_multipart(filename, size)
+                else:
+                    complete = self.upload_file(filename)
+                complete = complete and self.verify_file(filename)
+            except Exception as err:
+                log.debug(str(err), exc_info=True)
+                complete = False
             if complete:
-                log.debug(u'{} uploaded on retry'.format(f))
-                count += 1
-            else:
-                self.failed_uploads.append(f)
-        if len(self.failed_uploads) >= 1:
-            print(u'\nThe following files failed to upload...')
-            for f in self.failed_uploads:
-                print(f)
-            time.sleep(3)
+                log.debug(u'{} uploaded successfully'.format(filename))
+                return filename, True, size
+            if attempt < self.upload_retries:
+                log.debug(u'{} failed to upload. Retrying in '
+                          u'{:.1f} s'.format(filename, delay))
+                time.sleep(delay)
+                delay *= 2
+        return filename, False, size
+
+    def _upload_multipart(self, filename, size):
+        # Uploads the parts of a file the service doesn't have yet with
+        # a pool of workers. Returns True once the upload is completed.
+        upload_id = self.multipart_uploads.get(filename)
+        parts = {}
+        if upload_id is not None:
+            try:
+                parts = self.list_parts(filename, upload_id)
+            except Exception as err:
+                log.debug(str(err), exc_info=True)
+                log.debug(u'Restarting multipart upload of '
+                          u'{}'.format(filename))
+                upload_id = None
+                parts = {}
+        if upload_id is None:
+            upload_id = self.init_multipart(filename)
+            self.multipart_uploads[filename] = upload_id
+
+        part_size = self.multipart_part_size
+        count = max(1, (size + part_size - 1) // part_size)
+        missing = [n for n in range(1, count + 1) if n not in parts]
+        if len(parts) > 0:
+            log.info(u'Resuming {}. {} of {} parts already '
+                     u'uploaded'.format(filename, count - len(missing),
+                                        count))
+
+        path = self._get_path(filename)
+
+        def upload_part(part_number):
+            try:
+                with open(path, u'rb') as f:
+                    f.seek((part_number - 1) * part_size)
+                    data = f.read(part_size)
+                tag = self.upload_part(filename, upload_id, part_number,
+                                       data)
+            except Exception as err:
+                log.debug(str(err), exc_info=True)
+                tag = None
+            return part_number, tag
+
+        if len(missing) > 0:
+            workers = max(1, min(self.upload_workers, len(missing)))
+            pool = ThreadPool(workers)
+            try:
+                for part_number, tag in pool.imap_unordered(upload_part,
+                                                            missing):
+                    if tag:
+                        parts[part_number] = tag
+                    else:
+                        log.debug(u'Part {} of {} failed to '
+                                  u'upload'.format(part_number, filename))
+            finally:
+                pool.close()
+                pool.join()
+
+        if len(parts) < count:
             return False
-        else:
-            print('\nUpload complete')
-            return True
+        complete = self.complete_multipart(filename, upload_id,
+                                           [(n, parts[n]) for n in
+                                            range(1, count + 1)])
+        if complete:
+            del self.multipart_uploads[filename]
+        return complete
+
+    def _get_path(self, filename):
+        if self.deploy_dir is None:
+            return filename
+        return os.path.join(self.deploy_dir, *filename.split(u'/'))
+
+    def _get_file_size(self, filename):
+        try:
+            return os.path.getsize(self._get_path(filename))
+        except OSError:
+            return 0
 
     def connect(self):
         # Connects to service
@@ -236,5 +566,90 @@ class BaseUploader(object):
         # """
         raise NotImplementedError('Must be implemented in subclass.')
 
+    def verify_file(self, filename):
+        """Checks a file arrived intact after :meth:`upload_file`.
+        Uploaders that can read back the size or hash of a remote file
+        should override this. Failed checks are retried like failed
+        uploads.
+
+        Args:
+
+            filename (str): file that was uploaded
+
+        Returns:
+
+            (bool): True if the remote file is complete
+        """
+        return True
+
+    def init_multipart(self, filename):
+        """Starts a multipart upload. Only called when multipart is True
+
+        Args:
+
+            filename (str): file to upload
+
+        Returns:
+
+            (str): Id of the upload. Json serializable, it's kept to
+                   resume the upload on the next run
+        """
+        raise NotImplementedError(u'Must be implemented in subclass.')
+
+    def upload_part(self, filename, upload_id, part_number, data):
+        """Uploads a part of a file. Called from upload_workers threads
+        at once.
+
+        Args:
+
+            filename (str): file being uploaded
+
+            upload_id (str): Id from :meth:`init_multipart`
+
+            part_number (int): Position of the part, starting at 1
+
+            data (bytes): Part data
+
+        Returns:
+
+            (str): Tag the service needs to complete the upload, like an
+                   ETag. None if the upload failed
+        """
+        raise NotImplementedError(u'Must be implemented in subclass.')
+
+    def complete_multipart(self, filename, upload_id, parts):
+        """Joins the uploaded parts into the remote file
+
+        Args:
+
+            filename (str): file being uploaded
+
+            upload_id (str): Id from :meth:`init_multipart`
+
+            parts (list): (part number, tag) of every part in order
+
+        Returns:
+
+            (bool): True if the remote file is complete
+        """
+        raise NotImplementedError(u'Must be implemented in subclass.')
+
+    def list_parts(self, filename, upload_id):
+        """Lists the parts of an upload the service already has. Used
+        to resume an upload. Raise an exception if the upload is gone
+        to start a new one.
+
+        Args:
+
+            filename (str): file being uploaded
+
+            upload_id (str): Id from :meth:`init_multipart`
+
+        Returns:
+
+            (dict): part number: tag
+        """
+        raise NotImplementedError(u'Must be implemented in subclass.')
+
     def _get_filelist_count(self):
         return len(self.file_list)
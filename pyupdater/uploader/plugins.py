@@ -0,0 +1,193 @@
+# --------------------------------------------------------------------------
+# Copyright 2014 Digital Sapphire Development Team
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# --------------------------------------------------------------------------
+#
+# Uploaders shipped with PyUpdater. Registered in setup.py under the
+# pyupdater.plugins.uploaders namespace like external plugins.
+from __future__ import unicode_literals
+
+import logging
+import os
+import shutil
+import threading
+import uuid
+
+from pyupdater.exceptions import UploaderError
+from pyupdater.uploader import BaseUploader
+from pyupdater.utils import (atomic_write,
+                             convert_to_list,
+                             get_hash,
+                             lazy_import,
+                             link_file)
+
+log = logging.getLogger(__name__)
+
+
+@lazy_import
+def urllib3():
+    import urllib3
+    return urllib3
+
+
+class LocalUploader(BaseUploader):
+    """Publishes to one or more local directories, like a web server's
+    document root or NFS mounted mirrors. Files are hardlinked when the
+    directory is on the same device as the deploy dir & copied
+    otherwise. Set with UPLOAD_DIR.
+
+    Also implements multipart uploads, staging parts in a
+    .multipart dir of the first upload dir. Off by default since
+    hardlinking is faster. Used to test uploaders with multipart
+    support offline.
+    """
+
+    # Dir in the first upload dir parts are staged in
+    multipart_dir = '.multipart'
+
+    def init(self, **kwargs):
+        self.file_list = kwargs.get('files', [])
+        self.upload_dirs = convert_to_list(kwargs.get('upload_dir') or [],
+                                           [])
+        if len(self.upload_dirs) == 0:
+            raise UploaderError('Must set UPLOAD_DIR to use the local '
+                                'uploader', expected=True)
+
+    def upload_file(self, filename):
+        parts = filename.split('/')
+        src = os.path.join(self.deploy_dir, *parts)
+        self._publish(src, filename)
+        return True
+
+    def _publish(self, src, filename):
+        parts = filename.split('/')
+        for upload_dir in self.upload_dirs:
+            dst = os.path.join(upload_dir, *parts)
+            self._make_dirs(os.path.dirname(dst))
+            method = link_file(src, dst)
+            log.debug('Published {} to {} by {}'.format(filename,
+                                                       upload_dir, method))
+
+    def _make_dirs(self, path):
+        try:
+            # Other workers may create the same dir
+            if not os.path.exists(path):
+                os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+
+    def _part_dir(self, upload_id):
+        return os.path.join(self.upload_dirs[0], self.multipart_dir,
+                            upload_id)
+
+    def init_multipart(self, filename):
+        upload_id = uuid.uuid4().hex
+        self._make_dirs(self._part_dir(upload_id))
+        return upload_id
+
+    def upload_part(self, filename, upload_id, part_number, data):
+        part_dir = self._part_dir(upload_id)
+        if not os.path.isdir(part_dir):
+            raise UploaderError('Unknown upload: {}'.format(upload_id))
+        tag = get_hash(data)
+        # Parts are named number-hash so listing them doesn't read them
+        atomic_write(os.path.join(part_dir,
+                                  '{}-{}'.format(part_number, tag)), data)
+        return tag
+
+    def list_parts(self, filename, upload_id):
+        part_dir = self._part_dir(upload_id)
+        if not os.path.isdir(part_dir):
+            raise UploaderError('Unknown upload: {}'.format(upload_id))
+        parts = {}
+        for name in os.listdir(part_dir):
+            # Skips temp files of interrupted writes
+            number, _, tag = name.partition('-')
+            if number.isdigit():
+                parts[int(number)] = tag
+        return parts
+
+    def complete_multipart(self, filename, upload_id, parts):
+        part_dir = self._part_dir(upload_id)
+        joined = os.path.join(part_dir, 'joined')
+        with open(joined, 'wb') as f:
+            for part_number, tag in parts:
+                name = '{}-{}'.format(part_number, tag)
+                with open(os.path.join(part_dir, name), 'rb') as p:
+                    shutil.copyfileobj(p, f)
+        self._publish(joined, filename)
+        shutil.rmtree(part_dir, ignore_errors=True)
+        return True
+
+    def verify_file(self, filename):
+        parts = filename.split('/')
+        size = os.path.getsize(os.path.join(self.deploy_dir, *parts))
+        for upload_dir in self.upload_dirs:
+            path = os.path.join(upload_dir, *parts)
+            if not os.path.exists(path) or os.path.getsize(path) != size:
+                return False
+        return True
+
+
+class HTTPUploader(BaseUploader):
+    """Publishes with HTTP PUT requests to UPLOAD_URL, like a WebDAV
+    share or a local stand-in for an object store. Requests share one
+    connection pool across workers.
+    """
+
+    def init(self, **kwargs):
+        self.file_list = kwargs.get('files', [])
+        self.upload_url = kwargs.get('upload_url')
+        if not self.upload_url:
+            raise UploaderError('Must set UPLOAD_URL to use the http '
+                                'uploader', expected=True)
+        if not self.upload_url.endswith('/'):
+            self.upload_url += '/'
+        self._http_pool = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def http_pool(self):
+        # Made on first use since upload_workers is set after init
+        with self._pool_lock:
+            if self._http_pool is None:
+                self._http_pool = urllib3.PoolManager(
+                    maxsize=self.upload_workers)
+        return self._http_pool
+
+    def upload_file(self, filename):
+        path = os.path.join(self.deploy_dir, *filename.split('/'))
+        headers = {
+            str('Content-Type'): str('application/octet-stream'),
+            str('Content-Length'): str(os.path.getsize(path)),
+            }
+        # The file is streamed instead of read into memory
+        with open(path, 'rb') as f:
+            r = self.http_pool.request(str('PUT'), self.upload_url + filename,
+                                       body=f, headers=headers)
+        log.debug('PUT {}: {}'.format(filename, r.status))
+        return 200 <= r.status < 300
+
+    def verify_file(self, filename):
+        size = os.path.getsize(os.path.join(self.deploy_dir,
+                                            *filename.split('/')))
+        r = self.http_pool.request(str('HEAD'), self.upload_url + filename)
+        if r.status in [405, 501]:
+            # Server can't answer HEAD requests
+            return True
+        length = r.headers.get('content-length')
+        if r.status != 200:
+            return False
+        return length is None or int(length) == size
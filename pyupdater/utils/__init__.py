@@ -54,7 +54,15 @@ def lazy_import(func):
 
 
 class _LazyImport(object):
-    """Class representing a lazy import."""
+    """Class representing a lazy import.
+
+    Attributes are only forwarded by __getattr__ until the import. Then
+    the proxy shares the module's __dict__, so references to the proxy
+    kept after the import look attributes up like the module itself.
+    """
+
+    __slots__ = ('_pyu_lazy_target', '_pyu_lazy_name', '_pyu_lazy_loader',
+                 '_pyu_lazy_namespace', '__dict__')
 
     def __init__(self, name, loader, namespace=None):
         self._pyu_lazy_target = _LazyImport
@@ -64,28 +72,39 @@ class _LazyImport(object):
 
     def _pyu_lazy_load(self):
         if self._pyu_lazy_target is _LazyImport:
-            self._pyu_lazy_target = self._pyu_lazy_loader()
+            target = self._pyu_lazy_loader()
+            self._pyu_lazy_target = target
+            if isinstance(getattr(target, '__dict__', None), dict):
+                self.__dict__ = target.__dict__
             ns = self._pyu_lazy_namespace
             if ns is not None:
                 try:
                     if ns[self._pyu_lazy_name] is self:
-                        ns[self._pyu_lazy_name] = self._pyu_lazy_target
+                        ns[self._pyu_lazy_name] = target
                 except KeyError:  # pragma: no cover
                     pass
+                # Not needed after the rebind
+                self._pyu_lazy_namespace = None
 
-    def __getattribute__(self, attr):  # pragma: no cover
-        try:
-            return object.__getattribute__(self, attr)
-        except AttributeError:
-            if self._pyu_lazy_target is _LazyImport:
-                self._pyu_lazy_load()
-            return getattr(self._pyu_lazy_target, attr)
+    def __getattr__(self, attr):
+        # Only called for attributes not found on the proxy
+        if self._pyu_lazy_target is _LazyImport:
+            self._pyu_lazy_load()
+        return getattr(self._pyu_lazy_target, attr)
+
+    def __call__(self, *args, **kwargs):
+        # Lets classes be imported lazily too
+        if self._pyu_lazy_target is _LazyImport:
+            self._pyu_lazy_load()
+        return self._pyu_lazy_target(*args, **kwargs)
 
     def __nonzero__(self):  # pragma: no cover
         if self._pyu_lazy_target is _LazyImport:
             self._pyu_lazy_load()
         return bool(self._pyu_lazy_target)
 
+    __bool__ = __nonzero__
+
 
 @lazy_import
 def bz2():
@@ -93,6 +112,12 @@ def bz2():
     return bz2
 
 
+@lazy_import
+def errno():
+    import errno
+    return errno
+
+
 @lazy_import
 def gzip():
     import gzip
@@ -129,6 +154,12 @@ def StringIO():
     return StringIO
 
 
+@lazy_import
+def struct():
+    import struct
+    return struct
+
+
 @lazy_import
 def subprocess():
     import subprocess
@@ -153,6 +184,12 @@ def zipfile():
     return zipfile
 
 
+@lazy_import
+def zlib():
+    import zlib
+    return zlib
+
+
 @lazy_import
 def jms_utils():
     import jms_utils
@@ -246,7 +283,24 @@ def get_hash(data):
     return hash_
 
 
-def get_highest_version(name, plat, easy_data):
+def get_key_id(public_key):
+    """Short, stable id for a public key. Stored next to signatures so
+    clients can pick the matching key directly.
+
+    Args:
+
+        public_key (str): base64 encoded public key
+
+    Returns:
+
+        (str): key id
+    """
+    if isinstance(public_key, six.text_type):
+        public_key = public_key.encode('ascii')
+    return hashlib.sha256(public_key).hexdigest()[:16]
+
+
+def get_highest_version(name, plat, easy_data, channel=None):
     """Parses version file and returns the highest version number.
 
     Args:
@@ -255,12 +309,31 @@ def get_highest_version(name, plat, easy_data):
 
        easy_data (dict): data file to search
 
+    Kwargs:
+
+       channel (str): Release channel. Version files without channel
+                      data fall back to the latest version if it's
+                      stable enough for the channel.
+
     Returns:
 
        (str) Highest version number
     """
-    version_key = '{}*{}*{}'.format('latest', name, plat)
-    version = easy_data.get(version_key)
+    version = None
+    if channel is not None:
+        channel_key = '{}*{}*{}*{}'.format(settings.CHANNELS_KEY, channel,
+                                           name, plat)
+        version = easy_data.get(channel_key)
+
+    if version is None:
+        version_key = '{}*{}*{}'.format('latest', name, plat)
+        version = easy_data.get(version_key)
+        if version is not None and channel is not None:
+            release = settings.CHANNELS.get(channel, 2)
+            if Version(version).release < release:
+                log.debug('Latest version {} is not in the {} '
+                          'channel'.format(version, channel))
+                version = None
 
     if version is not None:
         log.debug('Highest version: {}'.format(version))
@@ -283,6 +356,27 @@ def get_mac_dot_app_dir(directory):
     return os.path.dirname(os.path.dirname(os.path.dirname(directory)))
 
 
+def get_object_path(digest, folder=None):
+    """Path of a file in the hashed deploy layout. objects/ab/cdef...
+
+    Args:
+
+        digest (str): sha256 hex digest of the file
+
+    Kwargs:
+
+        folder (str): Top folder. Defaults to the objects folder
+
+    Returns:
+
+        (str): Path relative to the deploy dir. Separated by / so it
+               can be used in urls
+    """
+    if folder is None:
+        folder = settings.DEPLOY_OBJECTS_FOLDER
+    return '/'.join([folder, digest[:2], digest[2:]])
+
+
 def get_package_hashes(filename):
     """Provides hash of given filename.
 
@@ -296,14 +390,58 @@ def get_package_hashes(filename):
     """
     log.debug('Getting package hashes')
     filename = os.path.abspath(filename)
+    # Hashing in blocks keeps memory flat for large archives.
+    # hashlib releases the GIL so threads can hash in parallel.
+    hasher = hashlib.sha256()
     with open(filename, 'rb') as f:
-        data = f.read()
+        for block in iter(lambda: f.read(settings.HASH_BLOCK_SIZE), b''):
+            hasher.update(block)
 
-    _hash = hashlib.sha256(data).hexdigest()
+    _hash = hasher.hexdigest()
     log.debug('Hash for file {}: {}'.format(filename, _hash))
     return _hash
 
 
+def gzip_compress(data, level=None):
+    """Deterministic gzip. The header has no filename or timestamp so
+    the same data & level always compress to the same bytes.
+
+    Args:
+
+        data (str): Data to compress
+
+    Kwargs:
+
+        level (int): Compression level 1-9
+
+    Returns:
+
+        (data): Gzip data
+    """
+    if level is None:
+        level = settings.ARCHIVE_COMPRESS_LEVEL
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = compressor.compress(data) + compressor.flush()
+    return _gzip_header(level) + body + _gzip_trailer(zlib.crc32(data),
+                                                      len(data))
+
+
+def _gzip_header(level):
+    # Extra flags as gzip sets them for max & fastest compression
+    if level == 9:
+        xfl = 2
+    elif level == 1:
+        xfl = 4
+    else:
+        xfl = 0
+    # Magic, deflate, no flags, mtime 0, extra flags, unknown os
+    return struct.pack(str('<BBBBIBB'), 0x1f, 0x8b, 8, 0, 0, xfl, 255)
+
+
+def _gzip_trailer(crc, size):
+    return struct.pack(str('<II'), crc & 0xffffffff, size & 0xffffffff)
+
+
 def gzip_decompress(data):
     """Decompress gzip data
 
@@ -331,6 +469,158 @@ def gzip_decompress(data):
     return data
 
 
+def get_archive_format(filename):
+    """Gets the archive format of filename from its extension
+
+    Args:
+
+        filename (str): Name of archive
+
+    Returns:
+
+        (str): gztar, bztar, xztar, zip or None if not an archive
+    """
+    filename = filename.lower()
+    for archive_format, ext in settings.ARCHIVE_FORMATS.items():
+        if filename.endswith(ext):
+            return archive_format
+    return None
+
+
+def remove_archive_ext(filename):
+    """Returns (str): filename without its archive extension"""
+    archive_format = get_archive_format(filename)
+    if archive_format is None:
+        return filename
+    ext = settings.ARCHIVE_FORMATS[archive_format]
+    log.debug('Removed "{}"'.format(ext))
+    return filename[:-len(ext)]
+
+
+def _lzma():
+    # Part of the standard library on python 3 only
+    try:
+        import lzma
+    except ImportError:  # pragma: no cover
+        try:
+            from backports import lzma
+        except ImportError:
+            raise UtilsError('xz archives need backports.lzma on python 2',
+                             expected=True)
+    return lzma
+
+
+def compress_archive(data, archive_format, level=None):
+    """Compresses a tar payload. Output only depends on data & level.
+
+    Args:
+
+        data (str): Uncompressed tar
+
+        archive_format (str): gztar, bztar or xztar
+
+    Kwargs:
+
+        level (int): Compression level. 1-9 or 0-9 for xztar
+
+    Returns:
+
+        (str): Compressed data
+    """
+    output = six.BytesIO()
+    writer = ArchiveWriter(output, archive_format, level)
+    writer.write(data)
+    writer.close()
+    return output.getvalue()
+
+
+class ArchiveWriter(object):
+    """File like object compressing everything written to it into
+    fileobj. Writing a tar payload gives the same bytes as
+    :func:`compress_archive`, without holding the payload in memory.
+
+    Args:
+
+        fileobj (file): Open file to write compressed data to
+
+        archive_format (str): gztar, bztar or xztar
+
+    Kwargs:
+
+        level (int): Compression level. 1-9 or 0-9 for xztar
+    """
+
+    def __init__(self, fileobj, archive_format, level=None):
+        if level is None:
+            level = settings.ARCHIVE_COMPRESS_LEVELS.get(
+                archive_format, settings.ARCHIVE_COMPRESS_LEVEL)
+        self.fileobj = fileobj
+        self.archive_format = archive_format
+        self.size = 0
+        self.crc = zlib.crc32(b'')
+        if archive_format == 'gztar':
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                               -zlib.MAX_WBITS)
+            fileobj.write(_gzip_header(level))
+        elif archive_format == 'bztar':
+            if not 1 <= level <= 9:
+                raise UtilsError('bztar compression level must be 1-9',
+                                 expected=True)
+            self.compressor = bz2.BZ2Compressor(level)
+        elif archive_format == 'xztar':
+            lzma = _lzma()
+            self.compressor = lzma.LZMACompressor(format=lzma.FORMAT_XZ,
+                                                  preset=level)
+        else:
+            raise UtilsError('Unknown archive format: '
+                             '{}'.format(archive_format), expected=True)
+
+    def write(self, data):
+        self.size += len(data)
+        if self.archive_format == 'gztar':
+            self.crc = zlib.crc32(data, self.crc)
+        self.fileobj.write(self.compressor.compress(data))
+
+    def tell(self):
+        "Returns (int): Uncompressed bytes written"
+        return self.size
+
+    def close(self):
+        "Flushes the compressor. Doesn't close fileobj"
+        self.fileobj.write(self.compressor.flush())
+        if self.archive_format == 'gztar':
+            self.fileobj.write(_gzip_trailer(self.crc, self.size))
+
+
+def open_tar(filename):
+    """Opens a .tar.gz, .tar.bz2 or .tar.xz archive for reading
+
+    Args:
+
+        filename (str): Path to archive
+
+    Returns:
+
+        (obj): tarfile.TarFile
+    """
+    archive_format = get_archive_format(filename)
+    if archive_format == 'gztar':
+        return tarfile.open(filename, 'r:gz')
+    if archive_format == 'bztar':
+        return tarfile.open(filename, 'r:bz2')
+    if archive_format == 'xztar':
+        if six.PY3:
+            return tarfile.open(filename, 'r:xz')
+        # tarfile can't read xz on python 2
+        tar = tarfile.open(fileobj=_lzma().LZMAFile(filename, 'rb'),
+                           mode='r:')
+        # Closes the LZMAFile with the archive
+        tar._extfileobj = False
+        return tar
+    raise UtilsError('Not a tar archive: {}'.format(filename),
+                     expected=True)
+
+
 def setup_appname(config):  # pragma: no cover
     if config.APP_NAME is not None:
         default = config.APP_NAME
@@ -473,9 +763,113 @@ def repo_update(config):
     repo_update_remove_attr(config)
 
 
-def make_archive(name, version, target):
+def normalize_archive(filename, level=None):
+    """Recompresses a .tar.gz archive with :func:`gzip_compress` so a
+    client can rebuild the exact same bytes from the uncompressed tar.
+
+    Args:
+
+        filename (str): Path to archive
+
+    Kwargs:
+
+        level (int): Compression level 1-9
+
+    Returns:
+
+        (bool): True if filename is a .tar.gz archive
+    """
+    if not filename.endswith('.tar.gz'):
+        return False
+    with open(filename, 'rb') as f:
+        data = f.read()
+    normalized = gzip_compress(gzip_decompress(data), level)
+    if normalized != data:
+        log.debug('Normalized archive: {}'.format(filename))
+        atomic_write(filename, normalized)
+    return True
+
+
+def _archive_mtime():
+    # Honors https://reproducible-builds.org/specs/source-date-epoch/
+    epoch = os.environ.get('SOURCE_DATE_EPOCH')
+    if epoch is not None:
+        try:
+            return max(int(epoch), settings.ARCHIVE_MTIME)
+        except ValueError:
+            log.warning('Invalid SOURCE_DATE_EPOCH: {}'.format(epoch))
+    return settings.ARCHIVE_MTIME
+
+
+def _archive_members(target, arcname):
+    # Yields (path, arcname) of target & everything below it in
+    # sorted order so the filesystem's listing order doesn't matter
+    yield target, arcname
+    if os.path.isdir(target) and not os.path.islink(target):
+        for f in sorted(os.listdir(target)):
+            for m in _archive_members(os.path.join(target, f),
+                                      arcname + '/' + f):
+                yield m
+
+
+def _archive_mode(path):
+    # Only the executable bit survives
+    if os.path.isdir(path) or os.stat(path).st_mode & 0o111:
+        return 0o755
+    return 0o644
+
+
+def _make_tar(fileobj, target, arcname, mtime):
+    # Writes the tar of target to fileobj, one member at a time
+    tar = tarfile.open(fileobj=fileobj, mode='w', format=tarfile.GNU_FORMAT)
+    try:
+        for path, name in _archive_members(target, arcname):
+            info = tar.gettarinfo(path, name)
+            info.mtime = mtime
+            info.uid = info.gid = 0
+            info.uname = info.gname = ''
+            if info.issym():
+                info.mode = 0o777
+                tar.addfile(info)
+            elif info.isfile():
+                info.mode = _archive_mode(path)
+                with open(path, 'rb') as f:
+                    tar.addfile(info, f)
+            else:
+                info.mode = _archive_mode(path)
+                tar.addfile(info)
+    finally:
+        tar.close()
+
+
+def _make_zip(filename, target, arcname, mtime):  # pragma: no cover
+    date_time = time.gmtime(mtime)[:6]
+    with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for path, name in _archive_members(target, arcname):
+            if os.path.isdir(path):
+                info = zipfile.ZipInfo(name + '/', date_time)
+                data = b''
+            else:
+                info = zipfile.ZipInfo(name, date_time)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with open(path, 'rb') as f:
+                    data = f.read()
+            info.create_system = 3
+            info.external_attr = _archive_mode(path) << 16
+            if os.path.isdir(path):
+                # Unix directory type & the MS-DOS directory flag
+                info.external_attr |= 0o40000 << 16 | 0x10
+            zf.writestr(info, data)
+
+
+def make_archive(name, version, target, level=None, archive_format=None):
     """Used to make archives of file or dir. Zip on windows and tar.gz
-    on all other platforms
+    on all other platforms unless archive_format is given
+
+    Archives are reproducible. Members are sorted & have normalized
+    mtimes, owners & permissions & compressed data has no timestamps,
+    so archiving the same files always gives the same bytes. Set
+    SOURCE_DATE_EPOCH to use a specific mtime.
 
     Args:
         name - Name of app. Used to create final archive name
@@ -484,9 +878,25 @@ def make_archive(name, version, target):
 
         target - name of actual target file or dir.
 
+    Kwargs:
+        level (int) - Compression level. 1-9 or 0-9 for xztar
+
+        archive_format (str) - gztar, bztar, xztar or zip
+
     Returns:
          (str) - name of archive
     """
+    if archive_format is None:
+        # Only use zip on windows. Zip doens't preserve file
+        # permissions on nix & mac
+        if jms_utils.system.get_system() == 'win':  # pragma: no cover
+            archive_format = 'zip'
+        else:
+            archive_format = 'gztar'
+    if archive_format not in settings.ARCHIVE_FORMATS:
+        raise UtilsError('Unknown archive format: {}'.format(archive_format),
+                         expected=True)
+
     file_dir = os.path.dirname(os.path.abspath(target))
     filename = '{}-{}-{}'.format(name, jms_utils.system.get_system(), version)
     filename_path = os.path.join(file_dir, filename)
@@ -494,39 +904,17 @@ def make_archive(name, version, target):
     log.debug('starting archive')
 
     ext = os.path.splitext(target)[1]
-    temp_file = name + ext
-
-    # Remove file if it exists. Found during testing...
-    if os.path.exists(temp_file):
-        log.debug('Removing: {}'.format(temp_file))
-        if os.path.isdir(temp_file):
-            shutil.rmtree(temp_file, ignore_errors=True)
-        else:
-            os.remove(temp_file)
-    if os.path.isfile(target):
-        shutil.copy(target, temp_file)
-    else:
-        shutil.copytree(target, temp_file)
-    # Only use zip on windows. Zip doens't preserve file
-    # permissions on nix & mac
-    if jms_utils.system.get_system() == 'win':  # pragma: no cover
-        ext = '.zip'
-        with zipfile.ZipFile(filename_path + '.zip', 'w') as zf:
-            zf.write(target, temp_file)
+    arcname = name + ext
+    mtime = _archive_mtime()
+    ext = settings.ARCHIVE_FORMATS[archive_format]
+    if archive_format == 'zip':  # pragma: no cover
+        _make_zip(filename_path + ext, target, arcname, mtime)
     else:
-        ext = '.tar.gz'
-        if os.path.isfile(target):
-            with tarfile.open(filename_path + '.tar.gz', 'w:gz') as tar:
-                tar.add(target, temp_file)
-        else:
-            shutil.make_archive(filename, 'gztar', file_dir, temp_file)
+        with open(filename_path + ext, 'wb') as f:
+            writer = ArchiveWriter(f, archive_format, level)
+            _make_tar(writer, target, arcname, mtime)
+            writer.close()
 
-    if os.path.exists(temp_file):
-        log.debug('Removing: {}'.format(temp_file))
-        if os.path.isfile(temp_file):
-            os.remove(temp_file)
-        else:
-            shutil.rmtree(temp_file, ignore_errors=True)
     output_filename = filename + ext
     log.debug('Archive output filename: {}'.format(output_filename))
     return output_filename
@@ -585,6 +973,225 @@ def remove_dot_files(files):
     return new_list
 
 
+# ioctl request to clone a file on linux. Copy on write filesystems
+# like btrfs & xfs support it
+_FICLONE = 0x40049409
+
+
+def _temp_path(dst):
+    # Sibling of dst so the final rename stays on one device
+    dst = os.path.abspath(dst)
+    return os.path.join(os.path.dirname(dst),
+                        '.{}.{}.tmp'.format(os.path.basename(dst),
+                                            os.getpid()))
+
+
+def _replace(src, dst):
+    # Atomic where the os can rename over an existing file
+    try:
+        os.rename(src, dst)
+    except OSError:
+        if sys.platform != 'win32' or not os.path.exists(dst):
+            raise
+        os.remove(dst)
+        os.rename(src, dst)
+
+
+def _same_file(src, dst):
+    # True if dst exists & is src or a hardlink of it
+    if not os.path.exists(dst):
+        return False
+    try:
+        return os.path.samefile(src, dst)
+    # No os.path.samefile on windows with python 2
+    except AttributeError:  # pragma: no cover
+        return False
+
+
+def _reflink(src, dst):
+    if not sys.platform.startswith('linux'):
+        return False
+    import fcntl
+    try:
+        with open(src, 'rb') as s:
+            with open(dst, 'wb') as d:
+                fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+    except (IOError, OSError):
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+    return True
+
+
+def link_file(src, dst):
+    """Makes dst a hardlink to src, or a copy on write clone if the
+    filesystem can't hardlink. Data is only copied when src & dst are
+    on different devices. dst is replaced atomically if it exists.
+
+    Args:
+
+        src (str): Path to file
+
+        dst (str): Path to new file
+
+    Returns:
+
+        (str): How dst was made. link, reflink or copy
+    """
+    # Renaming a link onto another link of the same file does nothing,
+    # which would leave temp behind
+    if _same_file(src, dst):
+        return 'link'
+    temp = _temp_path(dst)
+    if os.path.exists(temp):
+        os.remove(temp)
+    try:
+        os.link(src, temp)
+        method = 'link'
+    # No os.link on windows with python 2
+    except (AttributeError, OSError):
+        if _reflink(src, temp) is True:
+            method = 'reflink'
+        else:
+            shutil.copy2(src, temp)
+            method = 'copy'
+    try:
+        _replace(temp, dst)
+    except OSError:
+        os.remove(temp)
+        raise
+    return method
+
+
+def move_file(src, dst):
+    """Renames src to dst, replacing dst atomically if it exists. Data
+    is only copied when src & dst are on different devices.
+
+    Args:
+
+        src (str): Path to file
+
+        dst (str): New path of file
+    """
+    if _same_file(src, dst):
+        # Renaming would do nothing & leave src
+        os.remove(src)
+        return
+    try:
+        _replace(src, dst)
+        return
+    except OSError as err:
+        if err.errno != errno.EXDEV:
+            raise
+    log.debug('Copying {} across devices'.format(src))
+    temp = _temp_path(dst)
+    shutil.copy2(src, temp)
+    try:
+        _replace(temp, dst)
+    except OSError:
+        os.remove(temp)
+        raise
+    os.remove(src)
+
+
+def _fsync_dir(path):
+    # Makes renames in path durable. Dirs can't be synced on windows
+    if sys.platform == 'win32':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class AtomicWriter(object):
+    """Writes files so a crash never leaves one partly written. Data
+    goes to a temp file next to its target & is synced to disk. Targets
+    are only replaced by :meth:`commit`, so files written together are
+    replaced together.
+
+    As a context manager staged files are committed when the block
+    exits & removed if it raises.
+    """
+
+    def __init__(self):
+        # (temp path, target path) in the order staged
+        self.staged = []
+
+    def write(self, path, data):
+        """Stages data to be written to path
+
+        Args:
+
+            path (str): Path to file
+
+            data (bytes): Data to write. Text is written as utf-8
+        """
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        path = os.path.abspath(path)
+        # Writing a file twice in a batch keeps the last data
+        self.staged = [s for s in self.staged if s[1] != path]
+        temp = _temp_path(path)
+        try:
+            with open(temp, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        except (IOError, OSError):
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+        self.staged.append((temp, path))
+
+    def commit(self):
+        "Replaces the targets with the staged files"
+        dirs = []
+        try:
+            while len(self.staged) > 0:
+                temp, path = self.staged[0]
+                _replace(temp, path)
+                self.staged.pop(0)
+                if os.path.dirname(path) not in dirs:
+                    dirs.append(os.path.dirname(path))
+        except OSError:
+            self.abort()
+            raise
+        for d in dirs:
+            _fsync_dir(d)
+
+    def abort(self):
+        "Removes the staged files"
+        for temp, _ in self.staged:
+            if os.path.exists(temp):
+                os.remove(temp)
+        self.staged = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+def atomic_write(path, data):
+    """Writes data to path so a crash never leaves it partly written.
+    See :class:`AtomicWriter`
+
+    Args:
+
+        path (str): Path to file
+
+        data (bytes): Data to write. Text is written as utf-8
+    """
+    with AtomicWriter() as writer:
+        writer.write(path, data)
+
+
 def run(cmd):
     """Logs a command before running it in subprocess.
 
@@ -778,6 +1385,10 @@ class Version(object):
             self.release_version = 0
         else:
             self.release_version = int(release_version)
+        self.channel = settings.DEFAULT_CHANNEL
+        for channel, release in settings.CHANNELS.items():
+            if release == self.release:
+                self.channel = channel
         self.version_tuple = (self.major, self.minor, self.patch,
                               self.release, self.release_version)
 
@@ -793,15 +1404,9 @@ class Version(object):
 
     def _quick_sanatize(self, version):
         log.debug('Version str: {}'.format(version))
-        ext = os.path.splitext(version)[1]
         # Removing file extensions, to ensure count isn't
         # contaminated
-        if ext == '.zip':
-            log.debug('Removed ".zip"')
-            version = version[:-4]
-        elif ext == '.gz':
-            log.debug('Removed ".tar.gz"')
-            version = version[:-7]
+        version = remove_archive_ext(version)
         count = version.count('.')
         # There will be 4 dots when version is passed
         # That was created with Version object.
@@ -0,0 +1,232 @@
+# --------------------------------------------------------------------------
+# Copyright 2014 Digital Sapphire Development Team
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# --------------------------------------------------------------------------
+#
+# Content defined chunking for the chunk store. Archives are split
+# where a rolling gear hash (FastCDC) matches a mask, so an insert or
+# delete only changes the chunks around it & every other chunk is
+# shared with the last release. Each release gets a chunk index listing
+# the sha256 & length of its chunks in order.
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import logging
+import struct
+import zlib
+
+from pyupdater import settings
+from pyupdater.utils import get_hash, gzip_compress, gzip_decompress
+from pyupdater.utils.exceptions import UtilsError
+
+log = logging.getLogger(__name__)
+
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+# Random value per byte. Derived from sha256 so it's the same on every
+# machine & python version.
+_GEAR = [struct.unpack(str('>Q'),
+                       hashlib.sha256(str(i).encode('ascii')).digest()[:8])[0]
+         for i in range(256)]
+
+
+def _mask(bits):
+    # The gear hash shifts left, so its high bits depend on the most
+    # bytes. Cut points are tested on those.
+    return ((1 << bits) - 1) << (64 - bits)
+
+
+def chunk_boundaries(data, min_size=None, avg_size=None, max_size=None):
+    """Finds content defined chunk boundaries with FastCDC.
+
+    The first min_size bytes of a chunk are never hashed. Up to
+    avg_size a harder mask is used & after it an easier one, which
+    keeps chunk sizes close to avg_size.
+
+    Args:
+
+        data (bytes): Data to split
+
+    Kwargs:
+
+        min_size (int): Smallest chunk size
+
+        avg_size (int): Normal chunk size. Rounded down to a power of 2
+
+        max_size (int): Largest chunk size
+
+    Returns:
+
+        (generator): (offset, length) of each chunk
+    """
+    if min_size is None:
+        min_size = settings.CHUNK_MIN_SIZE
+    if avg_size is None:
+        avg_size = settings.CHUNK_AVG_SIZE
+    if max_size is None:
+        max_size = settings.CHUNK_MAX_SIZE
+    bits = avg_size.bit_length() - 1
+    mask_s = _mask(bits + 2)
+    mask_l = _mask(bits - 2)
+    gear = _GEAR
+    view = bytearray(data)
+    size = len(view)
+    start = 0
+    while start < size:
+        remaining = size - start
+        if remaining <= min_size:
+            yield start, remaining
+            return
+        end = start + min(max_size, remaining)
+        normal = start + min(avg_size, remaining)
+        cut = end
+        fp = 0
+        for i in range(start + min_size, normal):
+            fp = ((fp << 1) + gear[view[i]]) & _MASK64
+            if not fp & mask_s:
+                cut = i + 1
+                break
+        else:
+            for i in range(max(normal, start + min_size), end):
+                fp = ((fp << 1) + gear[view[i]]) & _MASK64
+                if not fp & mask_l:
+                    cut = i + 1
+                    break
+        yield start, cut - start
+        start = cut
+
+
+def split_chunks(data, **kwargs):
+    """Splits data into content defined chunks
+
+    Args:
+
+        data (bytes): Data to split
+
+    Kwargs:
+
+        Passed to :func:`chunk_boundaries`
+
+    Returns:
+
+        (generator): (sha256 hex digest, chunk data) of each chunk
+    """
+    for offset, length in chunk_boundaries(data, **kwargs):
+        chunk = data[offset:offset + length]
+        yield get_hash(chunk), chunk
+
+
+def compress_chunk(chunk):
+    "Returns (bytes): chunk as stored in the deploy dir"
+    return zlib.compress(chunk, 9)
+
+
+def decompress_chunk(data, digest):
+    """Decompresses a chunk downloaded from the deploy dir
+
+    Args:
+
+        data (bytes): Compressed chunk
+
+        digest (str): sha256 hex digest of the chunk
+
+    Returns:
+
+        (bytes): Chunk data
+    """
+    try:
+        chunk = zlib.decompress(data)
+    except zlib.error as err:
+        log.debug(str(err), exc_info=True)
+        raise UtilsError('Corrupt chunk: {}'.format(digest), expected=True)
+    if get_hash(chunk) != digest:
+        raise UtilsError('Chunk hash mismatch: {}'.format(digest),
+                         expected=True)
+    return chunk
+
+
+def get_payload(data, mode=None):
+    """Returns (bytes): the data chunked for an archive. The
+    uncompressed tar in tar mode, otherwise the archive itself.
+    """
+    if mode == settings.PATCH_MODE_TAR:
+        return gzip_decompress(data)
+    return data
+
+
+def make_chunk_index(chunks, mode=None, compress_level=None):
+    """Creates the chunk index of an archive
+
+    Args:
+
+        chunks (list): (digest, length) of each chunk in order
+
+    Kwargs:
+
+        mode (str): settings.PATCH_MODE_TAR if the chunks are the
+                    uncompressed tar of a .tar.gz archive
+
+        compress_level (int): Level to recompress the tar with
+
+    Returns:
+
+        (bytes): Deterministic gzipped json. Published under its hash
+    """
+    index = {
+        'chunks': [[d, l] for d, l in chunks],
+        'size': sum(l for _, l in chunks),
+        }
+    if mode is not None:
+        index['mode'] = mode
+        index['compress_level'] = compress_level
+    data = json.dumps(index, sort_keys=True, separators=(',', ':'))
+    return gzip_compress(data.encode('utf-8'))
+
+
+def load_chunk_index(data):
+    """Reads a chunk index made with :func:`make_chunk_index`
+
+    Args:
+
+        data (bytes): Chunk index
+
+    Returns:
+
+        (dict): chunks, size, mode & compress_level
+    """
+    try:
+        index = json.loads(gzip_decompress(data).decode('utf-8'))
+        chunks = [(d, int(l)) for d, l in index['chunks']]
+        size = int(index['size'])
+    except Exception as err:
+        log.debug(str(err), exc_info=True)
+        raise UtilsError('Malformed chunk index', expected=True)
+    if sum(l for _, l in chunks) != size:
+        raise UtilsError('Chunk index size mismatch', expected=True)
+    return {
+        'chunks': chunks,
+        'size': size,
+        'mode': index.get('mode'),
+        'compress_level': index.get('compress_level',
+                                    settings.ARCHIVE_COMPRESS_LEVEL),
+        }
+
+
+def build_archive(payload, index):
+    """Returns (bytes): the archive a chunk index describes from its
+    reassembled payload
+    """
+    if index['mode'] == settings.PATCH_MODE_TAR:
+        return gzip_compress(payload, index['compress_level'])
+    return payload
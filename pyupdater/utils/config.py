@@ -23,6 +23,7 @@ import pickle
 import six
 
 from pyupdater import settings
+from pyupdater.utils import atomic_write
 
 log = logging.getLogger(__name__)
 
@@ -113,21 +114,21 @@ class Loader(object):
         filename = os.path.join(self.cwd, settings.USER_CLIENT_CONFIG_FILENAME)
         attr_str_format = "    {} = '{}'\n"
         attr_format = "    {} = {}\n"
-        with open(filename, 'w') as f:
-            f.write('class ClientConfig(object):\n')
-            if hasattr(obj, 'APP_NAME') and obj.APP_NAME is not None:
-                f.write(attr_str_format.format('APP_NAME', obj.APP_NAME))
-                log.debug('Wrote APP_NAME to client config')
-            if hasattr(obj, 'COMPANY_NAME') and obj.COMPANY_NAME is not None:
-                f.write(attr_str_format.format('COMPANY_NAME',
-                        obj.COMPANY_NAME))
-                log.debug('Wrote COMPANY_NAME to client config')
-            if hasattr(obj, 'UPDATE_URLS') and obj.UPDATE_URLS is not None:
-                f.write(attr_format.format('UPDATE_URLS', obj.UPDATE_URLS))
-                log.debug('Wrote UPDATE_URLS to client config')
-            if hasattr(obj, 'PUBLIC_KEYS') and obj.PUBLIC_KEYS is not None:
-                f.write(attr_format.format('PUBLIC_KEYS', obj.PUBLIC_KEYS))
-                log.debug('Wrote PUBLIC_KEYS to client config')
+        lines = ['class ClientConfig(object):\n']
+        if hasattr(obj, 'APP_NAME') and obj.APP_NAME is not None:
+            lines.append(attr_str_format.format('APP_NAME', obj.APP_NAME))
+            log.debug('Wrote APP_NAME to client config')
+        if hasattr(obj, 'COMPANY_NAME') and obj.COMPANY_NAME is not None:
+            lines.append(attr_str_format.format('COMPANY_NAME',
+                         obj.COMPANY_NAME))
+            log.debug('Wrote COMPANY_NAME to client config')
+        if hasattr(obj, 'UPDATE_URLS') and obj.UPDATE_URLS is not None:
+            lines.append(attr_format.format('UPDATE_URLS', obj.UPDATE_URLS))
+            log.debug('Wrote UPDATE_URLS to client config')
+        if hasattr(obj, 'PUBLIC_KEYS') and obj.PUBLIC_KEYS is not None:
+            lines.append(attr_format.format('PUBLIC_KEYS', obj.PUBLIC_KEYS))
+            log.debug('Wrote PUBLIC_KEYS to client config')
+        atomic_write(filename, ''.join(lines))
 
 
 # This is the default config used
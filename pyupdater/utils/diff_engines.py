@@ -0,0 +1,314 @@
+# --------------------------------------------------------------------------
+# Copyright 2014 Digital Sapphire Development Team
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# --------------------------------------------------------------------------
+#
+# Diff engines create patches on the dev machine & apply them on the
+# client. Each engine has a format id which is recorded next to the
+# patch in the version file so clients know how to apply it.
+from __future__ import unicode_literals
+
+import bz2
+import hashlib
+import logging
+import struct
+import zlib
+
+try:  # pragma: no cover
+    import bsdiff4
+except ImportError:  # pragma: no cover
+    bsdiff4 = None
+
+from pyupdater import settings
+from pyupdater.utils import bsdiff4_py
+from pyupdater.utils.exceptions import UtilsError
+
+log = logging.getLogger(__name__)
+
+_engines = {}
+
+
+def register_engine(engine):
+    """Makes an engine available by its format id
+
+    Args:
+
+        engine (class): DiffEngine subclass
+
+    Returns:
+
+        (class): engine, so this can be used as a decorator
+    """
+    _engines[engine.format_id] = engine
+    return engine
+
+
+def get_engine(format_id=None):
+    """Returns an engine instance for format_id
+
+    Kwargs:
+
+        format_id (str): Format id of the engine. Patches without one
+                         are bsdiff4.
+
+    Returns:
+
+        (obj): DiffEngine
+    """
+    if format_id is None:
+        format_id = settings.DEFAULT_PATCH_FORMAT
+    try:
+        return _engines[format_id]()
+    except KeyError:
+        raise UtilsError('Unknown patch format: {}'.format(format_id),
+                         expected=True)
+
+
+def get_engine_names():
+    "Returns (list): Format ids of all registered engines"
+    return sorted(_engines.keys())
+
+
+class DiffEngine(object):
+    "Base class for diff engines"
+
+    format_id = None
+    # Memory needed to create a patch per byte of source file
+    memory_factor = 1
+    # Only suits the uncompressed tar of .tar.gz archives
+    tar_only = False
+
+    def can_diff(self):
+        """Returns (bool): True if patches can be created on this
+        system. Some engines can only patch without optional libraries.
+        """
+        return True
+
+    def diff(self, src_path, dst_path, patch_path):
+        """Creates a patch from src to dst
+
+        Args:
+
+            src_path (str): Path to old file
+
+            dst_path (str): Path to new file
+
+            patch_path (str): Path to write patch to
+        """
+        raise NotImplementedError
+
+    def patch(self, source, patch):
+        """Applies a patch in memory
+
+        Args:
+
+            source (bytes): Old file data
+
+            patch (bytes): Patch data
+
+        Returns:
+
+            (bytes): New file data
+        """
+        raise NotImplementedError
+
+
+@register_engine
+class Bsdiff4Engine(DiffEngine):
+    """Smallest patches. Creating a patch takes O(n log n) time & about
+    17 times the source size in memory.
+    """
+
+    format_id = 'bsdiff4'
+    memory_factor = settings.PATCH_MEMORY_FACTOR
+
+    def can_diff(self):
+        return bsdiff4 is not None
+
+    def diff(self, src_path, dst_path, patch_path):
+        if bsdiff4 is None:
+            raise UtilsError('Bsdiff is missing. Cannot create patches',
+                             expected=True)
+        bsdiff4.file_diff(src_path, dst_path, patch_path)
+
+    def patch(self, source, patch):
+        if bsdiff4 is None:  # pragma: no cover
+            return bsdiff4_py.patch(source, patch)
+        return bsdiff4.patch(source, patch)
+
+
+_u32 = struct.Struct(str('>I'))
+_u64 = struct.Struct(str('>Q'))
+_copy = struct.Struct(str('>II'))
+_OP_COPY = b'C'
+_OP_LITERAL = b'L'
+
+
+def _weak_checksum(data):
+    return zlib.adler32(data) & 0xFFFFFFFF
+
+
+def _strong_checksum(data):
+    return hashlib.md5(data).digest()
+
+
+@register_engine
+class BlockEngine(DiffEngine):
+    """Block matching engine for tar payloads, patch mode tar. Blocks
+    of the new file found anywhere in the old file are copied,
+    everything else is sent as literal data. Creating a patch takes
+    linear time & memory, so it suits very large files. Patches are
+    bigger than bsdiff4 patches.
+
+    Tar members start on 512 byte records, so blocks are only looked
+    for at those offsets of the new file. Data shifted by anything else
+    isn't matched, which is why the package handler uses bsdiff4 for
+    payloads that aren't tar.
+
+    Kwargs:
+
+        block_size (int): Size of blocks to match
+
+        step (int): Offsets of the new file tried for a match are a
+                    multiple of this
+    """
+
+    format_id = 'block'
+    tar_only = True
+    # Old file & its block index
+    memory_factor = 2
+    magic = b'PYUBLK01'
+
+    def __init__(self, block_size=None, step=512):
+        if block_size is None:
+            block_size = settings.PATCH_BLOCK_SIZE
+        self.block_size = block_size
+        self.step = step
+
+    def diff(self, src_path, dst_path, patch_path):
+        with open(src_path, 'rb') as f:
+            src = f.read()
+        with open(dst_path, 'rb') as f:
+            dst = f.read()
+        with open(patch_path, 'wb') as f:
+            f.write(self.diff_data(src, dst))
+
+    def diff_data(self, src, dst):
+        """Creates a patch in memory
+
+        Args:
+
+            src (bytes): Old file data
+
+            dst (bytes): New file data
+
+        Returns:
+
+            (bytes): Patch data
+        """
+        size = self.block_size
+        index = self._index(src)
+
+        ops = []
+        # Start of the current literal run
+        literal = [0]
+        # First block & block count of the current copy run
+        run = [None, 0]
+
+        def flush_literal(pos):
+            if pos > literal[0]:
+                ops.append(_OP_LITERAL + _u32.pack(pos - literal[0]) +
+                           dst[literal[0]:pos])
+
+        def flush_copy():
+            if run[0] is not None:
+                ops.append(_OP_COPY + _copy.pack(run[0], run[1]))
+                run[0] = None
+                run[1] = 0
+
+        pos = 0
+        end = len(dst)
+        # Checksums are computed by zlib & hashlib a block at a time.
+        # The loop itself runs once per step or matched block.
+        while pos + size <= end:
+            data = dst[pos:pos + size]
+            block = None
+            candidates = index.get(_weak_checksum(data))
+            if candidates is not None:
+                block = candidates.get(_strong_checksum(data))
+            if block is None:
+                flush_copy()
+                pos += self.step
+                continue
+
+            flush_literal(pos)
+            if run[0] is not None and run[0] + run[1] == block:
+                run[1] += 1
+            else:
+                flush_copy()
+                run[0] = block
+                run[1] = 1
+            pos += size
+            literal[0] = pos
+
+        flush_copy()
+        flush_literal(end)
+        header = (self.magic + _u32.pack(size) + _u64.pack(end))
+        return header + bz2.compress(b''.join(ops))
+
+    def _index(self, src):
+        # weak checksum: {strong checksum: block number}
+        size = self.block_size
+        index = {}
+        for i in range(len(src) // size):
+            data = src[i * size:(i + 1) * size]
+            index.setdefault(_weak_checksum(data), {}).setdefault(
+                _strong_checksum(data), i)
+        return index
+
+    def patch(self, source, patch):
+        header_size = len(self.magic) + _u32.size + _u64.size
+        if patch[:len(self.magic)] != self.magic:
+            raise UtilsError('Not a block patch', expected=True)
+        size, = _u32.unpack_from(patch, len(self.magic))
+        length, = _u64.unpack_from(patch, len(self.magic) + _u32.size)
+        ops = bz2.decompress(patch[header_size:])
+
+        output = []
+        offset = 0
+        try:
+            while offset < len(ops):
+                op = ops[offset:offset + 1]
+                offset += 1
+                if op == _OP_COPY:
+                    start, count = _copy.unpack_from(ops, offset)
+                    offset += _copy.size
+                    output.append(source[start * size:(start + count) *
+                                         size])
+                elif op == _OP_LITERAL:
+                    count, = _u32.unpack_from(ops, offset)
+                    offset += _u32.size
+                    output.append(ops[offset:offset + count])
+                    offset += count
+                else:
+                    raise UtilsError('Bad block patch op', expected=True)
+        except struct.error as err:
+            log.debug(str(err), exc_info=True)
+            raise UtilsError('Malformed block patch', expected=True)
+
+        data = b''.join(output)
+        if len(data) != length:
+            raise UtilsError('Block patch output length mismatch',
+                             expected=True)
+        return data
@@ -0,0 +1,340 @@
+# --------------------------------------------------------------------------
+# Copyright 2014 Digital Sapphire Development Team
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# --------------------------------------------------------------------------
+#
+# Compact, canonical binary encoding of the version manifest.
+#
+# Layout (all integers big endian):
+#
+#   magic            4 bytes  b'PYUM'
+#   format version   u8
+#   payload length   u32
+#   payload
+#       string count u32
+#       strings      [kind u8 | length u16 | bytes] sorted & unique
+#       index width  u8, 1, 2 or 4 bytes depending on string count
+#       record count u32
+#       records      [depth u8 | key index * depth |
+#                     value type u8 | value index or i64]
+#   signature count  u16
+#   signatures       [key id length u8 | key id |
+#                     length u16 | raw signature bytes]
+#
+# Signatures cover everything before the signature block so clients
+# verify the exact bytes they downloaded. Records are the leaves of the
+# manifest flattened to key paths, so decoding never builds dict trees.
+from __future__ import unicode_literals
+
+import binascii
+import logging
+import re
+import struct
+
+import six
+
+from pyupdater.utils.exceptions import UtilsError
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'PYUM'
+FORMAT_VERSION = 1
+
+# String kinds
+_STR_TEXT = 0
+# Lowercase hex digests are stored as raw bytes, halving their size
+_STR_HEX = 1
+
+# Value types
+_VALUE_STR = 0
+_VALUE_INT = 1
+
+_hex_re = re.compile('^(?:[0-9a-f]{2}){16,}$')
+
+_u8 = struct.Struct(str('>B'))
+_u16 = struct.Struct(str('>H'))
+_u32 = struct.Struct(str('>I'))
+_i64 = struct.Struct(str('>q'))
+_header = struct.Struct(str('>4sBI'))
+_index_formats = {1: 'B', 2: 'H', 4: 'I'}
+_index_structs = {}
+
+
+def _index_width(count):
+    if count <= 0xFF:
+        return 1
+    if count <= 0xFFFF:
+        return 2
+    return 4
+
+
+def _index_struct(width, count):
+    # Record keys are unpacked with a single struct call
+    try:
+        return _index_structs[(width, count)]
+    except KeyError:
+        fmt = str('>{}{}'.format(count, _index_formats[width]))
+        _index_structs[(width, count)] = s = struct.Struct(fmt)
+        return s
+
+
+def _flatten(data, path, out):
+    for k, v in data.items():
+        if not isinstance(k, six.string_types):
+            raise UtilsError('Manifest keys must be strings', expected=True)
+        key_path = path + (k,)
+        if isinstance(v, dict):
+            _flatten(v, key_path, out)
+        elif isinstance(v, bool) or not isinstance(v, six.string_types +
+                                                   six.integer_types):
+            raise UtilsError('Unsupported manifest value for '
+                             '{}'.format('*'.join(key_path)), expected=True)
+        else:
+            out.append((key_path, v))
+    return out
+
+
+def _pack_string(s):
+    if _hex_re.match(s):
+        raw = binascii.unhexlify(s)
+        kind = _STR_HEX
+    else:
+        raw = s.encode('utf-8')
+        kind = _STR_TEXT
+    if len(raw) > 0xFFFF:
+        raise UtilsError('Manifest string too long', expected=True)
+    return _u8.pack(kind) + _u16.pack(len(raw)) + raw
+
+
+def encode_manifest(data):
+    """Encodes manifest data to canonical bytes without signatures.
+
+    Equal manifests always produce identical bytes regardless of dict
+    ordering, which is what gets signed.
+
+    Args:
+
+        data (dict): Version manifest. A "sigs" key is ignored.
+
+    Returns:
+
+        (bytes): Encoded manifest
+    """
+    data = dict(data)
+    data.pop('sigs', None)
+    data.pop('sig', None)
+    leaves = _flatten(data, (), [])
+
+    strings = set()
+    for path, value in leaves:
+        strings.update(path)
+        if isinstance(value, six.string_types):
+            strings.add(value)
+    # Text type everywhere so py2 str & unicode sort & compare equally
+    strings = sorted(set(six.text_type(s) for s in strings))
+    index = dict((s, i) for i, s in enumerate(strings))
+
+    records = []
+    for path, value in leaves:
+        key = tuple(index[six.text_type(p)] for p in path)
+        records.append((key, value))
+    records.sort(key=lambda r: r[0])
+
+    parts = [_u32.pack(len(strings))]
+    for s in strings:
+        parts.append(_pack_string(s))
+    width = _index_width(len(strings))
+    single = _index_struct(width, 1)
+    parts.append(_u8.pack(width))
+    parts.append(_u32.pack(len(records)))
+    for key, value in records:
+        parts.append(_u8.pack(len(key)))
+        parts.append(_index_struct(width, len(key)).pack(*key))
+        if isinstance(value, six.string_types):
+            parts.append(_u8.pack(_VALUE_STR))
+            parts.append(single.pack(index[six.text_type(value)]))
+        else:
+            parts.append(_u8.pack(_VALUE_INT))
+            parts.append(_i64.pack(value))
+    payload = b''.join(parts)
+    return _header.pack(MAGIC, FORMAT_VERSION, len(payload)) + payload
+
+
+def attach_signatures(manifest, signatures):
+    """Appends the signature block to an encoded manifest
+
+    Args:
+
+        manifest (bytes): Output of :func:`encode_manifest`
+
+        signatures (list): (key id, raw signature bytes) tuples
+
+    Returns:
+
+        (bytes): Signed manifest
+    """
+    parts = [manifest, _u16.pack(len(signatures))]
+    for key_id, s in signatures:
+        key_id = key_id.encode('ascii')
+        parts.append(_u8.pack(len(key_id)))
+        parts.append(key_id)
+        parts.append(_u16.pack(len(s)))
+        parts.append(s)
+    return b''.join(parts)
+
+
+class BinaryManifest(object):
+    """Read only view of a binary manifest. Supports the same lookups
+    as :class:`pyupdater.utils.EasyAccessDict`.
+
+    Args:
+
+        data (bytes): Signed or unsigned binary manifest
+
+    Attributes:
+
+        signed_data (bytes): The bytes covered by signatures
+
+        signatures (list): (key id, raw signature bytes) tuples
+
+    Kwargs:
+
+        sep (str): Used as a delimiter between keys
+    """
+
+    def __init__(self, data, sep='*'):
+        self.sep = sep
+        self.entries = {}
+        self.signatures = []
+        self.signed_data = None
+        try:
+            self._parse(data)
+        except (struct.error, IndexError, UnicodeDecodeError) as err:
+            log.debug(str(err), exc_info=True)
+            raise UtilsError('Malformed binary manifest', expected=True)
+
+    def _parse(self, data):
+        magic, version, length = _header.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise UtilsError('Not a binary manifest', expected=True)
+        if version != FORMAT_VERSION:
+            raise UtilsError('Unsupported binary manifest version '
+                             '{}'.format(version), expected=True)
+        offset = _header.size
+        end = offset + length
+        if end > len(data):
+            raise UtilsError('Truncated binary manifest', expected=True)
+        self.signed_data = data[:end]
+
+        count, = _u32.unpack_from(data, offset)
+        offset += _u32.size
+        strings = []
+        for _ in six.moves.range(count):
+            kind, = _u8.unpack_from(data, offset)
+            size, = _u16.unpack_from(data, offset + 1)
+            offset += 3
+            raw = data[offset:offset + size]
+            offset += size
+            if kind == _STR_HEX:
+                strings.append(binascii.hexlify(raw).decode('ascii'))
+            else:
+                strings.append(raw.decode('utf-8'))
+
+        width, = _u8.unpack_from(data, offset)
+        if width not in _index_formats:
+            raise UtilsError('Bad binary manifest index width',
+                             expected=True)
+        single = _index_struct(width, 1)
+        count, = _u32.unpack_from(data, offset + 1)
+        offset += 1 + _u32.size
+        sep = self.sep
+        entries = self.entries
+        for _ in six.moves.range(count):
+            depth, = _u8.unpack_from(data, offset)
+            offset += 1
+            key_struct = _index_struct(width, depth)
+            key = key_struct.unpack_from(data, offset)
+            offset += key_struct.size
+            value_type, = _u8.unpack_from(data, offset)
+            offset += 1
+            if value_type == _VALUE_STR:
+                i, = single.unpack_from(data, offset)
+                value = strings[i]
+                offset += width
+            else:
+                value, = _i64.unpack_from(data, offset)
+                offset += _i64.size
+            entries[sep.join([strings[i] for i in key])] = value
+
+        if offset != end:
+            raise UtilsError('Binary manifest length mismatch',
+                             expected=True)
+        if len(data) > end:
+            count, = _u16.unpack_from(data, end)
+            offset = end + _u16.size
+            for _ in six.moves.range(count):
+                size, = _u8.unpack_from(data, offset)
+                offset += 1
+                key_id = data[offset:offset + size].decode('ascii')
+                offset += size
+                size, = _u16.unpack_from(data, offset)
+                offset += _u16.size
+                self.signatures.append((key_id, data[offset:offset + size]))
+                offset += size
+
+    def get(self, key):
+        """Retrive value from manifest.
+
+        Leaf lookups are a single dict access. Looking up a partial key
+        returns the matching sub tree as a dict.
+
+        Args:
+
+            key (str): Key to access value
+
+        Returns:
+
+            (object): Value of key if found or None
+        """
+        value = self.entries.get(key)
+        if value is not None:
+            return value
+        prefix = key + self.sep
+        tree = {}
+        for k, v in self.entries.items():
+            if k.startswith(prefix):
+                _insert(tree, k[len(prefix):].split(self.sep), v)
+        if len(tree) == 0:
+            return None
+        return tree
+
+    def to_dict(self):
+        "Returns the manifest as nested dicts"
+        tree = {}
+        for k, v in self.entries.items():
+            _insert(tree, k.split(self.sep), v)
+        return tree
+
+    # Because I always forget call the get method
+    def __call__(self, key):
+        return self.get(key)
+
+    def __str__(self):
+        return str(self.to_dict())
+
+
+def _insert(tree, layers, value):
+    for layer in layers[:-1]:
+        tree = tree.setdefault(layer, {})
+    tree[layers[-1]] = value
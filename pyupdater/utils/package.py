@@ -18,7 +18,9 @@ from __future__ import unicode_literals
 import logging
 import os
 
-from pyupdater.utils import (parse_platform,
+from pyupdater.utils import (get_archive_format,
+                             parse_platform,
+                             remove_archive_ext,
                              Version,
                              )
 from pyupdater.utils.exceptions import UtilsError, VersionError
@@ -97,10 +99,6 @@ class Package(object):
         self.platform = None
         self.info = dict(status=False, reason='')
         self.patch_info = {}
-        # seems to produce the best diffs.
-        # Tests on homepage: https://github.com/JMSwag/PyUpdater
-        # Zip doesn't keep +x permissions. Only using gz for now.
-        self.supported_extensions = ['.zip', '.gz']
         # ToDo: May need to add more files to ignore
         self.ignored_files = ['.DS_Store', ]
         self.extract_info(filename)
@@ -122,8 +120,7 @@ class Package(object):
             log.debug(msg)
             self.info['reason'] = msg
             return
-        if os.path.splitext(package)[1].lower() not in \
-                self.supported_extensions:
+        if get_archive_format(package) is None:
             msg = 'Not a supported archive format: {}'.format(package)
             self.info['reason'] = msg
             log.warning(msg)
@@ -153,14 +150,8 @@ class Package(object):
     def _parse_package_name(self, package):
         # Returns package name from update archive name
         log.debug('Package name: {}'.format(package))
-        ext = os.path.splitext(package)[1]
         # Removes file extension
-        if ext == '.zip':
-            log.debug('Removed ".zip"')
-            package = package[:-4]
-        elif ext == '.gz':
-            log.debug('Removed ".tar.gz"')
-            package = package[:-7]
+        package = remove_archive_ext(package)
         # Changes appname-platform-version to appname
         # ToDo: May need to update if support for app names with
         #       hyphens in them are requested. Example "My-App"
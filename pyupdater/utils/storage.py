@@ -1,148 +1,298 @@
-# --------------------------------------------------------------------------
-# Copyright 2014 Digital Sapphire Development Team
-#
-# Licensed under the Apache License, Version 2.0 (the "License");
-# you may not use this file except in compliance with the License.
-# You may obtain a copy of the License at
-#
-#     http://www.apache.org/licenses/LICENSE-2.0
-#
-# Unless required by applicable law or agreed to in writing, software
-# distributed under the License is distributed on an "AS IS" BASIS,
-# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
-# See the License for the specific language governing permissions and
-# limitations under the License.
-# --------------------------------------------------------------------------
-from __future__ import unicode_literals
-
-import json
-import logging
-import os
-import pickle
-
-from pyupdater import settings
-
-
-log = logging.getLogger(__name__)
-
-
-class Storage(object):
-
-    def __init__(self, data_dir=None):
-        """Loads & saves config file to file-system.
-
-            Args:
-
-                config_dir (str): Path to directory where config will be stored
-        """
-        if data_dir is None:
-            data_dir = os.getcwd()
-        self.config_dir = os.path.join(data_dir, settings.CONFIG_DATA_FOLDER)
-        if not os.path.exists(self.config_dir):
-            log.info('Creating config dir')
-            os.mkdir(self.config_dir)
-        log.debug('Config Dir: {}'.format(self.config_dir))
-        self.filename = os.path.join(self.config_dir,
-                                     settings.CONFIG_FILE_USER)
-        log.debug('Config DB: {}'.format(self.filename))
-        self.db = None
-        self.sync_threshold = 3
-        self.count = 0
-
-    def load_db(self):
-        "Loads database into memory."
-        if not os.path.exists(self.filename):
-            self.db = {}
-            log.debug('Created new config data file')
-        else:
-            try:
-                with open(self.filename, 'r') as f:
-                    self.db = json.loads(f.read())
-            except ValueError:
-                log.error('Invalid config data file. Saving as '
-                          '{}.old'.format(self.filename))
-                self.db = {}
-                log.debug('Created new config data file')
-        self.sync_db()
-
-    def sync_db(self):
-        "Sync updates of in memory database back to database on disk."
-        if self.count >= self.sync_threshold:
-            self._sync_db()
-            self.count = 0
-        self.count += 1
-
-    def _sync_db(self):
-        if self.db is None:
-            self.load_db()
-        log.debug('Syncing db to filesystem')
-        with open(self.filename, 'w') as f:
-            f.write(json.dumps(self.db, indent=4, sort_keys=True))
-
-    def _export(self):
-        with open('export.db', 'w') as f:
-            f.write(json.dumps(self.db))
-
-    def _export(self):
-        export = {}
-        if self.db is None:
-            self.load_db()
-        for k, v in self.db.items():
-            export[k] = v
-        print export
-        with open('export.db', 'w') as f:
-            f.write(export)
-
-    def save(self, key, value):
-        """Saves key & value to database
-
-        Args:
-
-            key (str): used to retrieve value from database
-
-            value (obj): python object to store in database
-
-        """
-        if self.db is None:
-            self.load_db()
-
-        if isinstance(key, unicode) is True:
-            log.debug('Key Name: {}'.format(key))
-            log.debug('Key type: {}'.format(type(key)))
-            key = str(key)
-
-        self.db[key] = value
-
-    def load(self, key):
-        """Loads value for given key
-
-            Args:
-
-                key (str): The key associated with the value you want
-                form the database.
-
-            Returns:
-
-                Object if exists or else None
-        """
-        if self.db is None:
-            self.load_db()
-
-        if isinstance(key, unicode) is True:
-            log.debug('Key Name: {}'.format(key))
-            log.debug('Key type: {}'.format(type(key)))
-            key = str(key)
-
-        data = self.db.get(key)
-        if data is not None:
-            try:
-                data = pickle.loads(data)
-            except:
-                log.debug('Not pickle data')
-                pass
-            try:
-                data = json.loads(data)
-            except Exception as err:
-                log.debug(self.db.get(key))
-                log.debug(err, exc_info=True)
-        return data
+# --------------------------------------------------------------------------
+# Copyright 2014 Digital Sapphire Development Team
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# --------------------------------------------------------------------------
+from __future__ import unicode_literals
+
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+
+from pyupdater import settings
+
+
+log = logging.getLogger(__name__)
+
+# First bytes of every sqlite database file
+_SQLITE_HEADER = b'SQLite format 3\x00'
+
+# Values of these keys hold a dict that's stored as a row per entry,
+# i.e. version_meta/<name>/<version>/<platform>, so adding a release
+# doesn't rewrite the whole version manifest. key: (field, depth)
+_SPLIT_KEYS = {
+    settings.CONFIG_DB_KEY_VERSION_META: (settings.UPDATES_KEY, 3),
+    }
+
+
+def _flatten(value, path, depth, rows):
+    # Empty dicts get a row too so they survive a reload
+    if depth == 0 or not isinstance(value, dict) or len(value) == 0:
+        rows[path] = json.dumps(value, sort_keys=True)
+        return
+    for k, v in value.items():
+        _flatten(v, '/'.join([path, k]), depth - 1, rows)
+
+
+def _to_rows(key, value):
+    # Returns (dict): row key: json value
+    rows = {}
+    field, depth = _SPLIT_KEYS.get(key, (None, 0))
+    if (isinstance(value, dict) is False or
+            isinstance(value.get(field), dict) is False):
+        rows[key] = json.dumps(value, sort_keys=True)
+        return rows
+    root = dict(value)
+    root[field] = {}
+    rows[key] = json.dumps(root, sort_keys=True)
+    for k, v in value[field].items():
+        _flatten(v, '/'.join([key, k]), depth - 1, rows)
+    return rows
+
+
+def _from_rows(key, rows):
+    # Inverse of _to_rows
+    value = json.loads(rows[key]) if key in rows else {}
+    if len(rows) == 1 and key in rows:
+        return value
+    field = _SPLIT_KEYS[key][0]
+    if isinstance(value, dict) is False:
+        value = {}
+    parts = value.setdefault(field, {})
+    for row_key in sorted(rows):
+        if row_key == key:
+            continue
+        path = row_key[len(key) + 1:].split('/')
+        node = parts
+        for k in path[:-1]:
+            node = node.setdefault(k, {})
+        node[path[-1]] = json.loads(rows[row_key])
+    return value
+
+
+class Storage(object):
+
+    def __init__(self, data_dir=None):
+        """Loads & saves config file to file-system.
+
+        The config file is a sqlite database with a json value per key.
+        Entries of the version manifest get a row each. A sync only
+        writes the rows that changed since the last one, in a single
+        transaction. Config files from before are migrated.
+
+            Args:
+
+                config_dir (str): Path to directory where config will be stored
+        """
+        if data_dir is None:
+            data_dir = os.getcwd()
+        self.config_dir = os.path.join(data_dir, settings.CONFIG_DATA_FOLDER)
+        if not os.path.exists(self.config_dir):
+            log.info('Creating config dir')
+            os.mkdir(self.config_dir)
+        log.debug('Config Dir: {}'.format(self.config_dir))
+        self.filename = os.path.join(self.config_dir,
+                                     settings.CONFIG_FILE_USER)
+        log.debug('Config DB: {}'.format(self.filename))
+        self.db = None
+        # Keys saved since the last sync
+        self.dirty = set()
+        # key: {row key: json value} as on disk
+        self.rows = {}
+        # Syncs can come from patch worker callbacks
+        self.lock = threading.Lock()
+        self.sync_threshold = 3
+        self.count = 0
+
+    def load_db(self):
+        "Loads database into memory."
+        self.db = {}
+        self.rows = {}
+        if os.path.exists(self.filename):
+            with open(self.filename, 'rb') as f:
+                header = f.read(len(_SQLITE_HEADER))
+            if header != _SQLITE_HEADER:
+                self._migrate_json()
+                return
+            try:
+                conn = self._connect()
+                try:
+                    rows = conn.execute('SELECT key, value FROM config')
+                    for row_key, value in rows:
+                        key = row_key.split('/', 1)[0]
+                        if key not in _SPLIT_KEYS:
+                            key = row_key
+                        self.rows.setdefault(key, {})[row_key] = value
+                    for key, rows in self.rows.items():
+                        self.db[key] = _from_rows(key, rows)
+                finally:
+                    conn.close()
+            except (sqlite3.DatabaseError, ValueError) as err:
+                log.debug(str(err), exc_info=True)
+                log.error('Invalid config data file. Saving as '
+                          '{}'.format(self._backup()))
+                self.db = {}
+                self.rows = {}
+                log.debug('Created new config data file')
+        else:
+            log.debug('Created new config data file')
+        self.sync_db()
+
+    def _migrate_json(self):
+        # Config files used to be one json object rewritten on every
+        # sync. Values may still be pickled or json strings.
+        try:
+            with open(self.filename, 'r') as f:
+                data = json.loads(f.read())
+        except ValueError:
+            log.error('Invalid config data file')
+            data = {}
+        log.info('Migrating config data file. Saving old file as '
+                 '{}'.format(self._backup()))
+        for key, value in data.items():
+            try:
+                value = pickle.loads(value)
+            except:
+                log.debug('Not pickle data')
+            try:
+                value = json.loads(value)
+            except Exception as err:
+                log.debug(err, exc_info=True)
+            self.db[key] = value
+        self.dirty.update(self.db.keys())
+        self._sync_db()
+
+    def _backup(self):
+        # Moves the config file out of the way. Returns its new path
+        backup = self.filename + '.old'
+        if os.path.exists(backup):
+            os.remove(backup)
+        os.rename(self.filename, backup)
+        return backup
+
+    def _connect(self):
+        conn = sqlite3.connect(self.filename)
+        conn.execute('CREATE TABLE IF NOT EXISTS config '
+                     '(key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        return conn
+
+    def sync_db(self, force=False):
+        """Sync updates of in memory database back to database on disk.
+
+        Kwargs:
+
+            force (bool): Sync now instead of waiting for the threshold
+        """
+        if force is True or self.count >= self.sync_threshold:
+            self._sync_db()
+            self.count = 0
+        self.count += 1
+
+    def _sync_db(self):
+        if self.db is None:
+            self.load_db()
+        with self.lock:
+            if len(self.dirty) == 0 and os.path.exists(self.filename):
+                return
+            log.debug('Syncing db to filesystem')
+            rows = []
+            removed = []
+            synced = {}
+            for key in sorted(self.dirty):
+                new = {}
+                if key in self.db:
+                    new = _to_rows(key, self.db[key])
+                old = self.rows.get(key, {})
+                for row_key in sorted(new):
+                    if old.get(row_key) != new[row_key]:
+                        rows.append((row_key, new[row_key]))
+                for row_key in sorted(set(old) - set(new)):
+                    removed.append((row_key,))
+                synced[key] = new
+            conn = self._connect()
+            try:
+                # Commits on success & rolls back on error, so the file
+                # never holds part of a sync
+                with conn:
+                    conn.executemany('INSERT OR REPLACE INTO config '
+                                     '(key, value) VALUES (?, ?)', rows)
+                    conn.executemany('DELETE FROM config WHERE key = ?',
+                                     removed)
+            finally:
+                conn.close()
+            for key, new in synced.items():
+                if len(new) > 0:
+                    self.rows[key] = new
+                else:
+                    self.rows.pop(key, None)
+            self.dirty.clear()
+
+    def _export(self):
+        with open('export.db', 'w') as f:
+            f.write(json.dumps(self.db))
+
+    def _export(self):
+        export = {}
+        if self.db is None:
+            self.load_db()
+        for k, v in self.db.items():
+            export[k] = v
+        print export
+        with open('export.db', 'w') as f:
+            f.write(export)
+
+    def save(self, key, value):
+        """Saves key & value to database
+
+        Args:
+
+            key (str): used to retrieve value from database
+
+            value (obj): python object to store in database
+
+        """
+        if self.db is None:
+            self.load_db()
+
+        if isinstance(key, unicode) is True:
+            log.debug('Key Name: {}'.format(key))
+            log.debug('Key type: {}'.format(type(key)))
+            key = str(key)
+
+        self.db[key] = value
+        self.dirty.add(key)
+
+    def load(self, key):
+        """Loads value for given key
+
+            Args:
+
+                key (str): The key associated with the value you want
+                form the database.
+
+            Returns:
+
+                Object if exists or else None
+        """
+        if self.db is None:
+            self.load_db()
+
+        if isinstance(key, unicode) is True:
+            log.debug('Key Name: {}'.format(key))
+            log.debug('Key type: {}'.format(type(key)))
+            key = str(key)
+
+        return self.db.get(key)
@@ -15,25 +15,16 @@
 # --------------------------------------------------------------------------
 from __future__ import unicode_literals
 
-import json
 import logging
 import os
-import shutil
 import sys
 import warnings
 
-from appdirs import user_log_dir
-from jms_utils.logger import log_formatter
-from jms_utils.paths import ChDir
-from jms_utils.terminal import ask_yes_no
-import requests
-import stevedore
-
-
-from pyupdater import PyUpdater, __version__
+from pyupdater import __version__
 from pyupdater import settings
 from pyupdater.utils import (check_repo,
                              initial_setup,
+                             lazy_import,
                              pretty_time,
                              repo_update,
                              setup_appname,
@@ -45,41 +36,108 @@ from pyupdater.utils import (check_repo,
 from pyupdater.utils.config import Loader, SetupConfig
 from pyupdater.utils.exceptions import UploaderError, UploaderPluginError
 from pyupdater.utils.storage import Storage
-from pyupdater.wrapper.builder import Builder
 from pyupdater.wrapper.options import get_parser
 
+# Commands only load the modules they use. pyupdater version doesn't
+# pay for PyInstaller, requests or the uploader plugins.
+
+
+@lazy_import
+def json():
+    import json
+    return json
+
+
+@lazy_import
+def shutil():
+    import shutil
+    return shutil
+
+
+@lazy_import
+def appdirs():
+    import appdirs
+    return appdirs
+
+
+@lazy_import
+def jms_utils():
+    import jms_utils
+    import jms_utils.logger
+    import jms_utils.paths
+    import jms_utils.terminal
+    return jms_utils
+
+
+@lazy_import
+def requests():
+    import requests
+    return requests
+
+
+@lazy_import
+def stevedore():
+    import stevedore
+    return stevedore
+
+
+@lazy_import
+def core():
+    import pyupdater.core
+    return pyupdater.core
+
+
+@lazy_import
+def builder():
+    import pyupdater.wrapper.builder
+    return pyupdater.wrapper.builder
+
 
-CWD = os.getcwd()
 log = logging.getLogger()
-if os.path.exists(os.path.join(CWD, 'pyu.log')):  # pragma: no cover
-    fh = logging.FileHandler(os.path.join(CWD, 'pyu.log'))
-    fh.setLevel(logging.DEBUG)
-    fh.setFormatter(log_formatter())
-    log.addHandler(fh)
 
-fmt = logging.Formatter('[%(levelname)s] %(message)s')
-sh = logging.StreamHandler()
-sh.setFormatter(fmt)
 
-# Used for Development
-# sh.setLevel(logging.DEBUG)
+def _log_dir():
+    return appdirs.user_log_dir(settings.APP_NAME, settings.APP_AUTHOR)
+
+
+def _setup_logging():
+    # Called by main so importing the wrapper doesn't add handlers to
+    # the root logger
+    import logging.handlers
+    cwd = os.getcwd()
+    if os.path.exists(os.path.join(cwd, 'pyu.log')):  # pragma: no cover
+        fh = logging.FileHandler(os.path.join(cwd, 'pyu.log'))
+        fh.setLevel(logging.DEBUG)
+        fh.setFormatter(jms_utils.logger.log_formatter())
+        log.addHandler(fh)
+
+    fmt = logging.Formatter('[%(levelname)s] %(message)s')
+    sh = logging.StreamHandler()
+    sh.setFormatter(fmt)
+
+    # Used for Development
+    # sh.setLevel(logging.DEBUG)
 
-sh.setLevel(logging.INFO)
-log.addHandler(sh)
+    sh.setLevel(logging.INFO)
+    log.addHandler(sh)
 
-LOG_DIR = user_log_dir(settings.APP_NAME, settings.APP_AUTHOR)
-log_file = os.path.join(LOG_DIR, settings.LOG_FILENAME_DEBUG)
-rfh = logging.handlers.RotatingFileHandler(log_file, maxBytes=35000,
-                                           backupCount=2)
-rfh.setFormatter(log_formatter())
-rfh.setLevel(logging.DEBUG)
-log.addHandler(rfh)
+    log_dir = _log_dir()
+    if not os.path.exists(log_dir):  # pragma: no cover
+        os.makedirs(log_dir)
+    log_file = os.path.join(log_dir, settings.LOG_FILENAME_DEBUG)
+    rfh = logging.handlers.RotatingFileHandler(log_file, maxBytes=35000,
+                                               backupCount=2)
+    rfh.setFormatter(jms_utils.logger.log_formatter())
+    rfh.setLevel(logging.DEBUG)
+    log.addHandler(rfh)
+    log.setLevel(logging.DEBUG)
+    log.debug('Version - {}'.format(__version__))
 
 
 def _build(args, pyi_args):
     check_repo()
-    builder = Builder(args, pyi_args)
-    builder.build()
+    b = builder.Builder(args, pyi_args)
+    b.build()
 
 
 # Get permission before deleting PyUpdater repo
@@ -88,8 +146,9 @@ def clean(args):  # pragma: no cover
         _clean()
 
     else:
-        answer = ask_yes_no('Are you sure you want to remove '
-                            'pyupdater data?', default='no')
+        answer = jms_utils.terminal.ask_yes_no('Are you sure you want to '
+                                               'remove pyupdater data?',
+                                               default='no')
         if answer is True:
             _clean()
         else:
@@ -124,7 +183,7 @@ def init(args):  # pragma: no cover
                           settings.CONFIG_FILE_USER)):
         config = initial_setup(SetupConfig())
         log.info('Creating pyu-data dir...')
-        pyu = PyUpdater(config, db)
+        pyu = core.Core(config, db)
         pyu.setup()
         log.info('Making signing keys...')
         pyu.make_keys(count)
@@ -141,8 +200,8 @@ def keys(args):
         _keys(args)
 
     else:
-        answer = ask_yes_no('Are you sure you want to revoke?',
-                            default='no')
+        answer = jms_utils.terminal.ask_yes_no('Are you sure you want to '
+                                               'revoke?', default='no')
         if answer is True:
             _keys(args)
         else:
@@ -155,8 +214,8 @@ def keys(args):  # pragma: no cover
         _keys(args)
 
     else:
-        answer = ask_yes_no('Are you sure you want to revoke?',
-                            default='no')
+        answer = jms_utils.terminal.ask_yes_no('Are you sure you want to '
+                                               'revoke?', default='no')
         if answer is True:
             _keys(args)
         else:
@@ -169,7 +228,7 @@ def _keys(args):  # pragma: no cover
     db = Storage()
     loader = Loader(db)
     config = loader.load_config()
-    pyu = PyUpdater(config, db)
+    pyu = core.Core(config, db)
     if args.count is not None:
         count = args.count
         pyu.revoke_key(count)
@@ -191,15 +250,15 @@ def _keys(args):  # pragma: no cover
 
 def _make_spec(args, pyi_args):
     check_repo()
-    builder = Builder(args, pyi_args)
-    builder.make_spec()
+    b = builder.Builder(args, pyi_args)
+    b.make_spec()
 
 
 def pkg(args):
     check_repo()
     db = Storage()
     loader = Loader(db)
-    pyu = PyUpdater(loader.load_config(), db)
+    pyu = core.Core(loader.load_config(), db)
     if args.process is False and args.sign is False:
         sys.exit('You must specify a command')
 
@@ -259,7 +318,7 @@ def upload_debug_info(args):  # pragma: no cover
         return url
 
     upload_data = {str('files'): {}}
-    with ChDir(LOG_DIR):
+    with jms_utils.paths.ChDir(_log_dir()):
         temp_files = os.listdir(os.getcwd())
         if len(temp_files) == 0:
             log.info('No log files to collect')
@@ -301,9 +360,9 @@ def upload(args):  # pragma: no cover
         error = True
 
     if error is False:
-        pyu = PyUpdater(loader.load_config(), db)
+        pyu = core.Core(loader.load_config(), db)
         try:
-            pyu.set_uploader(upload_service)
+            pyu.set_uploader(upload_service, args.all)
         except UploaderError as err:
             log.error(str(err))
             error = True
@@ -373,6 +432,7 @@ def _real_main(args):  # pragma: no cover
 
 
 def main(args=None):  # pragma: no cover
+    _setup_logging()
     try:
         _real_main(args)
         exit = 0
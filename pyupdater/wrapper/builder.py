@@ -29,6 +29,12 @@ from pyupdater.utils import (check_repo,
                              make_archive,
                              Version)
 
+# The vendored PyInstaller is imported as a top level package
+vendor_dir = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'vendor')
+if vendor_dir not in sys.path:
+    sys.path.append(vendor_dir)
+
 from PyInstaller.main import run as pyi_build
 from PyInstaller import makespec as _pyi_makespec
 from PyInstaller import build as _pyi_build
@@ -255,7 +261,9 @@ class Builder(object):
             log.debug('Version: {}'.format(version))
 
             # Time for some archive creation!
-            file_name = make_archive(name, version, app_name)
+            file_name = make_archive(name, version, app_name,
+                                     level=args.compress_level,
+                                     archive_format=args.archive_format)
             log.debug('Archive name: {}'.format(file_name))
             if args.keep is False:
                 if os.path.exists(temp_name):
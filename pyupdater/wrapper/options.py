@@ -80,6 +80,14 @@ def _build_make_spec_commom(subparser):
                            required=True)
     subparser.add_argument('-k', '--keep', dest='keep', action='store_true',
                            help='Won\'t delete update after archiving')
+    subparser.add_argument('--compress-level', dest='compress_level',
+                           type=int, choices=range(0, 10), metavar='0-9',
+                           help='Compression level of the archive. 1-9 '
+                           'or 0-9 for xztar')
+    subparser.add_argument('--archive-format', dest='archive_format',
+                           choices=['gztar', 'bztar', 'xztar', 'zip'],
+                           help='Defaults to zip on windows & gztar on '
+                           'mac & linux')
 
 
 def add_build_parser(subparsers):
@@ -178,6 +186,9 @@ def add_upload_parser(subparsers):
     upload_parser = subparsers.add_parser('upload', help='Uploads files')
     upload_parser.add_argument('-s', '--service', help='Where '
                                'updates are stored', dest='service')
+    upload_parser.add_argument('--all', help='Upload every file, even '
+                               'ones uploaded before', action='store_true',
+                               dest='all')
 
 
 def add_version_parser(subparsers):
@@ -78,6 +78,9 @@ setup(
     entry_points="""
     [console_scripts]
     pyupdater=pyupdater.wrapper:main
+    [pyupdater.plugins.uploaders]
+    local=pyupdater.uploader.plugins:LocalUploader
+    http=pyupdater.uploader.plugins:HTTPUploader
     """,
     classifiers=[
         'Development Status :: 4 - Beta',
@@ -0,0 +1,78 @@
+# --------------------------------------------------------------------------
+# Copyright 2014 Digital Sapphire Development Team
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# --------------------------------------------------------------------------
+from __future__ import unicode_literals
+
+import os
+
+import pytest
+
+from pyupdater import settings
+from pyupdater.utils import gzip_compress
+from pyupdater.utils.chunks import (build_archive,
+                                    chunk_boundaries,
+                                    compress_chunk,
+                                    decompress_chunk,
+                                    load_chunk_index,
+                                    make_chunk_index,
+                                    split_chunks)
+from pyupdater.utils.exceptions import UtilsError
+
+
+class TestChunks(object):
+
+    def test_boundaries(self):
+        data = os.urandom(1024 * 1024)
+        boundaries = list(chunk_boundaries(data))
+        assert boundaries[0][0] == 0
+        assert sum(l for _, l in boundaries) == len(data)
+        for offset, length in boundaries[:-1]:
+            assert settings.CHUNK_MIN_SIZE < length
+            assert length <= settings.CHUNK_MAX_SIZE
+        assert list(chunk_boundaries(b'')) == []
+        assert list(chunk_boundaries(b'abc')) == [(0, 3)]
+
+    def test_insert_changes_few_chunks(self):
+        data = os.urandom(1024 * 1024)
+        new = data[:300000] + b'inserted data' + data[300000:]
+        old_chunks = set(d for d, _ in split_chunks(data))
+        new_chunks = [d for d, _ in split_chunks(new)]
+        changed = [d for d in new_chunks if d not in old_chunks]
+        assert 0 < len(changed) <= 2
+
+    def test_index(self):
+        payload = os.urandom(200 * 1024)
+        chunks = [(d, len(c)) for d, c in split_chunks(payload)]
+        data = make_chunk_index(chunks, settings.PATCH_MODE_TAR, 9)
+        assert data == make_chunk_index(chunks, settings.PATCH_MODE_TAR, 9)
+        index = load_chunk_index(data)
+        assert index['chunks'] == chunks
+        assert index['size'] == len(payload)
+        assert build_archive(payload, index) == gzip_compress(payload, 9)
+
+        index = load_chunk_index(make_chunk_index(chunks))
+        assert index['mode'] is None
+        assert build_archive(payload, index) == payload
+
+        with pytest.raises(UtilsError):
+            load_chunk_index(gzip_compress(b'not an index'))
+
+    def test_compress_chunk(self):
+        digest, chunk = next(split_chunks(b'chunk data'))
+        assert decompress_chunk(compress_chunk(chunk), digest) == chunk
+        with pytest.raises(UtilsError):
+            decompress_chunk(compress_chunk(b'other'), digest)
+        with pytest.raises(UtilsError):
+            decompress_chunk(b'not zlib', digest)
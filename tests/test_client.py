@@ -19,13 +19,17 @@ from __future__ import unicode_literals
 import json
 import os
 import shutil
+import subprocess
+import sys
 import time
 
+import ed25519
 from jms_utils.system import get_system
 from jms_utils.paths import ChDir
 import pytest
 
 from pyupdater.client import Client
+from pyupdater.utils import get_key_id
 from tconfig import TConfig
 
 
@@ -84,6 +88,24 @@ class TestSetup(object):
         del filesystem_data['sigs']
         assert client.json_data == filesystem_data
 
+    def test_verify_data_key_id(self):
+        privkey, pubkey = ed25519.create_keypair()
+        pub = pubkey.to_ascii(encoding='base64').decode('ascii')
+        t_config = TConfig()
+        t_config.PUBLIC_KEYS = [pub]
+        t_config.DATA_DIR = os.getcwd()
+        client = Client(t_config, test=True)
+        data = b'version data'
+        sig = privkey.sign(data, encoding='base64')
+        assert client._verify_data(data, [('unknown', sig)],
+                                   encoding='base64') is False
+        assert client._verify_data(data, [(get_key_id(pub), sig)],
+                                   encoding='base64') is True
+        assert os.path.exists(client.verified_cache_file)
+        # Cached digests skip verification
+        client = Client(t_config, test=True)
+        assert client._verify_data(data, [], encoding='base64') is True
+
     def test_url_str_attr(self):
         t_config = TConfig()
         t_config.DATA_DIR = os.getcwd()
@@ -126,6 +148,43 @@ class TestSetup(object):
         client = Client(t_config, refresh=True, test=True)
         assert isinstance(client.update_urls, list)
 
+    def test_dirs_made_on_refresh(self):
+        t_config = TConfig()
+        t_config.DATA_DIR = os.path.join(os.getcwd(), 'data')
+        client = Client(t_config, test=True)
+        assert not os.path.exists(client.data_dir)
+        client.refresh()
+        assert os.path.exists(client.update_folder)
+
+
+# Imports the client in a new interpreter like a frozen app does
+IMPORT_CLIENT = """
+import json, logging, sys
+root = logging.getLogger()
+level, handlers, path = root.level, list(root.handlers), list(sys.path)
+import pyupdater.client
+print(json.dumps({'level': root.level == level,
+                  'handlers': root.handlers == handlers,
+                  'path': sys.path == path,
+                  'modules': sorted(sys.modules)}))
+"""
+
+
+class TestImport(object):
+
+    def test_no_side_effects(self):
+        p = subprocess.Popen([sys.executable, '-c', IMPORT_CLIENT],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate()
+        assert p.returncode == 0, err
+        data = json.loads(out.decode('utf-8').strip().splitlines()[-1])
+        assert data['level'] is True
+        assert data['handlers'] is True
+        assert data['path'] is True
+        for m in ['pyupdater.key_handler', 'pyupdater.package_handler',
+                  'pyupdater.uploader', 'appdirs', 'ed25519', 'urllib3']:
+            assert m not in data['modules']
+
 
 @pytest.mark.usefixtures("cleandir", "client")
 class TestDownload(object):
@@ -0,0 +1,107 @@
+# --------------------------------------------------------------------------
+# Copyright 2014 Digital Sapphire Development Team
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# --------------------------------------------------------------------------
+from __future__ import unicode_literals
+
+import io
+import os
+import tarfile
+import time
+
+import pytest
+
+from pyupdater.utils.diff_engines import get_engine, get_engine_names
+from pyupdater.utils.exceptions import UtilsError
+
+
+def make_tar(members):
+    f = io.BytesIO()
+    with tarfile.open(fileobj=f, mode='w') as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return f.getvalue()
+
+
+def make_data():
+    src = os.urandom(64 * 1024)
+    dst = bytearray(src)
+    # Insert of whole tar records, changed bytes & appended data
+    dst[1024:1024] = os.urandom(512 * 3)
+    dst[30000:30100] = os.urandom(100)
+    dst += os.urandom(5000)
+    return src, bytes(dst)
+
+
+@pytest.mark.usefixtures('cleandir')
+class TestDiffEngines(object):
+
+    def test_engines(self):
+        assert 'block' in get_engine_names()
+        assert 'bsdiff4' in get_engine_names()
+        assert get_engine().format_id == 'bsdiff4'
+        with pytest.raises(UtilsError):
+            get_engine('not-an-engine')
+
+    @pytest.mark.parametrize('format_id', ['block', 'bsdiff4'])
+    def test_round_trip(self, format_id):
+        src, dst = make_data()
+        with open('src', 'wb') as f:
+            f.write(src)
+        with open('dst', 'wb') as f:
+            f.write(dst)
+        engine = get_engine(format_id)
+        engine.diff('src', 'dst', 'patch')
+        with open('patch', 'rb') as f:
+            patch = f.read()
+        assert len(patch) < len(dst) // 4
+        assert engine.patch(src, patch) == dst
+
+    def test_block_edges(self):
+        engine = get_engine('block')
+        assert engine.patch(b'', engine.diff_data(b'', b'abc')) == b'abc'
+        assert engine.patch(b'abc', engine.diff_data(b'abc', b'')) == b''
+
+    def test_block_tar(self):
+        members = [('file{}'.format(i), os.urandom(1000 + i * 517))
+                   for i in range(100)]
+        src = make_tar(members)
+        # New member at the front, one changed & one removed. The new
+        # member matches nothing but costs bz2 next to nothing, so the
+        # time is spent looking for matches.
+        new = [('new', b'\1' * (4 * 1024 * 1024 + 3))]
+        members[40] = ('file40', os.urandom(len(members[40][1])))
+        del members[70]
+        dst = make_tar(new + members)
+
+        engine = get_engine('block')
+        start = time.time()
+        patch = engine.diff_data(src, dst)
+        # A byte at a time loop takes seconds on the new member alone
+        assert time.time() - start < 1
+        # Nearly all of the old archive is copied
+        assert len(patch) < len(src) // 10
+        assert engine.patch(src, patch) == dst
+
+    def test_block_bad_patch(self):
+        engine = get_engine('block')
+        src, dst = make_data()
+        patch = engine.diff_data(src, dst)
+        with pytest.raises(UtilsError):
+            engine.patch(src, b'XXXXXXXX' + patch[8:])
+        with pytest.raises(UtilsError):
+            # Wrong source gives the wrong output length
+            engine.patch(src[:1000], patch)
@@ -17,8 +17,11 @@ from __future__ import unicode_literals
 
 import os
 
+import ed25519
 import pytest
 
+from pyupdater.key_handler import BatchSigner
+from pyupdater.utils import get_key_id
 from pyupdater.utils.storage import Storage
 from pyupdater.utils.keydb import KeyDB
 
@@ -65,3 +68,49 @@ class TestRevoke(object):
         keydb.revoke_key(count=1)
         assert len(keydb.get_public_keys()) == 1
         assert keydb.get_revoked_key()['public'] == 'public1'
+
+
+@pytest.mark.usefixtures("cleandir")
+class TestIndex(object):
+
+    def test_key_ids(self):
+        db = Storage()
+        keydb = KeyDB(db, load=True)
+        keydb.add_key('public1', 'private1')
+        keydb.add_key('public2', 'private2')
+        key_id = get_key_id('public1')
+        assert keydb.get_key(key_id)['private'] == 'private1'
+        assert keydb.get_key('unknown') is None
+        assert keydb.is_revoked(key_id) is False
+        keydb.revoke_key(count=1)
+        assert keydb.is_revoked(key_id) is True
+        assert keydb.is_revoked(get_key_id('public2')) is False
+
+    def test_reload(self):
+        db = Storage()
+        keydb = KeyDB(db, load=True)
+        for i in range(11):
+            keydb.add_key('public{}'.format(i), 'private{}'.format(i))
+        db._sync_db()
+
+        keydb = KeyDB(Storage(), load=True)
+        assert keydb.get_public_keys()[1] == 'public1'
+        keydb.revoke_key(count=2)
+        assert keydb.get_revoked_key()['public'] == 'public1'
+        assert len(keydb.get_public_keys()) == 9
+
+
+class TestBatchSigner(object):
+
+    def test_sign(self):
+        keys = [ed25519.create_keypair() for _ in range(2)]
+        signer = BatchSigner([(str(i), k) for i, (k, _) in enumerate(keys)])
+        first = signer.add(b'first')
+        second = signer.add(b'second', raw=True)
+        sigs = signer.sign()
+        assert signer.payloads == []
+        assert [key_id for key_id, _ in sigs[first]] == ['0', '1']
+        for (_, vk), (_, sig) in zip(keys, sigs[first]):
+            vk.verify(sig, b'first', encoding='base64')
+        for (_, vk), (_, sig) in zip(keys, sigs[second]):
+            vk.verify(sig, b'second')
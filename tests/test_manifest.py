@@ -0,0 +1,93 @@
+# --------------------------------------------------------------------------
+# Copyright 2014 Digital Sapphire Development Team
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# --------------------------------------------------------------------------
+from __future__ import unicode_literals
+
+import json
+
+import ed25519
+import pytest
+
+from pyupdater.utils.exceptions import UtilsError
+from pyupdater.utils.manifest import (attach_signatures,
+                                      BinaryManifest,
+                                      encode_manifest)
+
+FILE_HASH = ('cb44ec613a594f3b20e46b768c5ee780e0a9b66ac'
+             '6d5ac1468ca4d3635c4aa9b')
+
+MANIFEST = {
+    'latest': {'jms': {'mac': '0.0.2.2.0'}},
+    'updates': {
+        'jms': {
+            '0.0.1.2.0': {
+                'mac': {
+                    'file_hash': FILE_HASH,
+                    'filename': 'jms-mac-0.0.1.tar.gz',
+                    }
+                },
+            '0.0.2.2.0': {
+                'mac': {
+                    'file_hash': FILE_HASH,
+                    'filename': 'jms-mac-0.0.2.tar.gz',
+                    'patch_hash': FILE_HASH,
+                    'patch_name': 'jms-mac-101',
+                    }
+                },
+            }
+        },
+    }
+
+
+class TestBinaryManifest(object):
+
+    def test_round_trip(self):
+        manifest = BinaryManifest(encode_manifest(MANIFEST))
+        assert manifest.to_dict() == MANIFEST
+        assert manifest.signatures == []
+
+    def test_canonical(self):
+        reordered = json.loads(json.dumps(MANIFEST, sort_keys=True))
+        reordered['sigs'] = ['ignored']
+        assert encode_manifest(MANIFEST) == encode_manifest(reordered)
+
+    def test_lookup(self):
+        manifest = BinaryManifest(encode_manifest(MANIFEST))
+        assert manifest.get('latest*jms*mac') == '0.0.2.2.0'
+        assert manifest('updates*jms*0.0.1.2.0*mac*file_hash') == FILE_HASH
+        versions = manifest.get('updates*jms')
+        assert sorted(versions.keys()) == ['0.0.1.2.0', '0.0.2.2.0']
+        assert manifest.get('updates*nope') is None
+
+    def test_signatures(self):
+        privkey, pubkey = ed25519.create_keypair()
+        data = encode_manifest(MANIFEST)
+        sig = privkey.sign(data)
+        signed = attach_signatures(data, [('0123456789abcdef', sig)])
+        manifest = BinaryManifest(signed)
+        assert manifest.signed_data == data
+        assert manifest.signatures == [('0123456789abcdef', sig)]
+        pubkey.verify(manifest.signatures[0][1], manifest.signed_data)
+
+    def test_bad_data(self):
+        data = encode_manifest(MANIFEST)
+        with pytest.raises(UtilsError):
+            BinaryManifest(b'XXXX' + data[4:])
+        with pytest.raises(UtilsError):
+            BinaryManifest(data[:20])
+
+    def test_bad_value(self):
+        with pytest.raises(UtilsError):
+            encode_manifest({'latest': ['not', 'supported']})
@@ -16,11 +16,24 @@
 from __future__ import unicode_literals
 
 import os
+import tarfile
 
 import pytest
 
 from pyupdater import settings
-from pyupdater.package_handler import PackageHandler
+from pyupdater.package_handler import _diff_uncompressed, PackageHandler
+from pyupdater.package_handler.ledger import JobLedger
+from pyupdater.package_handler.scheduler import (chunk_cost,
+                                                 patch_cost,
+                                                 PatchScheduler)
+from pyupdater.utils import (get_object_path,
+                             get_package_hashes,
+                             gzip_compress,
+                             gzip_decompress,
+                             normalize_archive,
+                             Version)
+from pyupdater.utils.chunks import load_chunk_index
+from pyupdater.utils.diff_engines import get_engine
 from pyupdater.utils.config import TransistionDict
 from pyupdater.utils.exceptions import PackageHandlerError
 from tconfig import TConfig
@@ -28,6 +41,36 @@ from tconfig import TConfig
 s_dir = settings.USER_DATA_FOLDER
 
 
+def _unpicklable(job):
+    return lambda: job
+
+
+def _exit_worker(job):
+    # Simulates a worker killed mid job, i.e. by the oom killer
+    if job == 1:
+        os._exit(1)
+    return job
+
+
+class ChannelPackage(object):
+
+    def __init__(self, name, platform, version):
+        self.name = name
+        self.platform = platform
+        self.version = str(Version(version))
+
+
+class FinishedPatch(object):
+
+    def __init__(self, patch_name):
+        self.patch_name = patch_name
+        self.patch_format = 'bsdiff4'
+        self.patch_mode = None
+        self.ready = True
+        with open(patch_name, 'w') as f:
+            f.write('patch')
+
+
 @pytest.mark.usefixtures('cleandir', 'db', 'pyu')
 class TestUtils(object):
 
@@ -69,3 +112,364 @@ class TestExecution(object):
         with pytest.raises(PackageHandlerError):
             p = PackageHandler()
             p.process_packages()
+
+    def test_patch_format(self, db):
+        t_config = TConfig()
+        t_config.DATA_DIR = os.getcwd()
+        t_config.PATCH_ENGINE = 'block'
+        config = TransistionDict()
+        config.from_object(t_config)
+        p = PackageHandler(config, db)
+        assert p._patch_format('jms', settings.PATCH_MODE_TAR) == 'block'
+        # The block engine only suits tar payloads
+        assert p._patch_format('jms') == 'bsdiff4'
+
+    def test_prune_version_file(self, db):
+        data_dir = os.getcwd()
+        t_config = TConfig()
+        t_config.DATA_DIR = data_dir
+        t_config.UPDATE_RETENTION_COUNT = 2
+        config = TransistionDict()
+        config.from_object(t_config)
+        p = PackageHandler(config, db)
+        versions = ['0.0.1.2.0', '0.0.2.2.0', '0.0.3.2.0', '0.1.0.2.0']
+        json_data = {'latest': {'jms': {'mac': '0.1.0.2.0',
+                                        'win': '0.0.1.2.0'}},
+                     'updates': {'jms': {}}}
+        for v in versions:
+            json_data['updates']['jms'][v] = {
+                'mac': {'file_hash': 'abc',
+                        'filename': 'jms-mac-{}.tar.gz'.format(v)}}
+        json_data['updates']['jms']['0.0.1.2.0']['win'] = {
+            'file_hash': 'abc', 'filename': 'jms-win-0.0.1.zip'}
+        with open(os.path.join(p.deploy_dir, 'jms-mac-0.0.1.2.0.tar.gz'),
+                  'w') as f:
+            f.write('old')
+
+        pruned = p._prune_version_file(json_data)
+        assert sorted(pruned) == ['jms-mac-0.0.1.2.0.tar.gz',
+                                  'jms-mac-0.0.2.2.0.tar.gz']
+        updates = json_data['updates']['jms']
+        assert sorted(updates.keys()) == ['0.0.1.2.0', '0.0.3.2.0',
+                                          '0.1.0.2.0']
+        # Latest release for a platform is never pruned
+        assert list(updates['0.0.1.2.0'].keys()) == ['win']
+        p._remove_pruned_files(pruned)
+        assert not os.path.exists(os.path.join(p.deploy_dir,
+                                               'jms-mac-0.0.1.2.0.tar.gz'))
+
+    def test_prune_version_file_channels(self, db):
+        t_config = TConfig()
+        t_config.DATA_DIR = os.getcwd()
+        t_config.UPDATE_RETENTION_COUNT = 2
+        config = TransistionDict()
+        config.from_object(t_config)
+        p = PackageHandler(config, db)
+        versions = ['0.1.0.2.0', '0.2.0.2.0', '0.3.0.1.0', '0.3.0.1.1',
+                    '0.3.0.1.2']
+        json_data = {'latest': {'jms': {'mac': '0.3.0.1.2'}},
+                     'updates': {'jms': {}}}
+        for v in versions:
+            json_data['updates']['jms'][v] = {
+                'mac': {'file_hash': 'abc',
+                        'filename': 'jms-mac-{}.tar.gz'.format(v)}}
+            p._update_channels(json_data, ChannelPackage('jms', 'mac', v))
+
+        # Betas don't count against the stable releases
+        pruned = p._prune_version_file(json_data)
+        assert pruned == ['jms-mac-0.3.0.1.0.tar.gz']
+
+    def test_update_channels(self, db):
+        data_dir = os.getcwd()
+        t_config = TConfig()
+        t_config.DATA_DIR = data_dir
+        config = TransistionDict()
+        config.from_object(t_config)
+        p = PackageHandler(config, db)
+        json_data = {'updates': {}, 'latest': {}}
+        for version in ['0.1.0', '0.2.0b1', '0.2.0a1']:
+            package = ChannelPackage('jms', 'mac', version)
+            p._update_channels(json_data, package)
+        channels = json_data['channels']
+        assert channels['stable']['jms']['mac'] == '0.1.0.2.0'
+        assert channels['beta']['jms']['mac'] == '0.2.0.1.1'
+        # A newer beta beats an older alpha on the alpha channel
+        assert channels['alpha']['jms']['mac'] == '0.2.0.1.1'
+
+    def test_load_packages(self, db):
+        data_dir = os.getcwd()
+        t_config = TConfig()
+        t_config.DATA_DIR = data_dir
+        config = TransistionDict()
+        config.from_object(t_config)
+        p = PackageHandler(config, db)
+        filenames = ['jms-mac-0.1.{}.tar.gz'.format(i) for i in range(5)]
+        filenames.append('notes.txt')
+        for f in filenames:
+            with open(f, 'w') as f_:
+                f_.write(f)
+        packages = p._load_packages(filenames)
+        assert [pkg.filename for pkg in packages] == filenames
+        statuses = [pkg.info['status'] for pkg in packages]
+        assert statuses == [True, True, True, True, True, False]
+        assert packages[0].file_hash == get_package_hashes(filenames[0])
+
+    def test_inspect_package_ledger(self, db):
+        data_dir = os.getcwd()
+        t_config = TConfig()
+        t_config.DATA_DIR = data_dir
+        config = TransistionDict()
+        config.from_object(t_config)
+        p = PackageHandler(config, db)
+        filename = 'jms-mac-0.1.0.tar.gz'
+        with open(filename, 'w') as f:
+            f.write(filename)
+        digest = p._inspect_package(filename).file_hash
+        assert p.ledger.get_digest(filename) == digest
+        # Recorded digests are trusted while size & mtime match
+        p.ledger.files[filename]['digest'] = 'recorded'
+        assert p._inspect_package(filename).file_hash == 'recorded'
+        # Not recorded after normalizing
+        assert p.ledger.get_digest(filename, normalized=True) is None
+        with open(filename, 'w') as f:
+            f.write('changed')
+        assert p._inspect_package(filename).file_hash != 'recorded'
+
+    def test_resume_patch(self, db):
+        data_dir = os.getcwd()
+        t_config = TConfig()
+        t_config.DATA_DIR = data_dir
+        config = TransistionDict()
+        config.from_object(t_config)
+        p = PackageHandler(config, db)
+        package = ChannelPackage('jms', 'mac', '0.2.0')
+        package.file_hash = 'abc'
+        package.channel = 'stable'
+        package.patch_info = {}
+        p.json_data = {'latest': {'jms': {'mac': '0.1.0.2.0'}},
+                       'updates': {'jms': {'0.1.0.2.0': {'mac': {
+                           'filename': 'jms-mac-0.1.0.tar.gz'}}}}}
+        with open(os.path.join(p.files_dir, 'jms-mac-0.1.0.tar.gz'),
+                  'w') as f:
+            f.write('old')
+        assert p._resume_patch(package) is False
+        patch = FinishedPatch(os.path.join(p.new_dir, 'jms-mac-101'))
+        # Recorded the way a finished patch job is
+        p._record_patch({'patch_num': 101, 'file_hash': 'abc',
+                         'src': os.path.join(p.files_dir,
+                                             'jms-mac-0.1.0.tar.gz')},
+                        patch)
+        assert p._resume_patch(package) is True
+        assert package.patch_info['patch_name'] == 'jms-mac-101'
+        assert p.config['patches']['jms'] == 101
+        # Patch from another source can't be reused
+        info = p.ledger.get('abc', JobLedger.PATCHED)
+        info['src'] = 'jms-mac-0.0.9.tar.gz'
+        assert p._resume_patch(package) is False
+        p.ledger.complete('abc', JobLedger.MANIFEST)
+        assert p._resume_patch(package) is True
+
+    def test_ledger(self, db):
+        ledger = JobLedger(db)
+        for f in ['a', 'b']:
+            with open(f, 'w') as f_:
+                f_.write(f)
+            ledger.set_digest(f, f + '-digest')
+            ledger.complete(f + '-digest', JobLedger.MANIFEST)
+        ledger.save()
+        ledger = JobLedger(db)
+        assert ledger.get('a-digest', JobLedger.MANIFEST) is True
+        assert ledger.get('a-digest', JobLedger.PATCHED) is None
+        ledger.prune(['b'])
+        assert ledger.get_digest('a') is None
+        assert ledger.get('a-digest', JobLedger.MANIFEST) is None
+        assert ledger.get_digest('b') == 'b-digest'
+        ledger.finish('b-digest')
+        assert ledger.get_digest('b') is None
+        assert ledger.jobs == {}
+
+    def test_hashed_layout(self, db):
+        data_dir = os.getcwd()
+        t_config = TConfig()
+        t_config.DATA_DIR = data_dir
+        t_config.DEPLOY_LAYOUT = 'hashed'
+        config = TransistionDict()
+        config.from_object(t_config)
+        p = PackageHandler(config, db)
+        filename = 'jms-mac-0.1.0.tar.gz'
+        with open(os.path.join(p.new_dir, filename), 'w') as f:
+            f.write('app')
+        package = ChannelPackage('jms', 'mac', '0.1.0')
+        package.filename = filename
+        package.file_hash = get_package_hashes(os.path.join(p.new_dir,
+                                                            filename))
+        package.patch_info = {}
+        p._move_packages([package])
+        obj = get_object_path(package.file_hash)
+        assert obj == 'objects/{}/{}'.format(package.file_hash[:2],
+                                             package.file_hash[2:])
+        assert os.path.exists(os.path.join(p.deploy_dir, *obj.split('/')))
+        assert not os.path.exists(os.path.join(p.deploy_dir, filename))
+        assert os.path.exists(os.path.join(p.files_dir, filename))
+
+        # Objects still used by other releases aren't pruned
+        p.retention_count = 1
+        info = {'file_hash': package.file_hash, 'filename': filename,
+                'layout': 'hashed'}
+        json_data = {'latest': {'jms': {'mac': '0.2.0.2.0'},
+                                'pyu': {'mac': '0.2.0.2.0'}},
+                     'updates': {'jms': {'0.1.0.2.0': {'mac': info},
+                                         '0.2.0.2.0': {'mac': {
+                                             'file_hash': 'ff' * 32,
+                                             'filename': 'jms-new',
+                                             'layout': 'hashed'}}},
+                                 'pyu': {'0.2.0.2.0': {'mac': info}}}}
+        pruned = p._prune_version_file(json_data)
+        assert pruned == [filename]
+        del json_data['updates']['pyu']
+        json_data['updates']['jms']['0.1.0.2.0'] = {'mac': info}
+        pruned = p._prune_version_file(json_data)
+        assert pruned == [filename, obj]
+        p._remove_pruned_files(pruned)
+        assert not os.path.exists(os.path.join(p.deploy_dir,
+                                               *obj.split('/')))
+
+    def test_chunk_store(self, db):
+        data_dir = os.getcwd()
+        t_config = TConfig()
+        t_config.DATA_DIR = data_dir
+        t_config.CHUNK_STORE = True
+        config = TransistionDict()
+        config.from_object(t_config)
+        p = PackageHandler(config, db)
+        payload = os.urandom(512 * 1024)
+        packages = []
+        for i, data in enumerate([payload, payload[:1000] + payload]):
+            filename = 'jms-mac-0.{}.0.tar.gz'.format(i + 1)
+            with open(os.path.join(p.new_dir, filename), 'wb') as f:
+                f.write(gzip_compress(data))
+            package = ChannelPackage('jms', 'mac', '0.{}.0'.format(i + 1))
+            package.filename = filename
+            package.file_hash = get_package_hashes(
+                os.path.join(p.new_dir, filename))
+            package.patch_info = {}
+            package.chunk_index = None
+            package.normalized = True
+            packages.append(package)
+        p._store_chunks(packages)
+
+        chunks = []
+        for package in packages:
+            path = os.path.join(p.deploy_dir,
+                                *get_object_path(package.chunk_index)
+                                .split('/'))
+            with open(path, 'rb') as f:
+                index = load_chunk_index(f.read())
+            assert index['mode'] == settings.PATCH_MODE_TAR
+            chunks.append(set(c for c, _ in index['chunks']))
+            assert p.ledger.get(package.file_hash, JobLedger.CHUNKED) == \
+                package.chunk_index
+        # Most chunks are shared by both releases
+        assert len(chunks[1] - chunks[0]) <= 2
+        chunks_dir = os.path.join(p.deploy_dir,
+                                  settings.DEPLOY_CHUNKS_FOLDER)
+        stored = set()
+        for root, dirs, files in os.walk(chunks_dir):
+            stored.update(os.path.basename(root) + f for f in files)
+        assert stored == chunks[0] | chunks[1]
+
+        # Only chunks no other release uses are pruned
+        p.retention_count = 1
+        json_data = {'latest': {'jms': {'mac': packages[1].version}},
+                     'updates': {'jms': {}}}
+        for package in packages:
+            json_data['updates']['jms'][package.version] = {
+                'mac': {'file_hash': package.file_hash,
+                        'filename': package.filename,
+                        'chunk_index': package.chunk_index}}
+        pruned = p._prune_version_file(json_data)
+        assert pruned[0] == packages[0].filename
+        assert pruned[1] == get_object_path(packages[0].chunk_index)
+        assert len(pruned[2:]) == len(chunks[0] - chunks[1])
+
+        # Chunks aren't pruned if a kept release's index is missing
+        os.remove(os.path.join(p.deploy_dir,
+                               *get_object_path(packages[1].chunk_index)
+                               .split('/')))
+        json_data['updates']['jms'][packages[0].version] = {
+            'mac': {'file_hash': packages[0].file_hash,
+                    'filename': packages[0].filename,
+                    'chunk_index': packages[0].chunk_index}}
+        pruned = p._prune_version_file(json_data)
+        assert pruned == [packages[0].filename,
+                          get_object_path(packages[0].chunk_index)]
+
+    def test_diff_uncompressed(self):
+        archives = []
+        for i in range(2):
+            with open('app.txt', 'w') as f:
+                f.write('Version {}\n'.format(i) + 'lorem ipsum ' * 5000)
+            archive = 'app-mac-0.1.{}.tar.gz'.format(i)
+            with tarfile.open(archive, 'w:gz') as tar:
+                tar.add('app.txt')
+            normalize_archive(archive)
+            archives.append(archive)
+        engine = get_engine('block')
+        _diff_uncompressed(engine, archives[0], archives[1], 'patch')
+        with open(archives[0], 'rb') as f:
+            src = f.read()
+        with open(archives[1], 'rb') as f:
+            dst = f.read()
+        with open('patch', 'rb') as f:
+            patch = f.read()
+        # What the client does to rebuild the new archive
+        data = engine.patch(gzip_decompress(src), patch)
+        assert gzip_compress(data) == dst
+
+
+@pytest.mark.usefixtures('cleandir')
+class TestPatchScheduler(object):
+
+    def test_run(self):
+        # Budget only fits one job at a time
+        scheduler = PatchScheduler(max_workers=4, memory=3)
+        jobs = ['a', 'bb', 'ccc', 'dddd']
+        assert scheduler.run(len, jobs, [1, 2, 3, 1]) == [1, 2, 3, 4]
+        assert len(scheduler.stats) == 4
+        assert scheduler.stats[0][2] is None
+
+    def test_run_callback(self):
+        scheduler = PatchScheduler(max_workers=2)
+        finished = []
+        results = scheduler.run(len, ['a', 'bb', 'ccc'], [1, 1, 1],
+                                callback=lambda i, r: finished.append((i, r)))
+        assert results == [1, 2, 3]
+        assert sorted(finished) == [(0, 1), (1, 2), (2, 3)]
+
+    def test_run_error(self):
+        scheduler = PatchScheduler(max_workers=2)
+        assert scheduler.run(int, ['1', 'x'], [1, 1]) == [1, None]
+        assert scheduler.stats[1][2] is not None
+
+    def test_run_unpicklable_result(self):
+        scheduler = PatchScheduler(max_workers=2)
+        results = scheduler.run(_unpicklable, [1, 2], [1, 1])
+        assert results == [None, None]
+        assert scheduler.stats[0][2] is not None
+
+    def test_run_worker_died(self):
+        scheduler = PatchScheduler(max_workers=2)
+        scheduler.dead_worker_grace = 0.5
+        assert scheduler.run(_exit_worker, [1, 2], [1, 1]) == [None, 2]
+        assert 'died' in scheduler.stats[0][2]
+        assert scheduler.stats[1][2] is None
+
+    def test_patch_cost(self):
+        with open('src', 'w') as f:
+            f.write('a' * 10)
+        with open('dst', 'w') as f:
+            f.write('a' * 20)
+        cost = 10 * settings.PATCH_MEMORY_FACTOR + 20
+        assert patch_cost('src', 'dst') == cost
+        assert patch_cost('missing', 'dst') == 20
+        assert chunk_cost('dst') == 60
@@ -47,6 +47,11 @@ class TestUtils(object):
         updater.from_object(myconfig)
         assert updater['APP_NAME'] == 'PyUpdater App'
 
+    def test_pyupdater_class(self):
+        class MyUpdater(PyUpdater):
+            pass
+        assert isinstance(MyUpdater(), PyUpdater)
+
     def test_setup(self):
         data_dir = os.getcwd()
         pyu_data_dir = os.path.join(data_dir, 'pyu-data')
@@ -88,6 +93,12 @@ class TestExecution(object):
         pyu.sign_update()
         assert os.path.exists(os.path.join(pyu_data_dir, 'deploy',
                               'versions.gz'))
+        assert os.path.exists(os.path.join(pyu_data_dir, 'deploy',
+                              'versions.bin.gz'))
+        assert os.path.exists(os.path.join(pyu_data_dir, 'deploy',
+                              'versions.sig'))
+        assert os.path.exists(os.path.join(pyu_data_dir, 'deploy',
+                              'versions-stable.gz'))
 
     def test_execution_patch(self, pyu, db):
 
@@ -127,4 +138,4 @@ class TestExecution(object):
                                   gen_archive_name(2)))
 
         files = os.listdir(os.path.join(pyu_data_dir, 'deploy'))
-        assert len(files) == 4
+        assert len(files) == 12
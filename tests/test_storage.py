@@ -0,0 +1,115 @@
+# --------------------------------------------------------------------------
+# Copyright 2014 Digital Sapphire Development Team
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# --------------------------------------------------------------------------
+from __future__ import unicode_literals
+
+import json
+import os
+import sqlite3
+
+import pytest
+
+from pyupdater import settings
+from pyupdater.utils.storage import Storage
+
+
+def get_rows(db):
+    conn = sqlite3.connect(db.filename)
+    try:
+        return dict(conn.execute('SELECT key, value FROM config'))
+    finally:
+        conn.close()
+
+
+@pytest.mark.usefixtures('cleandir')
+class TestStorage(object):
+
+    def test_save_load(self):
+        db = Storage()
+        db.save('version_meta', {'updates': {}})
+        db.save('app_config', {'APP_NAME': 'jms'})
+        db._sync_db()
+        assert os.path.exists(db.filename)
+
+        db = Storage()
+        assert db.load('version_meta') == {'updates': {}}
+        assert db.load('app_config') == {'APP_NAME': 'jms'}
+        assert db.load('missing') is None
+
+    def test_only_saved_keys_written(self):
+        db = Storage()
+        db.save('version_meta', {'updates': {}})
+        db.save('app_config', {'APP_NAME': 'jms'})
+        db._sync_db()
+        conn = sqlite3.connect(db.filename)
+        with conn:
+            conn.execute('UPDATE config SET value = ? WHERE key = ?',
+                         ('"untouched"', 'app_config'))
+        conn.close()
+
+        db.save('version_meta', {'updates': {'jms': {}}})
+        db._sync_db()
+        rows = get_rows(db)
+        assert json.loads(rows['version_meta']) == {'updates': {}}
+        assert json.loads(rows['version_meta/jms']) == {}
+        assert rows['app_config'] == '"untouched"'
+
+        db = Storage()
+        assert db.load('version_meta') == {'updates': {'jms': {}}}
+
+    def test_version_meta_rows(self):
+        info = {'filename': 'jms-mac-0.1.0.tar.gz', 'file_size': 10}
+        meta = {'latest': {}, 'updates': {'jms': {'0.1.0': {'mac': info,
+                                                            'win': info}}}}
+        db = Storage()
+        db.save('version_meta', meta)
+        db._sync_db()
+        rows = get_rows(db)
+        assert set(rows.keys()) == set(['version_meta',
+                                        'version_meta/jms/0.1.0/mac',
+                                        'version_meta/jms/0.1.0/win'])
+        conn = sqlite3.connect(db.filename)
+        with conn:
+            conn.execute('UPDATE config SET value = ? WHERE key = ?',
+                         ('"untouched"', 'version_meta/jms/0.1.0/mac'))
+        conn.close()
+
+        # Adding a release only writes its own row
+        meta['updates']['jms']['0.2.0'] = {'mac': info}
+        del meta['updates']['jms']['0.1.0']['win']
+        db.save('version_meta', meta)
+        db._sync_db()
+        rows = get_rows(db)
+        assert rows['version_meta/jms/0.1.0/mac'] == '"untouched"'
+        assert json.loads(rows['version_meta/jms/0.2.0/mac']) == info
+        assert 'version_meta/jms/0.1.0/win' not in rows
+
+        db = Storage()
+        meta['updates']['jms']['0.1.0']['mac'] = 'untouched'
+        assert db.load('version_meta') == meta
+
+    def test_migrate_json(self):
+        os.mkdir(settings.CONFIG_DATA_FOLDER)
+        filename = os.path.join(settings.CONFIG_DATA_FOLDER,
+                                settings.CONFIG_FILE_USER)
+        with open(filename, 'w') as f:
+            f.write(json.dumps({'version_meta': {'updates': {}},
+                                'app_config': json.dumps({'a': 1})}))
+        db = Storage()
+        assert db.load('version_meta') == {'updates': {}}
+        assert db.load('app_config') == {'a': 1}
+        assert os.path.exists(filename + '.old')
+        assert set(get_rows(db).keys()) == set(['version_meta',
+                                                'app_config'])
@@ -15,10 +15,13 @@
 # --------------------------------------------------------------------------
 from __future__ import unicode_literals
 
+import os
+
 import pytest
 import requests
 
 from pyupdater.uploader import BaseUploader, Uploader
+from pyupdater.uploader.plugins import LocalUploader
 from pyupdater.utils.exceptions import UploaderError, UploaderPluginError
 
 from tconfig import TConfig
@@ -62,6 +65,62 @@ class TestUtils(object):
         mu.init()
         mu.upload()
 
+    def test_plugin_baseclass_retries(self):
+        class MyUploader(BaseUploader):
+            upload_retry_delay = 0
+
+            def init(self, **kwargs):
+                self.file_list = ['a', 'b', 'c', 'bad']
+                self.attempts = {}
+
+            def upload_file(self, filename):
+                count = self.attempts.get(filename, 0) + 1
+                self.attempts[filename] = count
+                if filename == 'bad':
+                    raise IOError('Connection reset')
+                # Every file fails once
+                return count > 1
+
+        mu = MyUploader()
+        mu.init()
+        assert mu.upload() is False
+        assert mu.failed_uploads == ['bad']
+        assert mu.files_completed == 3
+        assert mu.attempts == {'a': 2, 'b': 2, 'c': 2,
+                               'bad': mu.upload_retries + 1}
+
+    def test_plugin_baseclass_publish_order(self):
+        class MyUploader(BaseUploader):
+            upload_retry_delay = 0
+
+            def init(self, **kwargs):
+                self.file_list = kwargs['files']
+                self.fail = kwargs.get('fail')
+                self.uploaded = []
+
+            def upload_file(self, filename):
+                if filename == self.fail:
+                    return False
+                self.uploaded.append(filename)
+                return True
+
+        files = ['versions.sig', 'versions.gz', 'app-mac-0.2.0.tar.gz',
+                 'app-mac-2', 'versions-beta.gz']
+        mu = MyUploader()
+        mu.init(files=files)
+        assert mu.upload() is True
+        assert sorted(mu.uploaded[:2]) == ['app-mac-0.2.0.tar.gz',
+                                           'app-mac-2']
+        assert mu.uploaded[2:] == ['versions-beta.gz', 'versions.gz',
+                                   'versions.sig']
+
+        # Version files aren't published if a file failed
+        mu = MyUploader()
+        mu.init(files=files, fail='app-mac-2')
+        assert mu.upload() is False
+        assert mu.uploaded == ['app-mac-0.2.0.tar.gz']
+        assert 'versions.gz' in mu.failed_uploads
+
 
 @pytest.mark.usefixtures('cleandir')
 class TestExecution(object):
@@ -91,6 +150,112 @@ class TestExecution(object):
         u.uploader.init(test='test')
         u.upload()
 
+    def test_upload_inventory(self, db):
+        class MyUploader(BaseUploader):
+
+            def init(self, **kwargs):
+                self.file_list = kwargs['files']
+                self.uploaded = []
+
+            def upload_file(self, filename):
+                self.uploaded.append(filename)
+                return True
+
+        u = Uploader()
+        u.init({'DATA_DIR': os.getcwd()}, db)
+        os.makedirs(os.path.join(u.deploy_dir, 'objects', 'ab'))
+        for path in ['versions.gz', 'app.tar.gz',
+                     os.path.join('objects', 'ab', 'cdef')]:
+            with open(os.path.join(u.deploy_dir, path), 'w') as f:
+                f.write('data')
+
+        def upload():
+            u.destination = 'test:bucket'
+            u.files = u._changed_files(u._get_files())
+            u.uploader = MyUploader()
+            u.uploader.init(files=u.files)
+            u.upload()
+            return sorted(u.uploader.uploaded)
+
+        assert upload() == ['app.tar.gz', 'objects/ab/cdef', 'versions.gz']
+        assert upload() == []
+        with open(os.path.join(u.deploy_dir, 'versions.gz'), 'w') as f:
+            f.write('new data')
+        assert upload() == ['versions.gz']
+        # A touched file isn't uploaded & its new mtime is recorded
+        path = os.path.join(u.deploy_dir, 'app.tar.gz')
+        os.utime(path, (0, 0))
+        assert upload() == []
+        assert u._load_inventory()['app.tar.gz']['mtime'] == 0
+
+    def test_local_uploader(self, db):
+        u = Uploader()
+        u.init({'DATA_DIR': os.getcwd(),
+                'UPLOAD_DIR': ['mirror1', 'mirror2']}, db)
+        os.makedirs(os.path.join(u.deploy_dir, 'objects', 'ab'))
+        for path in ['versions.gz', 'app.tar.gz',
+                     os.path.join('objects', 'ab', 'cdef')]:
+            with open(os.path.join(u.deploy_dir, path), 'w') as f:
+                f.write('data')
+
+        u.set_uploader(str('local'))
+        assert isinstance(u.uploader, LocalUploader)
+        assert len(u.files) == 3
+        u.upload()
+        for mirror in ['mirror1', 'mirror2']:
+            with open(os.path.join(mirror, 'objects', 'ab', 'cdef')) as f:
+                assert f.read() == 'data'
+            assert os.path.exists(os.path.join(mirror, 'versions.gz'))
+
+        # Unchanged files are skipped
+        u.set_uploader(str('local'))
+        assert u.files == []
+        u.set_uploader(str('local'), upload_all=True)
+        assert len(u.files) == 3
+
+    def test_multipart_resume(self, db):
+        class MyUploader(LocalUploader):
+            multipart = True
+            multipart_threshold = 1024
+            multipart_part_size = 1024
+            upload_retries = 0
+
+            def upload_part(self, filename, upload_id, part_number, data):
+                self.sent.append(part_number)
+                if part_number in self.fail:
+                    raise IOError('Connection reset')
+                return super(MyUploader, self).upload_part(
+                    filename, upload_id, part_number, data)
+
+        u = Uploader()
+        u.init({'DATA_DIR': os.getcwd(), 'UPLOAD_DIR': 'mirror'}, db)
+        os.makedirs(u.deploy_dir)
+        data = os.urandom(5000)
+        with open(os.path.join(u.deploy_dir, 'app.tar.gz'), 'wb') as f:
+            f.write(data)
+
+        def upload(fail):
+            u.destination = 'local:mirror'
+            u.files = u._changed_files(u._get_files())
+            u.uploader = MyUploader()
+            u.uploader.init(upload_dir='mirror', files=u.files)
+            u.uploader.sent = []
+            u.uploader.fail = fail
+            u.upload()
+            return sorted(u.uploader.sent)
+
+        assert upload([2, 4]) == [1, 2, 3, 4, 5]
+        assert not os.path.exists(os.path.join('mirror', 'app.tar.gz'))
+        # The next run only sends the missing parts
+        assert upload([]) == [2, 4]
+        with open(os.path.join('mirror', 'app.tar.gz'), 'rb') as f:
+            assert f.read() == data
+        assert os.listdir(os.path.join('mirror', '.multipart')) == []
+
+    def test_local_uploader_no_dir(self):
+        with pytest.raises(UploaderError):
+            LocalUploader().init(files=[])
+
     def test_set_uploader_fail(self):
         u = Uploader()
         u.init({'test': 'test'})
@@ -16,16 +16,33 @@
 from __future__ import unicode_literals
 
 import os
+import tarfile
+import time
 
 from jms_utils.paths import ChDir
 import pytest
 
-from pyupdater.utils import (check_repo,
+from pyupdater.utils import (ArchiveWriter,
+                             atomic_write,
+                             AtomicWriter,
+                             check_repo,
+                             compress_archive,
                              convert_to_list,
                              EasyAccessDict,
+                             get_archive_format,
                              get_hash,
+                             get_highest_version,
+                             get_key_id,
                              get_mac_dot_app_dir,
                              get_package_hashes,
+                             gzip_compress,
+                             gzip_decompress,
+                             lazy_import,
+                             link_file,
+                             make_archive,
+                             move_file,
+                             normalize_archive,
+                             open_tar,
                              parse_platform,
                              remove_dot_files,
                              Version
@@ -69,6 +86,159 @@ class TestUtils(object):
                   '405d950e5d5c8f3169fca0')
         assert digest == get_hash('Get this hash please')
 
+    def test_get_key_id(self):
+        key = 'O7DW/Bmyi7+mNxzAmB7Js/LLJOBnvXHeGr4lIvUbsjo'
+        assert get_key_id(key) == get_key_id(key.encode('ascii'))
+        assert len(get_key_id(key)) == 16
+        assert get_key_id(key) != get_key_id(key[:-1] + 'k')
+
+    def test_gzip_compress(self):
+        data = b'Some data to compress' * 100
+        compressed = gzip_compress(data)
+        assert compressed == gzip_compress(data)
+        assert gzip_decompress(compressed) == data
+        assert gzip_compress(data, 1) != compressed
+
+    def test_normalize_archive(self):
+        with open('normal.txt', 'w') as f:
+            f.write('I should be normal')
+        with tarfile.open('app-mac-0.1.0.tar.gz', 'w:gz') as tar:
+            tar.add('normal.txt')
+        with open('app-mac-0.1.0.tar.gz', 'rb') as f:
+            data = f.read()
+        assert normalize_archive('app-mac-0.1.0.tar.gz') is True
+        with open('app-mac-0.1.0.tar.gz', 'rb') as f:
+            normalized = f.read()
+        assert normalized == gzip_compress(gzip_decompress(data))
+        assert normalize_archive('normal.txt') is False
+
+    def test_make_archive_reproducible(self):
+        os.mkdir('app')
+        os.mkdir(os.path.join('app', 'lib'))
+        for f in ['app/run', 'app/lib/b.txt', 'app/lib/a.txt']:
+            with open(f, 'w') as f_:
+                f_.write(f * 10)
+        os.chmod(os.path.join('app', 'run'), 0o700)
+        filename = make_archive('app', '0.1.0', 'app')
+        with open(filename, 'rb') as f:
+            first = f.read()
+        os.remove(filename)
+        # Different times & permissions that aren't preserved
+        os.utime(os.path.join('app', 'lib', 'a.txt'), (0, time.time()))
+        os.chmod(os.path.join('app', 'lib', 'b.txt'), 0o600)
+        assert make_archive('app', '0.1.0', 'app') == filename
+        with open(filename, 'rb') as f:
+            assert f.read() == first
+        with tarfile.open(filename, 'r:gz') as tar:
+            members = tar.getmembers()
+        assert [m.name for m in members] == ['app', 'app/lib',
+                                             'app/lib/a.txt',
+                                             'app/lib/b.txt', 'app/run']
+        assert members[-1].mode == 0o755
+        assert members[-2].mode == 0o644
+        assert len(set(m.mtime for m in members)) == 1
+        # Built archives are already normalized
+        assert gzip_compress(gzip_decompress(first)) == first
+
+    def test_archive_writer(self):
+        data = os.urandom(100000) + b'a' * 100000
+        with open('out.gz', 'wb') as f:
+            writer = ArchiveWriter(f, 'gztar')
+            for i in range(0, len(data), 7000):
+                writer.write(data[i:i + 7000])
+            assert writer.tell() == len(data)
+            writer.close()
+        with open('out.gz', 'rb') as f:
+            assert f.read() == compress_archive(data, 'gztar')
+
+    @pytest.mark.parametrize('archive_format', ['bztar', 'xztar'])
+    def test_make_archive_format(self, archive_format):
+        try:
+            compress_archive(b'', archive_format)
+        except UtilsError:
+            pytest.skip('lzma not installed')
+        with open('app', 'w') as f:
+            f.write('app' * 100)
+        filename = make_archive('app', '0.1.0', 'app', level=1,
+                                archive_format=archive_format)
+        assert get_archive_format(filename) == archive_format
+        assert str(Version(filename)) == '0.1.0.2.0'
+        with open(filename, 'rb') as f:
+            data = f.read()
+        os.remove(filename)
+        make_archive('app', '0.1.0', 'app', level=1,
+                     archive_format=archive_format)
+        with open(filename, 'rb') as f:
+            assert f.read() == data
+        with open_tar(filename) as tar:
+            assert tar.extractfile('app').read() == b'app' * 100
+
+    def test_make_archive_bad_format(self):
+        with open('app', 'w') as f:
+            f.write('app')
+        with pytest.raises(UtilsError):
+            make_archive('app', '0.1.0', 'app', archive_format='rar')
+        with pytest.raises(UtilsError):
+            compress_archive(b'', 'bztar', 0)
+
+    def test_link_file(self):
+        os.mkdir('deploy')
+        with open('app.tar.gz', 'w') as f:
+            f.write('app')
+        dst = os.path.join('deploy', 'app.tar.gz')
+        assert link_file('app.tar.gz', dst) in ['link', 'reflink', 'copy']
+        with open('app.tar.gz', 'w') as f:
+            f.write('new app')
+        # Replaces existing files
+        link_file('app.tar.gz', dst)
+        with open(dst, 'r') as f:
+            assert f.read() == 'new app'
+        assert os.listdir('deploy') == ['app.tar.gz']
+        # Linking again leaves no temp file
+        link_file('app.tar.gz', dst)
+        assert os.listdir('deploy') == ['app.tar.gz']
+
+    def test_move_file(self):
+        os.mkdir('files')
+        dst = os.path.join('files', 'app.tar.gz')
+        for data in ['app', 'new app']:
+            with open('app.tar.gz', 'w') as f:
+                f.write(data)
+            move_file('app.tar.gz', dst)
+            assert not os.path.exists('app.tar.gz')
+            with open(dst, 'r') as f:
+                assert f.read() == data
+        # Moving a hardlink of dst onto it
+        link_file(dst, 'app.tar.gz')
+        move_file('app.tar.gz', dst)
+        assert not os.path.exists('app.tar.gz')
+        assert os.listdir('files') == ['app.tar.gz']
+
+    def test_atomic_write(self):
+        atomic_write('versions.gz', b'old')
+        atomic_write('versions.gz', 'new')
+        with open('versions.gz', 'rb') as f:
+            assert f.read() == b'new'
+
+        # Nothing is replaced until every file is written
+        with pytest.raises(ValueError):
+            with AtomicWriter() as writer:
+                writer.write('versions.gz', b'newer')
+                writer.write('versions.sig', b'sig')
+                raise ValueError('crash')
+        with open('versions.gz', 'rb') as f:
+            assert f.read() == b'new'
+        assert sorted(os.listdir('.')) == ['versions.gz']
+
+        writer = AtomicWriter()
+        writer.write('versions.gz', b'newer')
+        writer.write('versions.sig', b'sig')
+        assert not os.path.exists('versions.sig')
+        writer.commit()
+        assert sorted(os.listdir('.')) == ['versions.gz', 'versions.sig']
+        with open('versions.sig', 'rb') as f:
+            assert f.read() == b'sig'
+
     def test_get_mac_app_dir(self):
         main = 'Main'
         path = os.path.join(main, 'Contents', 'MacOS', 'app')
@@ -82,6 +252,28 @@ class TestUtils(object):
         assert good_easy.get('test') is True
         assert good_easy.get('no-test') is None
 
+    def test_get_highest_version_channel(self):
+        easy = EasyAccessDict({
+            'latest': {'jms': {'mac': '0.2.0.1.1'}},
+            'channels': {'stable': {'jms': {'mac': '0.1.0.2.0'}},
+                         'beta': {'jms': {'mac': '0.2.0.1.1'}}},
+            })
+        assert get_highest_version('jms', 'mac', easy) == '0.2.0.1.1'
+        assert get_highest_version('jms', 'mac', easy,
+                                   'stable') == '0.1.0.2.0'
+        assert get_highest_version('jms', 'mac', easy,
+                                   'beta') == '0.2.0.1.1'
+        # No channel data. Beta latest isn't used by stable clients
+        legacy = EasyAccessDict({'latest': {'jms': {'mac': '0.2.0.1.1'}}})
+        assert get_highest_version('jms', 'mac', legacy, 'stable') is None
+        assert get_highest_version('jms', 'mac', legacy,
+                                   'alpha') == '0.2.0.1.1'
+
+    def test_version_channel(self):
+        assert Version('1.1').channel == 'stable'
+        assert Version('1.1b1').channel == 'beta'
+        assert Version('1.2.1a2').channel == 'alpha'
+
     def test_parse_platform(self):
         assert parse_platform('app-mac-0.1.0.tar.gz') == 'mac'
         assert parse_platform('app-win-1.0.0.zip') == 'win'
@@ -125,6 +317,15 @@ class TestUtils(object):
         assert p1.platform == 'mac'
         assert p1.info['status'] is True
 
+    def test_package_tar_formats(self):
+        for f in ['jms-mac-0.0.2.tar.bz2', 'jms-mac-0.0.2.tar.xz']:
+            with open(f, 'w') as f_:
+                f_.write('')
+            p = Package(f)
+            assert p.name == 'jms'
+            assert p.version == '0.0.2.2.0'
+            assert p.info['status'] is True
+
     def test_package_ignored_file(self):
         with open('.DS_Store', 'w') as f:
             f.write('')
@@ -221,3 +422,25 @@ class TestUtils(object):
         info['package'] = None
         p = Patch(info)
         assert p.ready is False
+
+
+class TestLazyImport(object):
+
+    def test_lazy_import(self):
+        calls = []
+
+        @lazy_import
+        def json():
+            calls.append(1)
+            import json
+            return json
+
+        import json as json_module
+        assert calls == []
+        assert json.dumps([1]) == '[1]'
+        assert calls == [1]
+        # The proxy sees the module's attributes directly after import
+        assert json.loads is json_module.loads
+        assert json.__name__ == 'json'
+        json.dumps([2])
+        assert calls == [1]
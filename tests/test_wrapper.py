@@ -15,7 +15,10 @@
 # --------------------------------------------------------------------------
 from __future__ import unicode_literals
 
+import json
 import os
+import subprocess
+import sys
 
 import pytest
 
@@ -191,3 +194,48 @@ class TestUpdateRepo(object):
         add_update_parser(subparser)
         opts, other = parser.parse_known_args(['update'])
         update(opts)
+
+
+# Imports pyupdater.wrapper in a new interpreter like the pyupdater
+# command does. Reports how long it took & what got loaded.
+IMPORT_COST = """
+import json, logging, sys, time
+import pyupdater
+handlers = len(logging.getLogger().handlers)
+start = time.time()
+import pyupdater.wrapper
+print(json.dumps({'seconds': time.time() - start,
+                  'modules': sorted(sys.modules),
+                  'handlers': len(logging.getLogger().handlers) - handlers}))
+"""
+
+# Seconds importing pyupdater.wrapper may take. Every pyupdater command
+# pays it, even --help. Loading PyInstaller or requests blows it.
+IMPORT_TIME_BUDGET = 0.5
+
+
+class TestImportCost(object):
+
+    def _import_cost(self):
+        cmd = [sys.executable, '-c', IMPORT_COST]
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+        out, err = p.communicate()
+        assert p.returncode == 0, err
+        return json.loads(out.decode('utf-8').strip().splitlines()[-1])
+
+    def test_import_time(self):
+        # Best of a few runs so a busy machine doesn't fail the test
+        data = min([self._import_cost() for _ in range(3)],
+                   key=lambda d: d['seconds'])
+        loaded = [m for m in data['modules'] if m.startswith('pyupdater')]
+        assert data['seconds'] < IMPORT_TIME_BUDGET, loaded
+
+    def test_lazy_imports(self):
+        data = self._import_cost()
+        for m in ['PyInstaller', 'requests', 'stevedore', 'appdirs',
+                  'pyupdater.wrapper.builder', 'pyupdater.package_handler',
+                  'pyupdater.uploader']:
+            assert m not in data['modules']
+        # Log handlers are added by main
+        assert data['handlers'] == 0